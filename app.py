@@ -1,44 +1,62 @@
 import os
-import logging
+import click
 from flask import Flask
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
 from sqlalchemy.orm import DeclarativeBase
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
-
 # Create database base class
 class Base(DeclarativeBase):
     pass
 
-# Initialize SQLAlchemy
+# Initialize SQLAlchemy; bound to each app by create_app()
 db = SQLAlchemy(model_class=Base)
 
-# Create Flask app
-app = Flask(__name__)
-
-# Set secret key from environment variable
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
-
-# Configure database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///crm.db")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-
-# Enable CORS
-CORS(app, resources={r"/*": {"origins": "*"}})
-
-# Initialize the app with the SQLAlchemy extension
-db.init_app(app)
-
-# Import routes after app initialization to avoid circular imports
-with app.app_context():
-    from routes import *
-    from models import *
-    
-    # Create all database tables
-    db.create_all()
+
+def create_app(config=None):
+    """
+    Build the CRM app; config overrides the defaults below. Nothing here
+    touches the database: run `flask --app app init-db` to create the tables.
+    """
+    app = Flask(__name__)
+
+    # Set secret key from environment variable
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+
+    # Configure database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///crm.db")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    if config:
+        app.config.update(config)
+
+    # Enable CORS
+    CORS(app, resources={r"/*": {"origins": "*"}})
+
+    # Initialize the app with the SQLAlchemy extension
+    db.init_app(app)
+
+    # Imported here to avoid circular imports
+    import models  # noqa: F401
+    from routes import register_routes
+    register_routes(app)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the database tables."""
+        db.create_all()
+        # Tables created before the timestamps were NOT NULL may still hold
+        # NULLs, which no pagination cursor can point at
+        db.session.execute(text(
+            'UPDATE lead SET created_at = COALESCE(created_at, updated_at, CURRENT_TIMESTAMP), '
+            'updated_at = COALESCE(updated_at, created_at, CURRENT_TIMESTAMP) '
+            'WHERE created_at IS NULL OR updated_at IS NULL'
+        ))
+        db.session.commit()
+        click.echo('Database tables ready')
+
+    return app
@@ -1,48 +1,135 @@
+import gc
 import os
 import logging
-from datetime import datetime
+import weakref
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from sqlalchemy.orm import DeclarativeBase
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Create base class for SQLAlchemy models
 class Base(DeclarativeBase):
     pass
 
-# Initialize SQLAlchemy
+# Initialize SQLAlchemy; bound to each app by create_app()
 db = SQLAlchemy(model_class=Base)
 
-# Create Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
-
-# Enable CORS
-CORS(app, resources={r"/*": {"origins": "*"}})
-
-# Configure database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-
-# Initialize the app with SQLAlchemy
-db.init_app(app)
-
-# Import routes after app is created to avoid circular imports
-with app.app_context():
-    # Import models and create tables
-    from backend.models import Lead, Note
-    db.create_all()
-    
-    # Import routes
-    from backend.routes import register_routes
-    register_routes(app)
-
-    logger.debug("Database tables created successfully")
+
+# Engines of every app built in this process; forked children start with
+# empty pools instead of sharing the parent's sockets
+_engines = weakref.WeakSet()
+
+# Set by prepare_for_fork() in a process that forks workers from its app
+_preforking = False
+
+
+def prepare_for_fork():
+    """
+    Call once, before create_app(), in a process that builds the app and
+    then forks workers from it (gunicorn --preload). The collector is
+    disabled so collections don't leave freed holes in pages the workers
+    will share, what exists is frozen right before each fork, and each
+    worker re-enables collection as it starts, so collections in the
+    workers never write to, and so copy, the shared pages.
+    """
+    global _preforking
+    _preforking = True
+    gc.disable()
+
+
+def _before_fork():
+    if _preforking:
+        gc.freeze()
+
+
+def _after_fork_in_child():
+    global _preforking
+    for engine in list(_engines):
+        # Leaves the parent's connections open for the parent
+        engine.dispose(close=False)
+    if _preforking:
+        # A worker that forks in turn must opt in again
+        _preforking = False
+        gc.enable()
+
+
+os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+
+
+def create_app(config=None):
+    """
+    Build the API app. config overrides the defaults below and those of
+    each extension.
+
+    Nothing here touches the database: the engine connects on first use,
+    and `flask db create` and `flask db upgrade` set up the tables,
+    triggers and derived indexes. Logging is left to the server or script
+    that runs the app.
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
+
+    # Configure database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    if config:
+        app.config.update(config)
+
+    # Enable CORS
+    CORS(app, resources={r"/*": {"origins": "*"}})
+
+    db.init_app(app)
+    with app.app_context():
+        _engines.update(db.engines.values())
+
+    with app.app_context():
+        # Map the models before anything queries them
+        from backend import models  # noqa: F401
+
+        from backend.migrations import init_migrations
+        init_migrations(app)
+
+        from backend.changes import init_changes
+        init_changes(app)
+
+        from backend.funnel import init_funnel
+        init_funnel(app)
+
+        from backend.phones import install_phone_sync
+        install_phone_sync()
+
+        from backend.dedup import init_dedup, install_block_key_sync
+        install_block_key_sync()
+        init_dedup(app)
+
+        from backend.cache import init_cache
+        init_cache(app)
+
+        from backend.events import init_events
+        init_events(app)
+
+        from backend.sms import init_sms
+        init_sms(app)
+
+        from backend.dispatcher import init_dispatcher
+        init_dispatcher(app)
+
+        from backend.metrics import init_metrics
+        init_metrics(app)
+
+        from backend.slow_queries import init_slow_queries
+        init_slow_queries(app)
+
+        from backend.profiler import init_profiler
+        init_profiler(app)
+
+        from backend.routes import register_routes
+        register_routes(app)
+
+    return app
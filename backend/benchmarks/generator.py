@@ -0,0 +1,124 @@
+"""
+Bulk-load deterministic synthetic leads, notes and tags for benchmarks.
+The same seed and size always produce the same rows.
+
+    DATABASE_URL=sqlite:///bench.db python -m backend.benchmarks.generator --leads 100000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+# Fixed so generated timestamps don't depend on when the run happens
+EPOCH = datetime(2024, 1, 1)
+
+# Rows per multi-row INSERT
+BATCH_SIZE = 10000
+
+TAG_NAMES = ('golf', 'ski', 'beach', 'vip', 'résumé', 'wave-1', 'wave-2', 'wave-3', 'spanish', 'callback')
+FIRST_NAMES = ('Ana', 'Bob', 'Chloé', 'Dev', 'Eve', 'Finn', 'Gus', 'Hana', 'Ivan', 'Jo')
+RESORTS = ('Sunset', 'Harbor', 'Pines', None)
+STATUSES = ('NEW', 'SENT', 'REPLIED', 'BOOKED')
+# Skewed towards the top of the funnel, like real campaigns
+STATUS_WEIGHTS = (60, 25, 10, 5)
+
+
+def lead_row(index, rng):
+    """
+    Column values for the index-th generated lead
+    """
+    created_at = EPOCH + timedelta(minutes=index)
+    return {
+        'first_name': rng.choice(FIRST_NAMES),
+        'last_name': f'Last{rng.randrange(50000)}',
+        'email': f'lead{index}@example.com',
+        'status': rng.choices(STATUSES, STATUS_WEIGHTS)[0],
+        'created_at': created_at,
+        'updated_at': created_at + timedelta(minutes=rng.randrange(10000)),
+        'address': f'{index} Main St',
+        'zip': f'{rng.randrange(100000):05d}',
+        'resort': rng.choice(RESORTS),
+        'mortgaged': rng.random() < 0.3,
+        'phone_1': f'417{rng.randrange(10 ** 7):07d}',
+        'phone_2': f'212{rng.randrange(10 ** 7):07d}' if rng.random() < 0.2 else None,
+    }
+
+
+def generate(db, leads, seed=1, notes_per_lead=0.5, tag_rate=0.3):
+    """
+    Bulk-load leads into an empty database, with on average notes_per_lead
+    notes each and a tag on tag_rate of them. Returns the row counts.
+    """
+    from sqlalchemy import insert
+    from backend.dedup import backfill_block_keys
+    from backend.models import Lead, LeadTag, Note, Tag
+    from backend.phones import backfill_phone_index
+
+    rng = random.Random(seed)
+    tag_ids = []
+    for name in TAG_NAMES:
+        tag = Tag(name=name)
+        db.session.add(tag)
+        db.session.flush()
+        tag_ids.append(tag.id)
+
+    whole_notes, extra_note_rate = divmod(notes_per_lead, 1)
+    counts = {'leads': 0, 'notes': 0, 'tags': 0}
+    for start in range(0, leads, BATCH_SIZE):
+        stop = min(start + BATCH_SIZE, leads)
+        rows = [lead_row(index, rng) for index in range(start, stop)]
+        db.session.execute(insert(Lead), rows)
+
+        # Generated leads get ids 1..leads in order on an empty table
+        notes, lead_tags = [], []
+        for lead_id in range(start + 1, stop + 1):
+            written_at = EPOCH + timedelta(minutes=lead_id)
+            for number in range(int(whole_notes) + (rng.random() < extra_note_rate)):
+                at = written_at + timedelta(hours=number)
+                notes.append({'lead_id': lead_id, 'content': f'Call {number} with lead {lead_id}',
+                              'created_at': at, 'updated_at': at})
+            if rng.random() < tag_rate:
+                for tag_id in rng.sample(tag_ids, rng.randrange(1, 4)):
+                    lead_tags.append({'lead_id': lead_id, 'tag_id': tag_id})
+        if notes:
+            db.session.execute(insert(Note), notes)
+        if lead_tags:
+            db.session.execute(insert(LeadTag), lead_tags)
+        db.session.commit()
+
+        counts['leads'] += len(rows)
+        counts['notes'] += len(notes)
+        counts['tags'] += len(lead_tags)
+
+    # Core inserts bypass the ORM hooks that maintain these
+    with db.engine.begin() as connection:
+        backfill_phone_index(connection)
+        backfill_block_keys(connection)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--leads', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--notes-per-lead', type=float, default=0.5)
+    parser.add_argument('--tag-rate', type=float, default=0.3)
+    args = parser.parse_args()
+
+    from backend.app import create_app, db
+    from backend.migrations import create_schema
+    from backend.models import Lead
+
+    app = create_app()
+    with app.app_context():
+        create_schema()
+        if db.session.query(Lead.id).first() is not None:
+            parser.error('the database already has leads; point DATABASE_URL at an empty one')
+        started = time.perf_counter()
+        counts = generate(db, args.leads, args.seed, args.notes_per_lead, args.tag_rate)
+        print(f"Loaded {counts['leads']} leads, {counts['notes']} notes and {counts['tags']} tag "
+              f"assignments in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+"""
+Drive the API with concurrent clients and report per-scenario latency
+percentiles and throughput as JSON, for comparing runs across commits.
+
+    python -m backend.benchmarks.load --leads 100000 --threads 8 --output after.json
+    python -m backend.benchmarks.load --leads 100000 --baseline before.json
+
+Requests go through the Flask test client, so the numbers cover routing,
+queries and serialization but not the network or the WSGI server.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from backend.benchmarks.generator import STATUSES, TAG_NAMES, generate
+
+PERCENTILES = (50, 95, 99)
+
+# Leads per request in the import scenario
+IMPORT_ROWS = 100
+
+
+class Context:
+    """
+    What the scenarios need to know about the loaded data
+    """
+
+    def __init__(self, leads):
+        self.leads = leads
+        # Unique emails for imported leads; next() on a count is atomic
+        self.sequence = itertools.count()
+
+
+def _random_lead_id(rng, context):
+    return rng.randrange(1, context.leads + 1)
+
+
+def list_leads(client, rng, context):
+    from backend.pagination import encode_cursor
+
+    # A random page, so the response cache doesn't answer every request
+    cursor = encode_cursor('id', [rng.randrange(context.leads)])
+    return client.get('/api/leads', query_string={'limit': 100, 'cursor': cursor})
+
+
+def filter_leads(client, rng, context):
+    return client.get('/api/leads', query_string={
+        'status': rng.choice(STATUSES),
+        'tag': rng.sample(TAG_NAMES, rng.randrange(1, 3)),
+        'tag_mode': rng.choice(('any', 'all')),
+        'limit': 100
+    })
+
+
+def patch_lead(client, rng, context):
+    return client.patch(f'/api/leads/{_random_lead_id(rng, context)}', json={'status': rng.choice(STATUSES)})
+
+
+def add_note(client, rng, context):
+    return client.post(f'/api/notes/{_random_lead_id(rng, context)}', json={'content': 'Benchmark follow-up call'})
+
+
+def import_leads(client, rng, context):
+    lines = ['first_name,last_name,email,zip,phone_1']
+    for _ in range(IMPORT_ROWS):
+        n = next(context.sequence)
+        lines.append(f'Bench,Import{n},bench{n}@example.net,{rng.randrange(100000):05d},'
+                     f'303{rng.randrange(10 ** 7):07d}')
+    return client.post('/api/leads/import?format=csv', data='\n'.join(lines).encode(), content_type='text/csv')
+
+
+SCENARIOS = {
+    'list': list_leads,
+    'filter': filter_leads,
+    'patch': patch_lead,
+    'note-add': add_note,
+    'import': import_leads,
+}
+
+
+def percentile(ordered, p):
+    """
+    Nearest-rank percentile of an ascending list
+    """
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies, errors, seconds):
+    ordered = sorted(latencies)
+    summary = {
+        'requests': len(ordered),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(len(ordered) / seconds, 1) if seconds else None,
+        'latency_ms': {},
+    }
+    if ordered:
+        summary['latency_ms'] = {f'p{p}': round(percentile(ordered, p) * 1000, 3) for p in PERCENTILES}
+        summary['latency_ms']['mean'] = round(sum(ordered) / len(ordered) * 1000, 3)
+        summary['latency_ms']['max'] = round(ordered[-1] * 1000, 3)
+    return summary
+
+
+def run_scenario(app, name, context, requests, threads, warmup, seed):
+    """
+    Issue requests of one scenario from threads concurrent clients; warmup
+    requests are sent first and not measured
+    """
+    scenario = SCENARIOS[name]
+
+    client = app.test_client()
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        scenario(client, rng, context)
+
+    tickets = itertools.count()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(index):
+        client = app.test_client()
+        rng = random.Random(f'{seed}-{name}-{index}')
+        measured, failed = [], 0
+        while next(tickets) < requests:
+            started = time.perf_counter()
+            response = scenario(client, rng, context)
+            measured.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(measured)
+            errors.append(failed)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return summarize(latencies, sum(errors), time.perf_counter() - started)
+
+
+def _git_commit():
+    def git(*command):
+        return subprocess.run(
+            ['git', *command], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    try:
+        commit = git('rev-parse', 'HEAD')
+        dirty = git('status', '--porcelain', '--untracked-files=no')
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, result):
+    """
+    Lines comparing each scenario's latency and throughput to a baseline run
+    """
+    lines = [f"{'scenario':>10} {'metric':>10} {'baseline':>10} {'current':>10} {'change':>8}"]
+    for name, current in result['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        pairs = [(f'p{p} ms', before['latency_ms'].get(f'p{p}'), current['latency_ms'].get(f'p{p}'))
+                 for p in PERCENTILES]
+        pairs.append(('rps', before['throughput_rps'], current['throughput_rps']))
+        for metric, old, new in pairs:
+            if old and new is not None:
+                lines.append(f'{name:>10} {metric:>10} {old:>10.1f} {new:>10.1f} {(new - old) / old:>+7.0%}')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--leads', type=int, default=10000, help='Leads to generate into a scratch database.')
+    parser.add_argument('--database-url', help='Benchmark an existing database instead; generated if empty.')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='Measured requests per scenario.')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout.')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against.')
+    args = parser.parse_args()
+    if args.requests < 1 or args.threads < 1:
+        parser.error('--requests and --threads must be positive')
+
+    database_url = args.database_url
+    if not database_url:
+        directory = tempfile.mkdtemp(prefix='lead-load-')
+        database_url = f'sqlite:///{directory}/load.db'
+    from backend.app import create_app, db
+    from backend.migrations import create_schema
+    from backend.models import Lead
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url})
+
+    with app.app_context():
+        create_schema()
+        if db.session.query(Lead.id).first() is None:
+            started = time.perf_counter()
+            generate(db, args.leads, seed=args.seed)
+            print(f'Generated {args.leads} leads in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+        leads = db.session.query(Lead.id).order_by(Lead.id.desc()).limit(1).scalar()
+        dialect = db.engine.dialect.name
+
+    import sqlalchemy
+    result = {
+        'meta': {
+            'commit': _git_commit(),
+            'started_at': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'dialect': dialect,
+            'leads': leads,
+            'requests': args.requests,
+            'threads': args.threads,
+            'seed': args.seed,
+        },
+        'scenarios': {},
+    }
+
+    context = Context(leads)
+    for name in args.scenarios:
+        summary = run_scenario(app, name, context, args.requests, args.threads, args.warmup, args.seed)
+        result['scenarios'][name] = summary
+        latency = summary['latency_ms']
+        print(f"{name:>10}: p50 {latency['p50']:.1f} ms  p95 {latency['p95']:.1f} ms  p99 {latency['p99']:.1f} ms  "
+              f"{summary['throughput_rps']} req/s  {summary['errors']} errors", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            for line in compare(json.load(f), result):
+                print(line, file=sys.stderr)
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark the lead list serialization paths: ORM objects + Lead.to_dict()
++ jsonify against row tuples + lead_payloads() + encode_json(), and check
+that both produce the same bytes.
+
+    python -m backend.benchmarks.serialization --rows 10000 100000
+"""
+import argparse
+import tempfile
+import time
+from backend.benchmarks.generator import generate
+
+
+def orm_body(rows, include):
+    from flask import jsonify
+    from backend.models import Lead
+    from backend.serialization import eager_load
+
+    leads = eager_load(Lead.query, include).order_by(Lead.id).limit(rows).all()
+    return jsonify({'success': True, 'data': [lead.to_dict(include=include) for lead in leads]}).get_data()
+
+
+def fast_body(rows, include):
+    from backend.models import Lead
+    from backend.serialization import encode_json, lead_payloads, lead_row_query
+
+    query, names = lead_row_query(include=include, extra=('id',))
+    result = query.order_by(Lead.id).limit(rows).all()
+    return encode_json({'success': True, 'data': lead_payloads(result, names, include)})
+
+
+def best_of(repeat, func, *args):
+    from backend.app import db
+
+    best, body = None, None
+    for _ in range(repeat):
+        # Start every run with an empty identity map
+        db.session.remove()
+        started = time.perf_counter()
+        body = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    # Always a scratch database
+    directory = tempfile.mkdtemp(prefix='lead-bench-')
+    from backend.app import create_app, db
+    from backend.migrations import create_schema
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory}/bench.db'})
+
+    with app.app_context():
+        create_schema()
+        generate(db, max(args.rows), seed=args.seed)
+
+    print(f"{'rows':>8} {'include':>16} {'orm ms':>10} {'fast ms':>10} {'speedup':>8}  identical")
+    for rows in args.rows:
+        for include in ((), ('tags', 'latest_note'), ('notes', 'tags')):
+            with app.test_request_context():
+                orm_seconds, orm = best_of(args.repeat, orm_body, rows, include)
+                fast_seconds, fast = best_of(args.repeat, fast_body, rows, include)
+            label = ','.join(include) or '-'
+            print(f'{rows:>8} {label:>16} {orm_seconds * 1000:>10.1f} {fast_seconds * 1000:>10.1f} '
+                  f'{orm_seconds / fast_seconds:>7.1f}x  {orm == fast}')
+
+
+if __name__ == '__main__':
+    main()
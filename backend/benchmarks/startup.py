@@ -0,0 +1,112 @@
+"""
+Measure how long a worker takes to come up: cold import, create_app() and
+first request in a fresh interpreter, against forking an app built in the
+parent, as gunicorn --preload does.
+
+    python -m backend.benchmarks.startup --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from backend.benchmarks.generator import generate
+
+# Run in a fresh interpreter; prints its phase timings as JSON
+FRESH_WORKER = """
+import json, sys, time
+started = time.perf_counter()
+from backend.app import create_app
+imported = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': sys.argv[1]})
+created = time.perf_counter()
+status = app.test_client().get('/api/leads', query_string={'limit': 1}).status_code
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - started,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'status': status,
+}))
+"""
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def fresh_worker(database_url):
+    """
+    Phase timings of one fresh interpreter, plus its wall time including
+    interpreter startup and exit
+    """
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', FRESH_WORKER, database_url],
+        cwd=PACKAGE_ROOT, capture_output=True, text=True, check=True
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['process'] = time.perf_counter() - started
+    if timings.pop('status') != 200:
+        raise RuntimeError('fresh worker could not serve /api/leads')
+    return timings
+
+
+def forked_worker(app):
+    """
+    Wall time to fork a preloaded app, serve a first request in the child
+    and reap it
+    """
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            response = app.test_client().get('/api/leads', query_string={'limit': 1})
+            code = 0 if response.status_code == 200 else 1
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    elapsed = time.perf_counter() - started
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError('forked worker could not serve /api/leads')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--leads', type=int, default=1000)
+    args = parser.parse_args()
+    if args.runs < 1:
+        parser.error('--runs must be positive')
+
+    directory = tempfile.mkdtemp(prefix='lead-startup-')
+    database_url = f'sqlite:///{directory}/startup.db'
+
+    from backend.app import create_app, db, prepare_for_fork
+    from backend.migrations import create_schema
+    if hasattr(os, 'fork'):
+        prepare_for_fork()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': database_url})
+    with app.app_context():
+        create_schema()
+        generate(db, args.leads)
+
+    fresh = [fresh_worker(database_url) for _ in range(args.runs)]
+    forked = []
+    if hasattr(os, 'fork'):
+        forked = [forked_worker(app) for _ in range(args.runs)]
+
+    print(f"{'phase':>28} {'median ms':>10} {'min ms':>10}")
+    rows = [(f'fresh: {phase}', [timings[phase] for timings in fresh])
+            for phase in ('import', 'create_app', 'first_request', 'process')]
+    if forked:
+        rows.append(('preloaded: fork + request', forked))
+    for label, seconds in rows:
+        print(f'{label:>28} {statistics.median(seconds) * 1000:>10.1f} {min(seconds) * 1000:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
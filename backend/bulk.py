@@ -0,0 +1,160 @@
+import json
+from datetime import datetime
+from sqlalchemy import delete, func, insert, literal, select, update
+from backend.app import db
+from backend.changes import change_seq_stamp
+from backend.filters import lead_filter_clauses
+from backend.funnel import counted_status_change
+from backend.models import LEAD_STATUSES, Lead, LeadTag, Tag
+
+# Explicit id lists are applied in chunks to stay under driver bind limits
+ID_CHUNK_SIZE = 10000
+
+# Longest tag name, as stored in Tag.name
+MAX_TAG_LENGTH = 100
+
+
+class BulkUpdateError(ValueError):
+    """
+    Raised when a bulk update request is malformed
+    """
+
+
+def update_leads(criteria, values):
+    """
+    Run one UPDATE lead ... WHERE criteria and return the affected ids.
+    The caller commits.
+    """
+    statement = update(Lead).where(*criteria).values(**values)
+    if db.engine.dialect.update_returning:
+        rows = db.session.execute(
+            statement.returning(Lead.id),
+            execution_options={'synchronize_session': False}
+        )
+        return [lead_id for (lead_id,) in rows]
+
+    # No UPDATE ... RETURNING: collect the ids first, in the same transaction
+    ids = [lead_id for (lead_id,) in db.session.execute(select(Lead.id).where(*criteria))]
+    if ids:
+        db.session.execute(
+            update(Lead).where(Lead.id.in_(ids)).values(**values),
+            execution_options={'synchronize_session': False}
+        )
+    return ids
+
+
+def _id_clause(ids):
+    if db.engine.dialect.name == 'sqlite':
+        # One JSON bind rather than an IN list SQLAlchemy expands into
+        # thousands of parameters for every statement that uses the chunk
+        chunk = func.json_each(json.dumps(ids)).table_valued('value')
+        return Lead.id.in_(select(chunk.c.value))
+    return Lead.id.in_(ids)
+
+
+def _lead_selections(ids, filter_spec):
+    """
+    Criteria lists selecting the leads of a bulk request: one per chunk of
+    an explicit id list, or the filter alone
+    """
+    criteria = lead_filter_clauses(filter_spec or {})
+    if ids is None and not criteria:
+        raise BulkUpdateError('Provide ids or a non-empty filter')
+
+    if ids is None:
+        return [criteria]
+
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        raise BulkUpdateError('ids must be a list of integers')
+
+    unique_ids = sorted(set(ids))
+    return [
+        criteria + [_id_clause(unique_ids[start:start + ID_CHUNK_SIZE])]
+        for start in range(0, len(unique_ids), ID_CHUNK_SIZE)
+    ]
+
+
+def bulk_update_status(status, ids=None, filter_spec=None):
+    """
+    Move every matching lead to status with set-based UPDATEs.
+
+    Leads are selected by an explicit id list, a filter spec (see
+    lead_filter_clauses) or both. updated_at is bumped on every affected row.
+    Returns the sorted list of affected lead ids; the caller commits.
+    """
+    status = str(status or '').upper()
+    if status not in LEAD_STATUSES:
+        raise BulkUpdateError(f"status must be one of: {', '.join(LEAD_STATUSES)}")
+
+    selections = _lead_selections(ids, filter_spec)
+    values = {'status': status, 'updated_at': datetime.utcnow(), **change_seq_stamp()}
+
+    affected = []
+    for criteria in selections:
+        with counted_status_change(criteria, status):
+            affected.extend(update_leads(criteria, values))
+    return sorted(affected)
+
+
+def _tag_names(names, key):
+    if names is None:
+        return []
+    if not isinstance(names, list) or not all(isinstance(name, str) and name.strip() for name in names):
+        raise BulkUpdateError(f'{key} must be a list of tag names')
+    names = sorted({name.strip() for name in names})
+    if any(len(name) > MAX_TAG_LENGTH for name in names):
+        raise BulkUpdateError(f'Tag names must be at most {MAX_TAG_LENGTH} characters')
+    return names
+
+
+def _tag_ids(names, create=False):
+    """
+    Ids of the named tags, creating the missing ones when create is set
+    """
+    if not names:
+        return []
+    found = dict(db.session.execute(select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+    missing = [name for name in names if name not in found]
+    if create and missing:
+        db.session.execute(insert(Tag), [{'name': name} for name in missing])
+        found.update(db.session.execute(select(Tag.name, Tag.id).where(Tag.name.in_(missing))).all())
+    return sorted(found.values())
+
+
+def bulk_update_tags(add=None, remove=None, ids=None, filter_spec=None):
+    """
+    Add and remove tags by name on every matching lead, selected as in
+    bulk_update_status, with one INSERT ... SELECT per added tag and one
+    DELETE per selection. Tags being added are created if needed; leads
+    already carrying a tag are left alone.
+
+    Returns {'added': n, 'removed': n} counted in lead_tag rows; the caller
+    commits.
+    """
+    add = _tag_names(add, 'add')
+    remove = _tag_names(remove, 'remove')
+    if not add and not remove:
+        raise BulkUpdateError('Provide tags to add or remove')
+    both = sorted(set(add) & set(remove))
+    if both:
+        raise BulkUpdateError(f"Tags both added and removed: {', '.join(both)}")
+
+    selections = _lead_selections(ids, filter_spec)
+    remove_ids = _tag_ids(remove)
+    add_ids = _tag_ids(add, create=True)
+
+    added = removed = 0
+    for criteria in selections:
+        leads = select(Lead.id).where(*criteria)
+        if remove_ids:
+            removed += db.session.execute(
+                delete(LeadTag).where(LeadTag.tag_id.in_(remove_ids)).where(LeadTag.lead_id.in_(leads)),
+                execution_options={'synchronize_session': False}
+            ).rowcount
+        for tag_id in add_ids:
+            tagged = select(LeadTag.id).where(LeadTag.lead_id == Lead.id).where(LeadTag.tag_id == tag_id)
+            untagged = select(Lead.id, literal(tag_id)).where(*criteria).where(~tagged.exists())
+            added += db.session.execute(
+                insert(LeadTag).from_select(['lead_id', 'tag_id'], untagged)
+            ).rowcount
+    return {'added': added, 'removed': removed}
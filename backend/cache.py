@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults for the lead list response cache; override in app.config
+DEFAULT_CACHE_CONFIG = {
+    # 'lru' is per process, which is safe with several workers because keys
+    # carry the lead table version; 'shared' is a stand-in for a networked store
+    'RESPONSE_CACHE_BACKEND': 'lru',
+    'RESPONSE_CACHE_MAX_ENTRIES': 1024,
+    'RESPONSE_CACHE_TTL': 300,
+}
+
+
+class CacheBackend:
+    """
+    Storage interface for ResponseCache: get/set of response bodies
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class LRUCacheBackend(CacheBackend):
+    """
+    In-process LRU store with per-entry expiry
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'evictions': self.evictions
+            }
+
+
+class SharedCacheBackend(LRUCacheBackend):
+    """
+    Local stand-in for a shared store such as Redis or memcached: one
+    instance per process, shared by every app in it, holding only bytes.
+    It does not share anything between worker processes; a networked
+    CacheBackend would, which only saves misses, since keys carry the lead
+    table version either way.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def instance(cls, max_entries):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(max_entries)
+            return cls._instance
+
+    def set(self, key, value, ttl):
+        if not isinstance(value, bytes):
+            raise TypeError('Shared cache values must be bytes')
+        super().set(key, value, ttl)
+
+
+# Backend factories by name
+CACHE_BACKENDS = {
+    'lru': LRUCacheBackend,
+    'shared': SharedCacheBackend.instance,
+}
+
+
+class ResponseCache:
+    """
+    Cache of serialized lead list responses.
+
+    Every key carries the lead table version, which any committed write to
+    leads, notes or tags changes, so no process can serve a body older than
+    the ETag it sends with it and writers never have to invalidate
+    anything. Entries for older versions are simply never asked for again
+    and age out of the LRU.
+    """
+
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(version, variant):
+        """
+        Cache key for one representation (query string) of the lead list at
+        a lead table version. Read the version before running the query, so
+        a concurrent write can only make the key older than the body.
+        """
+        return f'leads:v{version}:{variant}'
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value, self.ttl)
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                'hits': self.hits,
+                'misses': self.misses
+            }
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_ratio'] = counters['hits'] / lookups if lookups else 0.0
+        counters.update(self.backend.stats())
+        return counters
+
+
+def init_cache(app):
+    """
+    Attach the lead list response cache to the app
+    """
+    for key, value in DEFAULT_CACHE_CONFIG.items():
+        app.config.setdefault(key, value)
+    backend = CACHE_BACKENDS[app.config['RESPONSE_CACHE_BACKEND']](app.config['RESPONSE_CACHE_MAX_ENTRIES'])
+    cache = ResponseCache(backend, app.config['RESPONSE_CACHE_TTL'])
+    app.extensions['response_cache'] = cache
+    return cache
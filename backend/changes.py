@@ -0,0 +1,167 @@
+import logging
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import delete, func, select, text, tuple_, update
+from backend.app import db
+from backend.models import Lead, LeadTombstone, TableVersion
+from backend.pagination import PaginationError, decode_cursor, encode_cursor
+from backend.serialization import eager_load
+from backend.versioning import current_version
+
+logger = logging.getLogger(__name__)
+
+# Counter whose value stamps lead.change_seq on SQLite, where writes are
+# serialized anyway; PostgreSQL stamps the writing transaction's id instead
+# (migration 0009), so concurrent writers don't queue on the counter row
+SEQUENCE = 'lead'
+
+# table_version row holding the highest change_seq pruned from lead_tombstone
+TOMBSTONE_FLOOR = 'lead_tombstone_floor'
+
+# Tombstones older than this are pruned by `flask prune-tombstones`
+DEFAULT_TOMBSTONE_RETENTION_DAYS = 30
+
+class SyncTokenExpired(Exception):
+    """
+    Raised when a since token predates the retained tombstones, so deletes
+    may have been missed and the client must resync from scratch
+    """
+
+
+def change_seq_stamp():
+    """
+    Extra values for a set-based UPDATE of lead that stamp change_seq in
+    the same row write. On SQLite the row trigger would otherwise restamp
+    every updated row with a second UPDATE; here the counter is bumped once
+    and the trigger skips rows whose change_seq the statement set.
+    PostgreSQL's BEFORE ROW trigger already stamps the row being written.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return {}
+    db.session.execute(
+        update(TableVersion)
+        .where(TableVersion.name == SEQUENCE)
+        .values(version=TableVersion.version + 1)
+    )
+    return {'change_seq': select(TableVersion.version).where(TableVersion.name == SEQUENCE).scalar_subquery()}
+
+
+def change_watermark():
+    """
+    Highest change_seq at or below which every write has finished. On
+    PostgreSQL that is just below the oldest transaction still running,
+    which may commit after younger ones with higher stamps.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return db.session.execute(text('SELECT lead_change_watermark()')).scalar()
+    return current_version(SEQUENCE)
+
+
+def _tombstone_floor():
+    return db.session.execute(
+        select(TableVersion.version).where(TableVersion.name == TOMBSTONE_FLOOR)
+    ).scalar() or 0
+
+
+def _changed_after(model, cursor, watermark, limit):
+    """
+    Keyset query for rows changed after cursor, up to the watermark, with
+    one row of lookahead
+    """
+    columns = (model.change_seq, model.id)
+    return (
+        select(model)
+        .where(tuple_(*columns) > tuple_(*cursor))
+        .where(model.change_seq <= watermark)
+        .order_by(*columns)
+        .limit(limit + 1)
+    )
+
+
+def _fetch_page(query, watermark, limit):
+    """
+    Returns (rows, next_cursor, has_more)
+    """
+    rows = db.session.execute(query).scalars().all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, [rows[-1].change_seq, rows[-1].id], True
+    # Everything up to the watermark has been seen
+    return rows, [watermark + 1, 0], False
+
+
+def lead_changes(since, limit, include=()):
+    """
+    Leads created or updated, and ids of leads deleted, after the since
+    token (None for a full sync).
+
+    Returns (changed_leads, deleted_ids, next_token, has_more). Each page
+    costs two index range scans over the rows that changed, however large
+    the lead table is.
+    """
+    # Read the watermark first: every write at or below it has committed
+    watermark = change_watermark()
+
+    if since:
+        values = decode_cursor(since, 'changes')
+        if len(values) != 4:
+            raise PaginationError('Invalid cursor')
+        lead_cursor, tombstone_cursor = values[:2], values[2:]
+        if tombstone_cursor[0] <= _tombstone_floor():
+            raise SyncTokenExpired('since token has expired; resync without since')
+    else:
+        # A full sync has nothing to delete
+        lead_cursor, tombstone_cursor = [0, 0], [watermark + 1, 0]
+
+    lead_query = eager_load(_changed_after(Lead, lead_cursor, watermark, limit), include)
+    leads, lead_cursor, more_leads = _fetch_page(lead_query, watermark, limit)
+
+    tombstone_query = _changed_after(LeadTombstone, tombstone_cursor, watermark, limit)
+    tombstones, tombstone_cursor, more_tombstones = _fetch_page(tombstone_query, watermark, limit)
+
+    deleted_ids = []
+    if tombstones:
+        # A reused id belongs to a live lead again; don't tell clients to drop it
+        candidates = {tombstone.lead_id for tombstone in tombstones}
+        live = set(db.session.execute(select(Lead.id).where(Lead.id.in_(candidates))).scalars())
+        deleted_ids = sorted(candidates - live)
+
+    next_token = encode_cursor('changes', lead_cursor + tombstone_cursor)
+    return leads, deleted_ids, next_token, more_leads or more_tombstones
+
+
+def prune_tombstones(retention_days=DEFAULT_TOMBSTONE_RETENTION_DAYS):
+    """
+    Delete tombstones older than retention_days and raise the floor below
+    which since tokens are rejected. Returns the number deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    highest = db.session.execute(
+        select(func.max(LeadTombstone.change_seq)).where(LeadTombstone.deleted_at < cutoff)
+    ).scalar()
+    if highest is None:
+        return 0
+
+    result = db.session.execute(delete(LeadTombstone).where(LeadTombstone.change_seq <= highest))
+    floor = db.session.execute(
+        update(TableVersion)
+        .where(TableVersion.name == TOMBSTONE_FLOOR)
+        .where(TableVersion.version < highest)
+        .values(version=highest)
+    )
+    if floor.rowcount == 0 and db.session.get(TableVersion, TOMBSTONE_FLOOR) is None:
+        db.session.add(TableVersion(name=TOMBSTONE_FLOOR, version=highest))
+    db.session.commit()
+    return result.rowcount
+
+
+def init_changes(app):
+    """
+    Register the `flask prune-tombstones` command
+    """
+    @app.cli.command('prune-tombstones')
+    @click.option('--days', default=DEFAULT_TOMBSTONE_RETENTION_DAYS, show_default=True,
+                  help='Keep tombstones newer than this many days.')
+    def prune_tombstones_command(days):
+        """Delete old lead tombstones."""
+        click.echo(f'Pruned {prune_tombstones(days)} tombstones')
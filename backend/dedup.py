@@ -0,0 +1,402 @@
+import logging
+import re
+import time
+from collections import defaultdict
+from itertools import combinations
+import click
+from flask import current_app
+from sqlalchemy import delete, event, func, insert, inspect, or_, select, update
+from backend.app import db
+from backend.models import Lead, LeadBlockKey, LeadDuplicate, LeadPhone, LeadTag, Note
+from backend.phones import PHONE_COLUMNS, normalize_phone, normalized_phones
+
+logger = logging.getLogger(__name__)
+
+# Defaults for duplicate detection; override in app.config
+DEFAULT_DEDUP_CONFIG = {
+    # Pairs scoring below this are not recorded
+    'DEDUP_THRESHOLD': 0.5,
+    # Keys shared by more leads than this (an office switchboard, 'info@')
+    # say nothing about identity and are skipped rather than compared
+    'DEDUP_MAX_BLOCK_SIZE': 50,
+}
+
+# Score each kind of evidence adds to a pair; the total is capped at 1
+WEIGHTS = {
+    'phone': 0.5,
+    'email_local': 0.3,
+    'name_zip': 0.3,
+    'first_name': 0.2,
+    'first_initial': 0.1,
+    'address': 0.15,
+}
+
+# Lead columns the blocking keys are derived from
+KEY_COLUMNS = ('last_name', 'zip', 'email')
+
+# Columns a merge copies from the merged lead when the kept lead has none
+MERGE_FILL_FIELDS = (
+    'address', 'zip', 'resort', 'last_text_sent', 'last_text_content', 'last_response', 'response_timestamp'
+)
+
+# Candidate pairs scored per round-trip, and ids / keys per IN list
+SCORE_CHUNK_SIZE = 5000
+IN_CHUNK_SIZE = 1000
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+_PROFILE_COLUMNS = (Lead.id, Lead.first_name, Lead.address) + tuple(
+    getattr(Lead, column) for column in KEY_COLUMNS + PHONE_COLUMNS
+)
+
+
+class DedupError(ValueError):
+    """
+    Raised when a merge request is invalid
+    """
+
+
+def _config(name):
+    return current_app.config.get(name, DEFAULT_DEDUP_CONFIG[name])
+
+
+def _normalize(value):
+    return _NON_ALNUM.sub('', str(value or '').lower())
+
+
+def email_local_part(email):
+    """
+    The mailbox part of an email, lowercased, without a +suffix and
+    punctuation, so 'J.Smith+ads@x.com' and 'jsmith@y.org' match
+    """
+    local = str(email or '').lower().split('@', 1)[0].split('+', 1)[0]
+    return _normalize(local)
+
+
+def blocking_keys(last_name, zip_code, email):
+    """
+    Blocking keys stored in lead_block_key; phones block through lead_phone
+    """
+    keys = []
+    name, zip5 = _normalize(last_name), _normalize(zip_code)[:5]
+    if name and zip5:
+        keys.append(f'name_zip:{name}|{zip5}')
+    local = email_local_part(email)
+    # Very short mailboxes ('jo', 'a') collide by chance
+    if len(local) >= 3:
+        keys.append(f'email_local:{local}')
+    return keys
+
+
+def _sync_block_keys(lead):
+    """
+    Reconcile lead.block_keys with the lead's columns, keeping unchanged rows
+    """
+    wanted = blocking_keys(lead.last_name, lead.zip, lead.email)
+    for row in list(lead.block_keys):
+        if row.key in wanted:
+            wanted.remove(row.key)
+        else:
+            lead.block_keys.remove(row)
+    for key in wanted:
+        lead.block_keys.append(LeadBlockKey(key=key))
+
+
+def _keys_changed(lead):
+    state = inspect(lead)
+    return any(state.attrs[column].history.has_changes() for column in KEY_COLUMNS)
+
+
+def _before_flush(session, flush_context, instances):
+    for lead in session.new:
+        if isinstance(lead, Lead):
+            _sync_block_keys(lead)
+    for lead in session.dirty:
+        if isinstance(lead, Lead) and _keys_changed(lead):
+            _sync_block_keys(lead)
+
+
+def install_block_key_sync():
+    """
+    Keep lead_block_key in step with every ORM insert or update of a lead.
+    Core bulk inserts bypass the ORM and must call index_block_keys_for_emails.
+    """
+    if not event.contains(db.session, 'before_flush', _before_flush):
+        event.listen(db.session, 'before_flush', _before_flush)
+
+
+def _key_rows(lead_rows):
+    rows = []
+    for lead_id, last_name, zip_code, email in lead_rows:
+        rows.extend({'lead_id': lead_id, 'key': key} for key in blocking_keys(last_name, zip_code, email))
+    return rows
+
+
+def index_block_keys_for_emails(emails):
+    """
+    Write the blocking keys of freshly bulk-inserted leads, found by email
+    with one IN query, using one multi-row INSERT. Returns the leads' ids;
+    the caller commits.
+    """
+    lead_rows = db.session.execute(
+        select(Lead.id, Lead.last_name, Lead.zip, Lead.email).where(Lead.email.in_(emails))
+    ).all()
+    rows = _key_rows(lead_rows)
+    if rows:
+        db.session.execute(insert(LeadBlockKey), rows)
+    return [lead_id for lead_id, *_ in lead_rows]
+
+
+def backfill_block_keys(connection, batch_size=10000):
+    """
+    Populate lead_block_key from the lead table when it is empty; run by
+    migration 0008 for leads written before it was introduced. On an
+    autocommit connection, such as the migration's, each batch commits as
+    it goes.
+    """
+    if connection.execute(select(LeadBlockKey.id).limit(1)).first() is not None:
+        return
+
+    last_id = 0
+    indexed = 0
+    while True:
+        lead_rows = connection.execute(
+            select(Lead.id, Lead.last_name, Lead.zip, Lead.email)
+            .where(Lead.id > last_id).order_by(Lead.id).limit(batch_size)
+        ).all()
+        if not lead_rows:
+            break
+        last_id = lead_rows[-1][0]
+        rows = _key_rows(lead_rows)
+        if rows:
+            connection.execute(insert(LeadBlockKey), rows)
+            indexed += len(rows)
+    logger.debug(f"Backfilled {indexed} lead blocking keys")
+
+
+def _chunks(values, size=IN_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _profiles(lead_ids):
+    """
+    The normalized attributes scoring compares, by lead id
+    """
+    profiles = {}
+    for chunk in _chunks(lead_ids):
+        for row in db.session.execute(select(*_PROFILE_COLUMNS).where(Lead.id.in_(chunk))):
+            profiles[row.id] = {
+                'first_name': _normalize(row.first_name),
+                'address': _normalize(row.address),
+                'phones': set(normalized_phones(getattr(row, column) for column in PHONE_COLUMNS)),
+                'keys': set(blocking_keys(row.last_name, row.zip, row.email)),
+            }
+    return profiles
+
+
+def score_pair(a, b):
+    """
+    Score two lead profiles; returns (score, reasons)
+    """
+    reasons = []
+    if a['phones'] & b['phones']:
+        reasons.append('phone')
+    shared_kinds = {key.split(':', 1)[0] for key in a['keys'] & b['keys']}
+    reasons.extend(kind for kind in ('email_local', 'name_zip') if kind in shared_kinds)
+    if a['first_name'] and a['first_name'] == b['first_name']:
+        reasons.append('first_name')
+    elif a['first_name'][:1] and a['first_name'][:1] == b['first_name'][:1]:
+        reasons.append('first_initial')
+    if a['address'] and a['address'] == b['address']:
+        reasons.append('address')
+    return min(1.0, round(sum(WEIGHTS[reason] for reason in reasons), 3)), reasons
+
+
+def _score_and_store(pairs, threshold):
+    """
+    Score candidate (low_id, high_id) pairs in chunks and insert those at or
+    above threshold. Returns the number recorded; the caller commits.
+    """
+    recorded = 0
+    for chunk in _chunks(pairs, SCORE_CHUNK_SIZE):
+        profiles = _profiles({lead_id for pair in chunk for lead_id in pair})
+        rows = []
+        for lead_id, duplicate_id in chunk:
+            if lead_id not in profiles or duplicate_id not in profiles:
+                continue
+            score, reasons = score_pair(profiles[lead_id], profiles[duplicate_id])
+            if score >= threshold:
+                rows.append({'lead_id': lead_id, 'duplicate_id': duplicate_id, 'score': score, 'reasons': reasons})
+        if rows:
+            db.session.execute(insert(LeadDuplicate), rows)
+            recorded += len(rows)
+    return recorded
+
+
+def _block_sources():
+    # (key column, lead id column); both tables are indexed on (key, lead_id)
+    return ((LeadPhone.phone, LeadPhone.lead_id), (LeadBlockKey.key, LeadBlockKey.lead_id))
+
+
+def _add_block_pairs(block, candidates):
+    for pair in combinations(sorted(set(block)), 2):
+        candidates.add(pair)
+
+
+def find_duplicates(threshold=None, max_block_size=None):
+    """
+    Rebuild lead_duplicate from scratch.
+
+    Only leads sharing a blocking key (normalized phone, last name + zip,
+    email mailbox) are compared, and keys shared by more than
+    max_block_size leads are skipped, so the work grows with the number of
+    near-matches rather than with the square of the table. Blocks are read
+    with index-ordered scans of lead_phone and lead_block_key.
+    """
+    threshold = _config('DEDUP_THRESHOLD') if threshold is None else threshold
+    max_block_size = _config('DEDUP_MAX_BLOCK_SIZE') if max_block_size is None else max_block_size
+    started = time.monotonic()
+
+    candidates = set()
+    for key_column, lead_column in _block_sources():
+        shared = (
+            select(key_column).group_by(key_column)
+            .having(func.count() > 1).having(func.count() <= max_block_size)
+        )
+        rows = db.session.execute(
+            select(key_column, lead_column).where(key_column.in_(shared)).order_by(key_column),
+            execution_options={'yield_per': 10000}
+        )
+        current, block = None, []
+        for key, lead_id in rows:
+            if key != current:
+                _add_block_pairs(block, candidates)
+                current, block = key, []
+            block.append(lead_id)
+        _add_block_pairs(block, candidates)
+
+    db.session.execute(delete(LeadDuplicate))
+    recorded = _score_and_store(sorted(candidates), threshold)
+    db.session.commit()
+
+    return {
+        'candidates': len(candidates),
+        'duplicates': recorded,
+        'seconds': round(time.monotonic() - started, 3)
+    }
+
+
+def detect_duplicates(lead_ids):
+    """
+    Record duplicates of the given (usually just written) leads against the
+    whole table, with index probes on their blocking keys. Returns the
+    number of new pairs; the caller commits.
+    """
+    lead_ids = set(lead_ids)
+    if not lead_ids:
+        return 0
+    max_block_size = _config('DEDUP_MAX_BLOCK_SIZE')
+
+    profiles = _profiles(lead_ids)
+    keys_by_source = (
+        {phone for profile in profiles.values() for phone in profile['phones']},
+        {key for profile in profiles.values() for key in profile['keys']},
+    )
+
+    candidates = set()
+    for (key_column, lead_column), keys in zip(_block_sources(), keys_by_source):
+        for chunk in _chunks(keys):
+            small = (
+                select(key_column).where(key_column.in_(chunk))
+                .group_by(key_column).having(func.count() <= max_block_size)
+            )
+            blocks = defaultdict(list)
+            for key, lead_id in db.session.execute(select(key_column, lead_column).where(key_column.in_(small))):
+                blocks[key].append(lead_id)
+            for block in blocks.values():
+                for new_id in lead_ids.intersection(block):
+                    candidates.update((min(new_id, other), max(new_id, other)) for other in block if other != new_id)
+
+    for chunk in _chunks(lead_ids):
+        candidates.difference_update(db.session.execute(
+            select(LeadDuplicate.lead_id, LeadDuplicate.duplicate_id)
+            .where(or_(LeadDuplicate.lead_id.in_(chunk), LeadDuplicate.duplicate_id.in_(chunk)))
+        ).tuples())
+
+    return _score_and_store(sorted(candidates), _config('DEDUP_THRESHOLD'))
+
+
+def merge_leads(keep_id, merge_id):
+    """
+    Merge lead merge_id into keep_id: its notes and tags move to the kept
+    lead, blank fields and free phone slots of the kept lead are filled from
+    it, and the merged lead is deleted.
+
+    Returns (kept_lead, moved_notes, moved_tags), or None if either lead
+    doesn't exist. The caller commits.
+    """
+    if keep_id == merge_id:
+        raise DedupError('Cannot merge a lead into itself')
+    keep = db.session.get(Lead, keep_id)
+    merge = db.session.get(Lead, merge_id)
+    if keep is None or merge is None:
+        return None
+
+    for field in MERGE_FILL_FIELDS:
+        if getattr(keep, field) in (None, '') and getattr(merge, field) not in (None, ''):
+            setattr(keep, field, getattr(merge, field))
+
+    known = normalized_phones(getattr(keep, column) for column in PHONE_COLUMNS)
+    free = [column for column in PHONE_COLUMNS if not getattr(keep, column)]
+    for raw in (getattr(merge, column) for column in PHONE_COLUMNS):
+        phone = normalize_phone(raw)
+        if phone and phone not in known and free:
+            setattr(keep, free.pop(0), raw)
+            known.append(phone)
+
+    moved_notes = db.session.execute(
+        update(Note).where(Note.lead_id == merge_id).values(lead_id=keep_id),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    moved_tags = db.session.execute(
+        update(LeadTag)
+        .where(LeadTag.lead_id == merge_id)
+        .where(LeadTag.tag_id.not_in(select(LeadTag.tag_id).where(LeadTag.lead_id == keep_id)))
+        .values(lead_id=keep_id),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.execute(delete(LeadTag).where(LeadTag.lead_id == merge_id))
+    db.session.execute(delete(LeadDuplicate).where(
+        or_(LeadDuplicate.lead_id == merge_id, LeadDuplicate.duplicate_id == merge_id)
+    ))
+
+    # The collections were emptied behind the ORM's back
+    db.session.expire(keep, ['notes', 'tags', 'latest_note'])
+    db.session.expire(merge, ['notes', 'tags'])
+    db.session.delete(merge)
+    db.session.flush()
+
+    # Filled-in fields can make the kept lead match others
+    detect_duplicates([keep_id])
+    return keep, moved_notes, moved_tags
+
+
+def init_dedup(app):
+    """
+    Apply the dedup defaults and register the `flask find-duplicates` batch job
+    """
+    for key, value in DEFAULT_DEDUP_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.cli.command('find-duplicates')
+    @click.option('--threshold', type=float, help='Minimum score to record.')
+    @click.option('--max-block-size', type=int, help='Skip keys shared by more leads than this.')
+    def find_duplicates_command(threshold, max_block_size):
+        """Rebuild the table of likely duplicate leads."""
+        stats = find_duplicates(threshold, max_block_size)
+        click.echo(
+            f"Found {stats['duplicates']} duplicate pairs among {stats['candidates']} "
+            f"candidates in {stats['seconds']}s"
+        )
@@ -0,0 +1,519 @@
+import logging
+import string
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import and_, bindparam, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from backend.app import db
+from backend.bulk import update_leads
+from backend.filters import lead_filter_clauses
+from backend.models import Campaign, CampaignMessage, Lead, RateLimitBucket
+from backend.phones import PHONE_COLUMNS, normalized_phones
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the outbound dispatcher; override in app.config
+DEFAULT_DISPATCH_CONFIG = {
+    'DISPATCH_PROVIDER': 'stub',
+    # Messages per second across every worker process
+    'DISPATCH_RATE': 100.0,
+    # Messages per second per sending number; None disables the per-number limit
+    'DISPATCH_PER_NUMBER_RATE': None,
+    'DISPATCH_FROM_NUMBERS': ['+15550000000'],
+    # 'database' buckets are shared by every process; 'local' buckets limit
+    # only their own process, so use them with a single worker
+    'DISPATCH_RATE_BACKEND': 'database',
+    'DISPATCH_BATCH_SIZE': 100,
+    # Provider calls in flight at once per campaign run
+    'DISPATCH_CONCURRENCY': 32,
+    # Claimed messages not stamped within this many seconds are picked up again
+    'DISPATCH_LEASE_SECONDS': 300,
+}
+
+# Lead fields available to message templates as $name / ${name}
+TEMPLATE_FIELDS = ('first_name', 'last_name', 'email', 'address', 'zip', 'resort')
+
+# Batch latencies kept per run for the percentile report
+MAX_LATENCY_SAMPLES = 1000
+
+
+class DispatchError(ValueError):
+    """
+    Raised when a campaign definition is invalid
+    """
+
+
+class SmsProvider:
+    """
+    Outbound SMS provider interface.
+
+    send() must treat idempotency_key as a dedup key: a resumed run may send
+    the same message again after a crash, and must not reach the handset twice.
+    It is called from several threads at once.
+    """
+
+    def send(self, from_number, to_number, body, idempotency_key):
+        """
+        Send one message and return the provider's message id
+        """
+        raise NotImplementedError
+
+
+class StubProvider(SmsProvider):
+    """
+    Local provider for development and tests; records messages in memory
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.messages = {}
+        self._lock = threading.Lock()
+
+    def send(self, from_number, to_number, body, idempotency_key):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if idempotency_key not in self.messages:
+                self.messages[idempotency_key] = {
+                    'id': f'stub-{uuid.uuid4().hex}',
+                    'from': from_number,
+                    'to': to_number,
+                    'body': body
+                }
+            return self.messages[idempotency_key]['id']
+
+
+# Provider factories by name
+PROVIDERS = {
+    'stub': StubProvider,
+}
+
+
+class TokenBucket:
+    """
+    In-process token bucket: rate tokens per second, bursting up to capacity
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, count):
+        """
+        Take up to count whole tokens; returns (taken, seconds to wait when
+        none were)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                taken = min(count, int(self.tokens))
+                self.tokens -= taken
+                return taken, 0
+            return 0, (1 - self.tokens) / self.rate
+
+    def acquire(self, count=1):
+        """
+        Block until a token is available, then take up to count of them.
+        Returns how many were taken.
+        """
+        while True:
+            taken, wait = self._try_acquire(count)
+            if taken:
+                return taken
+            time.sleep(wait)
+
+    def acquire_all(self, count):
+        """
+        Block until count tokens have been taken
+        """
+        while count > 0:
+            count -= self.acquire(count)
+
+
+class DatabaseTokenBucket(TokenBucket):
+    """
+    Token bucket kept in the rate_limit_bucket table, so every process that
+    shares the database shares the rate. Updates are compare-and-set on
+    updated_at, which is safe without row locks on any backend. Callers
+    take tokens in batches, so a round trip covers many messages.
+    """
+
+    def __init__(self, name, rate, capacity=None):
+        super().__init__(rate, capacity)
+        self.name = name
+
+    def _try_acquire(self, count):
+        table = RateLimitBucket.__table__
+        now = time.time()
+        with db.engine.begin() as connection:
+            row = connection.execute(
+                select(table.c.tokens, table.c.updated_at).where(table.c.name == self.name)
+            ).first()
+            if row is None:
+                taken = min(count, int(self.capacity))
+                try:
+                    connection.execute(insert(table).values(
+                        name=self.name, tokens=self.capacity - taken, updated_at=now
+                    ))
+                    return taken, 0
+                except IntegrityError:
+                    # Another process created it first; retry against its row
+                    return 0, 0.001
+
+            tokens = min(self.capacity, row.tokens + max(0.0, now - row.updated_at) * self.rate)
+            if tokens < 1:
+                return 0, (1 - tokens) / self.rate
+
+            taken = min(count, int(tokens))
+            result = connection.execute(
+                update(table)
+                .where(table.c.name == self.name)
+                .where(table.c.updated_at == row.updated_at)
+                .values(tokens=tokens - taken, updated_at=now)
+            )
+            # Lost the race to another process: try again straight away
+            if result.rowcount == 1:
+                return taken, 0
+            return 0, 0.001
+
+
+def _parse_template(template):
+    if not template or not isinstance(template, str):
+        raise DispatchError('template is required')
+    parsed = string.Template(template)
+    if not parsed.is_valid():
+        raise DispatchError('template has an invalid placeholder')
+    unknown = [name for name in parsed.get_identifiers() if name not in TEMPLATE_FIELDS]
+    if unknown:
+        raise DispatchError(f"Unknown template fields: {', '.join(unknown)}")
+    return parsed
+
+
+def create_campaign(name, template, filter_spec):
+    """
+    Create a campaign and materialize its recipients with one INSERT ... SELECT.
+    Returns (campaign, recipient_count); the caller commits.
+    """
+    if not name:
+        raise DispatchError('name is required')
+    _parse_template(template)
+    criteria = lead_filter_clauses(filter_spec or {})
+    if not criteria:
+        raise DispatchError('filter must select a segment of leads')
+
+    campaign = Campaign(name=name, template=template, filter_spec=filter_spec)
+    db.session.add(campaign)
+    db.session.flush()
+
+    recipients = select(literal(campaign.id), Lead.id, literal('pending')).where(*criteria)
+    result = db.session.execute(
+        insert(CampaignMessage.__table__).from_select(['campaign_id', 'lead_id', 'status'], recipients)
+    )
+    return campaign, result.rowcount
+
+
+def campaign_progress(campaign_id):
+    """
+    Count the campaign's messages by status
+    """
+    progress = {'pending': 0, 'claimed': 0, 'sent': 0, 'failed': 0}
+    rows = db.session.execute(
+        select(CampaignMessage.status, func.count())
+        .where(CampaignMessage.campaign_id == campaign_id)
+        .group_by(CampaignMessage.status)
+    )
+    for status, count in rows:
+        progress[status] = count
+    return progress
+
+
+class DispatchRun:
+    """
+    Throughput and batch latency for one run of a campaign in this process
+    """
+
+    def __init__(self, campaign_id):
+        self.campaign_id = campaign_id
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.batch_seconds = deque(maxlen=MAX_LATENCY_SAMPLES)
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.error = None
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.finished_at is None
+
+    def to_dict(self):
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        latencies = sorted(self.batch_seconds)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))]
+
+        return {
+            'campaign_id': self.campaign_id,
+            'running': self.running,
+            'sent': self.sent,
+            'failed': self.failed,
+            'batches': self.batches,
+            'elapsed_seconds': elapsed,
+            'messages_per_second': (self.sent + self.failed) / elapsed if elapsed > 0 else 0.0,
+            'batch_latency_seconds': {
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'max': latencies[-1] if latencies else None
+            },
+            'error': self.error
+        }
+
+
+class Dispatcher:
+    """
+    Sends campaigns through the configured provider under the global and
+    per-number rate limits.
+
+    Any number of threads or worker processes can run the same campaign:
+    each claims batches of pending messages with an atomic UPDATE (SKIP
+    LOCKED on PostgreSQL), so no message is claimed twice while its lease
+    is live. Within a run, up to DISPATCH_CONCURRENCY provider calls are in
+    flight at once, so provider latency doesn't cap throughput.
+    """
+
+    def __init__(self, app):
+        config = app.config
+        self.app = app
+        self.provider = PROVIDERS[config['DISPATCH_PROVIDER']]()
+        self.from_numbers = list(config['DISPATCH_FROM_NUMBERS'])
+        self.batch_size = config['DISPATCH_BATCH_SIZE']
+        self.concurrency = config['DISPATCH_CONCURRENCY']
+        self.lease = timedelta(seconds=config['DISPATCH_LEASE_SECONDS'])
+        self.rate_backend = config['DISPATCH_RATE_BACKEND']
+
+        self.global_bucket = self._bucket('global', config['DISPATCH_RATE'])
+        self.number_buckets = {}
+        if config['DISPATCH_PER_NUMBER_RATE']:
+            for number in self.from_numbers:
+                self.number_buckets[number] = self._bucket(f'number:{number}', config['DISPATCH_PER_NUMBER_RATE'])
+
+        self.runs = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, name, rate):
+        if self.rate_backend == 'database':
+            return DatabaseTokenBucket(f'dispatch:{name}', rate)
+        return TokenBucket(rate)
+
+    def start(self, campaign_id):
+        """
+        Run a campaign in a background thread unless this process is
+        already running it. Returns the DispatchRun.
+        """
+        with self._lock:
+            run = self.runs.get(campaign_id)
+            if run and run.running:
+                return run
+            run = DispatchRun(campaign_id)
+            self.runs[campaign_id] = run
+            run.thread = threading.Thread(
+                target=self._run_in_context, args=(run,), name=f'dispatch-{campaign_id}', daemon=True
+            )
+            run.thread.start()
+            return run
+
+    def run(self, campaign_id):
+        """
+        Run a campaign to completion in the calling thread
+        """
+        run = DispatchRun(campaign_id)
+        with self._lock:
+            self.runs[campaign_id] = run
+        self._run_in_context(run)
+        return run
+
+    def _run_in_context(self, run):
+        try:
+            with self.app.app_context():
+                campaign = db.session.get(Campaign, run.campaign_id)
+                template = _parse_template(campaign.template)
+                with ThreadPoolExecutor(self.concurrency, thread_name_prefix=f'dispatch-{run.campaign_id}') as pool:
+                    while True:
+                        batch = self._claim_batch(run.campaign_id)
+                        if not batch:
+                            break
+                        self._send_batch(run, template, batch, pool)
+        except Exception as e:
+            run.error = str(e)
+            logger.error(f"Error dispatching campaign {run.campaign_id}: {str(e)}")
+        finally:
+            run.finished_at = time.monotonic()
+
+    def _claim_batch(self, campaign_id):
+        now = datetime.utcnow()
+        token = str(uuid.uuid4())
+
+        claimable = (
+            select(CampaignMessage.id)
+            .where(CampaignMessage.campaign_id == campaign_id)
+            .where(or_(
+                CampaignMessage.status == 'pending',
+                and_(CampaignMessage.status == 'claimed', CampaignMessage.claimed_at < now - self.lease)
+            ))
+            .order_by(CampaignMessage.id)
+            .limit(self.batch_size)
+        )
+        if db.engine.dialect.name == 'postgresql':
+            claimable = claimable.with_for_update(skip_locked=True)
+
+        db.session.execute(
+            update(CampaignMessage)
+            .where(CampaignMessage.id.in_(claimable))
+            .values(status='claimed', claim_token=token, claimed_at=now),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+
+        lead_columns = [getattr(Lead, name) for name in TEMPLATE_FIELDS + PHONE_COLUMNS]
+        return db.session.execute(
+            select(CampaignMessage.id, CampaignMessage.lead_id, CampaignMessage.claim_token, *lead_columns)
+            .join(Lead, Lead.id == CampaignMessage.lead_id)
+            .where(CampaignMessage.claim_token == token)
+            .order_by(CampaignMessage.id)
+        ).all()
+
+    def _send_batch(self, run, template, batch, pool):
+        started = time.monotonic()
+        outgoing = []
+        failed = []
+
+        for message in batch:
+            phones = normalized_phones(getattr(message, column) for column in PHONE_COLUMNS)
+            if not phones:
+                failed.append({'b_id': message.id, 'b_token': message.claim_token, 'b_error': 'No valid phone number'})
+                continue
+
+            # A lead always hears from the same number
+            from_number = self.from_numbers[message.lead_id % len(self.from_numbers)]
+            body = template.safe_substitute({name: getattr(message, name) or '' for name in TEMPLATE_FIELDS})
+            outgoing.append((message, from_number, phones[0], body))
+
+        # Tokens are taken as many at a time as the buckets allow, and each
+        # message is handed to the pool as soon as it has its tokens
+        sending = []
+        while outgoing:
+            taken = self.global_bucket.acquire(len(outgoing))
+            ready, outgoing = outgoing[:taken], outgoing[taken:]
+            if self.number_buckets:
+                per_number = Counter(from_number for _, from_number, _, _ in ready)
+                for from_number, count in per_number.items():
+                    self.number_buckets[from_number].acquire_all(count)
+            for message, from_number, to_number, body in ready:
+                future = pool.submit(
+                    self.provider.send, from_number, to_number, body,
+                    idempotency_key=f'campaign-message-{message.id}'
+                )
+                sending.append((message, from_number, body, future))
+
+        sent = []
+        for message, from_number, body, future in sending:
+            try:
+                provider_id = future.result()
+            except Exception as e:
+                failed.append({'b_id': message.id, 'b_token': message.claim_token, 'b_error': str(e)})
+                continue
+
+            sent.append({
+                'b_id': message.id,
+                'b_token': message.claim_token,
+                'b_lead_id': message.lead_id,
+                'b_from_number': from_number,
+                'b_provider_id': provider_id,
+                'b_body': body
+            })
+
+        self._stamp_batch(sent, failed)
+
+        run.sent += len(sent)
+        run.failed += len(failed)
+        run.batches += 1
+        run.batch_seconds.append(time.monotonic() - started)
+
+    def _stamp_batch(self, sent, failed):
+        """
+        Record a batch's outcome with one executemany per table
+        """
+        now = datetime.utcnow()
+        messages = CampaignMessage.__table__
+        leads = Lead.__table__
+
+        promoted = []
+        if sent:
+            for row in sent:
+                row['b_now'] = now
+            db.session.execute(
+                update(messages)
+                .where(messages.c.id == bindparam('b_id'))
+                .where(messages.c.claim_token == bindparam('b_token'))
+                .values(
+                    status='sent',
+                    sent_at=bindparam('b_now'),
+                    from_number=bindparam('b_from_number'),
+                    provider_message_id=bindparam('b_provider_id')
+                ),
+                sent
+            )
+            db.session.execute(
+                update(leads)
+                .where(leads.c.id == bindparam('b_lead_id'))
+                .values(
+                    last_text_sent=bindparam('b_now'),
+                    last_text_content=bindparam('b_body'),
+                    updated_at=bindparam('b_now')
+                ),
+                sent
+            )
+            promoted = update_leads(
+                [Lead.id.in_([row['b_lead_id'] for row in sent]), Lead.status == 'NEW'],
+                {'status': 'SENT'}
+            )
+
+        if failed:
+            db.session.execute(
+                update(messages)
+                .where(messages.c.id == bindparam('b_id'))
+                .where(messages.c.claim_token == bindparam('b_token'))
+                .values(status='failed', error=bindparam('b_error')),
+                failed
+            )
+
+        db.session.commit()
+        if promoted:
+            self.app.extensions['events'].publish('statuses-changed', {
+                'to': 'SENT',
+                'lead_ids': sorted(promoted)
+            })
+
+
+def init_dispatcher(app):
+    """
+    Attach the outbound dispatcher to the app
+    """
+    for key, value in DEFAULT_DISPATCH_CONFIG.items():
+        app.config.setdefault(key, value)
+    dispatcher = Dispatcher(app)
+    app.extensions['dispatcher'] = dispatcher
+    return dispatcher
@@ -0,0 +1,229 @@
+import json
+import logging
+import queue
+import threading
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the lead event stream; override in app.config
+DEFAULT_EVENTS_CONFIG = {
+    # 'local' fans out within one process; with several gunicorn workers use
+    # a broker shared by all of them so every stream sees every event
+    'EVENTS_BROKER': 'local',
+    # Events kept for Last-Event-ID resume
+    'EVENTS_HISTORY': 1000,
+    # Events buffered per connected client before it is cut off as too slow
+    'EVENTS_SUBSCRIBER_QUEUE': 256,
+    # Seconds between keepalive comments on an idle stream
+    'EVENTS_HEARTBEAT': 15,
+}
+
+# Reconnect delay suggested to EventSource clients, in milliseconds
+RETRY_MS = 2000
+
+# Event types published by the lead routes and the SMS workers;
+# statuses-changed is one event for a batch of leads moved to one status
+EVENT_TYPES = (
+    'lead-created', 'lead-updated', 'status-changed', 'statuses-changed',
+    'note-added', 'notes-added', 'lead-merged'
+)
+
+Event = namedtuple('Event', ['id', 'type', 'data'])
+
+
+class EventBroker:
+    """
+    Ordered event log with fan-out to listeners. A broker shared between
+    worker processes must give every event an id that increases in
+    publication order, and deliver each event to every process's listener.
+    """
+
+    def publish(self, event_type, data):
+        """
+        Append an event, deliver it to the listeners and return it
+        """
+        raise NotImplementedError
+
+    def subscribe(self, listener):
+        raise NotImplementedError
+
+    def events_after(self, event_id):
+        """
+        Events newer than event_id, or None if some have already been
+        discarded and the caller can't resume without a gap
+        """
+        raise NotImplementedError
+
+
+class LocalBroker(EventBroker):
+    """
+    In-process broker: a bounded history ring and synchronous fan-out
+    """
+
+    def __init__(self, history):
+        self._history = deque(maxlen=history)
+        self._listeners = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event = Event(self._next_id, event_type, data)
+            self._next_id += 1
+            self._history.append(event)
+            # Delivered under the lock so every listener sees publication order
+            for listener in self._listeners:
+                listener(event)
+        return event
+
+    def subscribe(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def events_after(self, event_id):
+        with self._lock:
+            newest = self._next_id - 1
+            if event_id > newest:
+                # Ids from before a restart
+                return None
+            if event_id == newest:
+                return []
+            if not self._history or event_id < self._history[0].id - 1:
+                return None
+            return [event for event in self._history if event.id > event_id]
+
+
+# Broker factories by name
+BROKERS = {
+    'local': LocalBroker,
+}
+
+
+class Subscriber:
+    """
+    One connected stream's bounded buffer. When it fills up the subscriber
+    is marked overflowed and gets nothing more; its stream ends once the
+    buffer is drained and the client resumes with Last-Event-ID.
+    """
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, event):
+        if self.overflowed:
+            return False
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+
+def format_event(event):
+    """
+    Encode an event as an SSE message
+    """
+    data = json.dumps(event.data, separators=(',', ':'))
+    return f'id: {event.id}\nevent: {event.type}\ndata: {data}\n\n'
+
+
+class EventHub:
+    """
+    Per-process fan-out of broker events to the connected SSE streams.
+    Publishing never blocks on a slow client: each stream has its own
+    bounded queue and is dropped rather than allowed to hold up the rest.
+    """
+
+    def __init__(self, broker, queue_size, heartbeat):
+        self.broker = broker
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._counters = {'published': 0, 'delivered': 0, 'overflows': 0, 'resets': 0}
+        broker.subscribe(self._fan_out)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _fan_out(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        delivered = 0
+        for subscriber in subscribers:
+            was_overflowed = subscriber.overflowed
+            if subscriber.offer(event):
+                delivered += 1
+            elif not was_overflowed:
+                self._count('overflows')
+                logger.info("Dropping slow event stream subscriber")
+        self._count('delivered', delivered)
+
+    def publish(self, event_type, data):
+        """
+        Publish an event; call after the change it describes has committed
+        """
+        event = self.broker.publish(event_type, data)
+        self._count('published')
+        return event
+
+    def stream(self, last_event_id=None):
+        """
+        Generate the SSE messages for one client, starting after
+        last_event_id when the client is resuming
+        """
+        subscriber = Subscriber(self.queue_size)
+        # Subscribe before reading history so nothing falls between the two
+        with self._lock:
+            self._subscribers.add(subscriber)
+        try:
+            yield f'retry: {RETRY_MS}\n\n'
+
+            last_sent = last_event_id
+            if last_event_id is not None:
+                missed = self.broker.events_after(last_event_id)
+                if missed is None:
+                    # Too far behind to replay; the client must refetch
+                    self._count('resets')
+                    last_sent = None
+                    yield 'event: reset\ndata: {}\n\n'
+                else:
+                    for event in missed:
+                        yield format_event(event)
+                        last_sent = event.id
+
+            while True:
+                if subscriber.overflowed and subscriber.queue.empty():
+                    return
+                try:
+                    event = subscriber.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if last_sent is not None and event.id <= last_sent:
+                    continue
+                yield format_event(event)
+                last_sent = event.id
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': len(self._subscribers), **self._counters}
+
+
+def init_events(app):
+    """
+    Attach the lead event hub to the app
+    """
+    for key, value in DEFAULT_EVENTS_CONFIG.items():
+        app.config.setdefault(key, value)
+    broker = BROKERS[app.config['EVENTS_BROKER']](app.config['EVENTS_HISTORY'])
+    hub = EventHub(broker, app.config['EVENTS_SUBSCRIBER_QUEUE'], app.config['EVENTS_HEARTBEAT'])
+    app.extensions['events'] = hub
+    return hub
@@ -0,0 +1,86 @@
+from datetime import datetime
+from sqlalchemy import func, select
+from backend.models import LEAD_STATUSES, Lead, LeadTag, Tag
+
+# Keys accepted in a lead filter spec
+FILTER_KEYS = ('status', 'tag', 'tag_mode', 'zip_prefix', 'created_after', 'created_before')
+
+# How a list of tags combines: leads with any of them, or with all of them
+TAG_MODES = ('any', 'all')
+
+
+class FilterError(ValueError):
+    """
+    Raised when a lead filter spec is malformed
+    """
+
+
+def _parse_datetime(key, value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise FilterError(f'{key} must be an ISO 8601 date or datetime')
+
+
+def lead_filter_clauses(spec):
+    """
+    Turn a filter spec such as {"status": "NEW", "tag": "wave-3"} into a list
+    of SQL criteria on Lead, suitable for both SELECT and UPDATE statements.
+
+    status may be a single value or a list; tag matches leads carrying a tag
+    with that name, or for a list any of them (tag_mode 'any', the default)
+    or all of them (tag_mode 'all'); zip_prefix matches the start of the zip
+    code; and created_after / created_before bound created_at (inclusive /
+    exclusive).
+    """
+    if not isinstance(spec, dict):
+        raise FilterError('filter must be an object')
+
+    unknown = [key for key in spec if key not in FILTER_KEYS]
+    if unknown:
+        raise FilterError(f"Unknown filter keys: {', '.join(unknown)}")
+
+    clauses = []
+
+    status = spec.get('status')
+    if status:
+        statuses = [status] if isinstance(status, str) else status
+        if not isinstance(statuses, list) or not all(isinstance(s, str) for s in statuses):
+            raise FilterError('status must be a status or a list of statuses')
+        statuses = [s.upper() for s in statuses]
+        invalid = [s for s in statuses if s not in LEAD_STATUSES]
+        if invalid:
+            raise FilterError(f"Invalid status: {', '.join(invalid)}")
+        clauses.append(Lead.status.in_(statuses))
+
+    tag_mode = spec.get('tag_mode') or 'any'
+    if tag_mode not in TAG_MODES:
+        raise FilterError(f"tag_mode must be one of: {', '.join(TAG_MODES)}")
+
+    tag = spec.get('tag')
+    if tag:
+        names = [tag] if isinstance(tag, str) else tag
+        if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+            raise FilterError('tag must be a tag name or a list of names')
+        names = sorted(set(names))
+        # Both read uq_lead_tag_tag_id_lead_id by tag_id
+        tagged = (
+            select(LeadTag.lead_id)
+            .join(Tag, Tag.id == LeadTag.tag_id)
+            .where(Tag.name.in_(names))
+        )
+        if tag_mode == 'all' and len(names) > 1:
+            # (tag_id, lead_id) is unique, so a lead with every tag has one row per tag
+            tagged = tagged.group_by(LeadTag.lead_id).having(func.count() == len(names))
+        clauses.append(Lead.id.in_(tagged))
+
+    zip_prefix = spec.get('zip_prefix')
+    if zip_prefix:
+        clauses.append(Lead.zip.startswith(str(zip_prefix), autoescape=True))
+
+    if spec.get('created_after'):
+        clauses.append(Lead.created_at >= _parse_datetime('created_after', spec['created_after']))
+    if spec.get('created_before'):
+        clauses.append(Lead.created_at < _parse_datetime('created_before', spec['created_before']))
+
+    return clauses
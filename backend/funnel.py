@@ -0,0 +1,184 @@
+import logging
+from collections import Counter
+from contextlib import contextmanager
+import click
+from sqlalchemy import String, and_, cast, delete, func, insert, literal, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from backend.app import db
+from backend.models import FunnelCount, FunnelSuspension, Lead, LeadTag, Tag, LEAD_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Breakdowns served by GET /api/stats/funnel?by=
+FUNNEL_DIMENSIONS = ('resort', 'tag')
+
+# Dimension holding the overall per-status totals
+OVERALL = 'all'
+
+class FunnelError(ValueError):
+    """
+    Raised when a funnel breakdown is not supported
+    """
+
+
+@contextmanager
+def counted_status_change(criteria, status):
+    """
+    Wrap a bulk UPDATE moving the leads matching criteria to status.
+
+    SQLite triggers run per row, so there the moves are counted up front
+    with two grouped queries, the per-row update trigger stands down for
+    the statement, and the deltas are applied as one upsert. Inserting the
+    suspension row first takes SQLite's write lock, so no other writer can
+    change the counted rows before the UPDATE. PostgreSQL's statement-level
+    triggers already count per statement and are left to it.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        yield
+        return
+
+    db.session.execute(insert(FunnelSuspension))
+    moving = list(criteria) + [Lead.status.is_distinct_from(status)]
+    resort = func.coalesce(Lead.resort, '')
+    deltas = Counter()
+    rows = db.session.execute(
+        select(Lead.status, resort, func.count()).where(*moving).group_by(Lead.status, resort)
+    )
+    for old_status, value, count in rows:
+        for dimension, key in ((OVERALL, ''), ('resort', value)):
+            deltas[(dimension, key, old_status)] -= count
+            deltas[(dimension, key, status)] += count
+    rows = db.session.execute(
+        select(Lead.status, LeadTag.tag_id, func.count())
+        .join(LeadTag, LeadTag.lead_id == Lead.id)
+        .where(*moving)
+        .group_by(Lead.status, LeadTag.tag_id)
+    )
+    for old_status, tag_id, count in rows:
+        deltas[('tag', str(tag_id), old_status)] -= count
+        deltas[('tag', str(tag_id), status)] += count
+
+    yield
+
+    db.session.execute(delete(FunnelSuspension))
+    changes = [
+        {'dimension': dimension, 'value': value, 'status': row_status, 'slot': 0, 'count': delta}
+        for (dimension, value, row_status), delta in deltas.items() if delta
+    ]
+    if changes:
+        statement = sqlite_insert(FunnelCount.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=['dimension', 'value', 'status', 'slot'],
+            set_={'count': FunnelCount.__table__.c.count + statement.excluded['count']}
+        )
+        db.session.execute(statement, changes)
+
+
+def _rebuild(connection, dialect):
+    if dialect == 'postgresql':
+        # Block writers (not readers) so no delta lands between the delete and the recount
+        connection.execute(text('LOCK TABLE lead, lead_tag IN SHARE MODE'))
+
+    table = FunnelCount.__table__
+    columns = ['dimension', 'value', 'status', 'count']
+    status = cast(Lead.status, String)
+    counts = (
+        select(literal(OVERALL), literal(''), status, func.count())
+        .group_by(Lead.status),
+        select(literal('resort'), func.coalesce(Lead.resort, ''), status, func.count())
+        .group_by(func.coalesce(Lead.resort, ''), Lead.status),
+        select(literal('tag'), cast(LeadTag.tag_id, String), status, func.count())
+        .join(Lead, Lead.id == LeadTag.lead_id)
+        .group_by(LeadTag.tag_id, Lead.status),
+    )
+    connection.execute(delete(table))
+    for query in counts:
+        connection.execute(insert(table).from_select(columns, query))
+
+
+def rebuild_funnel_counts():
+    """
+    Recompute every counter from the lead table with GROUP BY, for repair
+    after writes that bypassed the triggers (e.g. manual SQL with them disabled)
+    """
+    with db.engine.begin() as connection:
+        _rebuild(connection, db.engine.dialect.name)
+
+
+def _status_counts():
+    return {status: 0 for status in LEAD_STATUSES}
+
+
+def funnel_counts(by=None):
+    """
+    Read the funnel from the counter rows: overall counts per status, and
+    per breakdown value when by is one of FUNNEL_DIMENSIONS. Costs one
+    query over the counter rows and their slots, independent of the number
+    of leads.
+    """
+    if by is not None and by not in FUNNEL_DIMENSIONS:
+        raise FunnelError(f"by must be one of: {', '.join(FUNNEL_DIMENSIONS)}")
+
+    dimensions = [OVERALL] + ([by] if by else [])
+    count = func.sum(FunnelCount.count)
+    rows = db.session.execute(
+        select(FunnelCount.dimension, FunnelCount.value, FunnelCount.status, count)
+        .where(FunnelCount.dimension.in_(dimensions))
+        .group_by(FunnelCount.dimension, FunnelCount.value, FunnelCount.status)
+        .having(count != 0)
+    )
+
+    overall = _status_counts()
+    groups = {}
+    for dimension, value, status, count in rows:
+        counts = overall if dimension == OVERALL else groups.setdefault(value, _status_counts())
+        counts[status] = count
+
+    result = {'statuses': overall, 'total': sum(overall.values())}
+    if not by:
+        return result
+
+    names = {}
+    if by == 'tag' and groups:
+        names = {
+            str(tag_id): name for tag_id, name in
+            db.session.execute(select(Tag.id, Tag.name).where(Tag.id.in_([int(value) for value in groups])))
+        }
+
+    breakdown = []
+    for value, counts in groups.items():
+        entry = {'value': names.get(value, value or None), 'statuses': counts, 'total': sum(counts.values())}
+        if by == 'tag':
+            entry['tag_id'] = int(value)
+        breakdown.append(entry)
+    breakdown.sort(key=lambda entry: (-entry['total'], str(entry['value'])))
+
+    result['by'] = by
+    result['breakdown'] = breakdown
+    return result
+
+
+def tag_counts():
+    """
+    Every tag with the number of leads carrying it, read from the 'tag'
+    counter rows rather than counted over lead_tag
+    """
+    counted = and_(FunnelCount.dimension == 'tag', FunnelCount.value == cast(Tag.id, String))
+    rows = db.session.execute(
+        select(Tag.id, Tag.name, func.coalesce(func.sum(FunnelCount.count), 0))
+        .outerjoin(FunnelCount, counted)
+        .group_by(Tag.id, Tag.name)
+        .order_by(Tag.name)
+    )
+    return [{'id': tag_id, 'name': name, 'lead_count': count} for tag_id, name, count in rows]
+
+
+def init_funnel(app):
+    """
+    Register the `flask rebuild-funnel` repair command
+    """
+    @app.cli.command('rebuild-funnel')
+    def rebuild_funnel_command():
+        """Recompute the funnel counters from the lead table."""
+        rebuild_funnel_counts()
+        click.echo('Funnel counters rebuilt')
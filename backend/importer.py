@@ -0,0 +1,286 @@
+import csv
+import io
+import json
+import logging
+from datetime import datetime
+from sqlalchemy import insert
+from backend.app import db
+from backend.models import LEAD_STATUSES, Lead
+from backend.dedup import detect_duplicates, index_block_keys_for_emails
+from backend.phones import index_phones_for_emails
+
+logger = logging.getLogger(__name__)
+
+# Rows per multi-row INSERT / COPY, each committed in its own transaction
+DEFAULT_BATCH_SIZE = 1000
+
+# Stop collecting row errors after this many so a bad file can't exhaust memory
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+REQUIRED_COLUMNS = ('first_name', 'last_name', 'email')
+OPTIONAL_COLUMNS = (
+    'status', 'address', 'zip', 'resort', 'mortgaged',
+    'phone_1', 'phone_2', 'phone_3', 'phone_4'
+)
+
+# Every column written per row, including the ones filled in by the importer
+INSERT_COLUMNS = REQUIRED_COLUMNS + OPTIONAL_COLUMNS + ('created_at', 'updated_at')
+
+
+class ImportFormatError(ValueError):
+    """
+    Raised when the upload format is missing or unsupported
+    """
+
+
+class ImportResult:
+    """
+    Running totals and row error reports for one import
+    """
+
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.possible_duplicates = 0
+        self.errors = []
+
+    def add_error(self, row_number, messages):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': messages})
+
+    def to_dict(self):
+        return {
+            'inserted': self.inserted,
+            'failed': self.failed,
+            'possible_duplicates': self.possible_duplicates,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors)
+        }
+
+
+def detect_format(explicit=None, content_type=None, filename=None):
+    """
+    Work out the upload format from ?format=, the file name or the content type
+    """
+    if explicit:
+        fmt = explicit.lower()
+    elif filename and '.' in filename:
+        fmt = filename.rsplit('.', 1)[1].lower()
+    elif content_type and 'csv' in content_type:
+        fmt = 'csv'
+    elif content_type and ('ndjson' in content_type or 'jsonl' in content_type):
+        fmt = 'ndjson'
+    else:
+        raise ImportFormatError('Could not determine import format; pass ?format=csv or ?format=ndjson')
+
+    if fmt == 'jsonl':
+        fmt = 'ndjson'
+    if fmt not in IMPORT_FORMATS:
+        raise ImportFormatError(f"Unsupported import format: {fmt}")
+    return fmt
+
+
+def _iter_records(text_stream, fmt):
+    """
+    Yield (row_number, record_or_None, parse_error) one row at a time
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(text_stream)
+        # Row numbers are file line numbers, with the header on line 1
+        for row_number, record in enumerate(reader, start=2):
+            yield row_number, record, None
+        return
+
+    for row_number, line in enumerate(text_stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None, 'Each line must be a JSON object'
+            continue
+        yield row_number, record, None
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('1', 'true', 't', 'yes', 'y'):
+        return True
+    if text in ('0', 'false', 'f', 'no', 'n'):
+        return False
+    raise ValueError(f'Invalid boolean: {value}')
+
+
+def validate_record(record, now):
+    """
+    Normalize one uploaded record into an insertable row.
+
+    Returns a (row, errors) tuple; row is None when errors is non-empty.
+    Unknown keys are ignored and empty values are treated as missing.
+    """
+    errors = []
+    row = {}
+
+    for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS:
+        value = record.get(column)
+        if isinstance(value, str):
+            value = value.strip()
+        row[column] = None if value == '' else value
+
+    for column in REQUIRED_COLUMNS:
+        if row[column] is None:
+            errors.append(f'Missing required field: {column}')
+
+    if row['status'] is None:
+        row['status'] = 'NEW'
+    else:
+        row['status'] = str(row['status']).upper()
+        if row['status'] not in LEAD_STATUSES:
+            errors.append(f"Invalid status: {row['status']}")
+
+    if row['mortgaged'] is None:
+        row['mortgaged'] = False
+    else:
+        try:
+            row['mortgaged'] = _parse_bool(row['mortgaged'])
+        except ValueError as e:
+            errors.append(str(e))
+
+    for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS:
+        value = row[column]
+        if column in ('mortgaged', 'status') or value is None:
+            continue
+        value = str(value)
+        row[column] = value
+        max_length = Lead.__table__.c[column].type.length
+        if max_length and len(value) > max_length:
+            errors.append(f'{column} is longer than {max_length} characters')
+
+    if errors:
+        return None, errors
+
+    row['created_at'] = now
+    row['updated_at'] = now
+    return row, []
+
+
+def _copy_rows(rows):
+    """
+    Load a batch with PostgreSQL COPY over the session's connection
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in INSERT_COLUMNS])
+    buffer.seek(0)
+
+    dbapi_connection = db.session.connection().connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY lead ({', '.join(INSERT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+
+
+def _insert_batch(rows):
+    if db.engine.dialect.name == 'postgresql':
+        _copy_rows(rows)
+    else:
+        # executemany of a single prepared INSERT
+        db.session.execute(insert(Lead), rows)
+
+
+def _flush_batch(batch, result):
+    """
+    Insert one batch of validated (row_number, row) pairs in one transaction.
+
+    Emails that already exist are reported up front with a single IN query.
+    If the batch insert still fails (e.g. a concurrent writer), rows are
+    retried one by one under savepoints so only the bad rows are rejected.
+    Likely duplicates of the new leads are recorded in the same transaction.
+    """
+    emails = [row['email'] for _, row in batch]
+    existing = {
+        email for (email,) in
+        db.session.query(Lead.email).filter(Lead.email.in_(emails))
+    }
+
+    rows = []
+    row_numbers = []
+    for row_number, row in batch:
+        if row['email'] in existing:
+            result.add_error(row_number, [f"Duplicate email: {row['email']}"])
+            continue
+        existing.add(row['email'])
+        rows.append(row)
+        row_numbers.append(row_number)
+
+    if not rows:
+        return
+
+    try:
+        _insert_batch(rows)
+        inserted_emails = [row['email'] for row in rows]
+        index_phones_for_emails(inserted_emails)
+        duplicates = detect_duplicates(index_block_keys_for_emails(inserted_emails))
+        db.session.commit()
+        result.inserted += len(rows)
+        result.possible_duplicates += duplicates
+        return
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Batch insert failed, retrying row by row: {str(e)}")
+
+    for row_number, row in zip(row_numbers, rows):
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(Lead), [row])
+                index_phones_for_emails([row['email']])
+                duplicates = detect_duplicates(index_block_keys_for_emails([row['email']]))
+            result.inserted += 1
+            result.possible_duplicates += duplicates
+        except Exception as e:
+            result.add_error(row_number, [str(getattr(e, 'orig', e))])
+    db.session.commit()
+
+
+def import_leads(binary_stream, fmt, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream leads from a CSV or NDJSON upload into the database.
+
+    Rows are parsed and validated as they are read and inserted in batches
+    of batch_size, so memory stays bounded by the batch size rather than
+    the file size.
+    """
+    result = ImportResult()
+    now = datetime.utcnow()
+    batch = []
+
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    for row_number, record, parse_error in _iter_records(text_stream, fmt):
+        if parse_error:
+            result.add_error(row_number, [parse_error])
+            continue
+
+        row, errors = validate_record(record, now)
+        if errors:
+            result.add_error(row_number, errors)
+            continue
+
+        batch.append((row_number, row))
+        if len(batch) >= batch_size:
+            _flush_batch(batch, result)
+            batch = []
+
+    if batch:
+        _flush_batch(batch, result)
+
+    return result
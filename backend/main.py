@@ -1,4 +1,13 @@
-from app import app
+import logging
+from backend.app import create_app
+from backend.migrations import create_schema
+
+app = create_app()
 
 if __name__ == "__main__":
+    # Development server only; under gunicorn run `flask db create` once
+    # and `flask db upgrade` on every deploy
+    logging.basicConfig(level=logging.DEBUG)
+    with app.app_context():
+        create_schema()
     app.run(host="0.0.0.0", port=5000, debug=True)
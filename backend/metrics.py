@@ -0,0 +1,313 @@
+"""
+Request, SQL and connection pool metrics in Prometheus text format.
+
+Each process keeps its own totals in memory. With several gunicorn workers,
+set METRICS_DIR (or PROMETHEUS_MULTIPROC_DIR) to a directory shared by the
+workers and emptied when the deployment starts: every worker writes its
+totals there at most every METRICS_FLUSH_INTERVAL seconds, and whichever
+worker answers /api/metrics sums all of them.
+"""
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Defaults for request metrics; override in app.config
+DEFAULT_METRICS_CONFIG = {
+    'METRICS_ENABLED': True,
+    # Shared by all workers of one deployment; None keeps metrics per process
+    'METRICS_DIR': None,
+    # Most seconds a worker's totals can lag behind in METRICS_DIR
+    'METRICS_FLUSH_INTERVAL': 5,
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+# name: (type, help, label names, histogram buckets)
+METRICS = {
+    'http_requests_total': (
+        'counter', 'Responses by route, method and status.', ('route', 'method', 'status'), None),
+    'http_request_duration_seconds': (
+        'histogram', 'Time to produce a response.', ('route', 'method'), LATENCY_BUCKETS),
+    'http_request_sql_statements': (
+        'histogram', 'SQL statements executed per request.', ('route', 'method'), STATEMENT_BUCKETS),
+    'http_request_db_seconds': (
+        'histogram', 'Time spent executing SQL per request.', ('route', 'method'), LATENCY_BUCKETS),
+    'http_response_size_bytes': (
+        'histogram', 'Response body size; streamed responses are not counted.', ('route', 'method'),
+        SIZE_BUCKETS),
+    'db_pool_wait_seconds': (
+        'histogram', 'Time to check a connection out of the pool, including connecting.', (),
+        POOL_WAIT_BUCKETS),
+}
+
+# Label for requests that matched no route, so 404 probes can't add series
+UNMATCHED_ROUTE = 'unmatched'
+
+
+class MetricsRegistry:
+    """
+    Thread-safe in-process totals. Histogram series are stored as
+    per-bucket counts followed by the sum and the count; the last bucket
+    is +Inf.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        index = bisect_left(buckets, value)
+        key = (name, labels)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(buckets) + 1) + [0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        """
+        The totals as JSON-serializable lists
+        """
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(series)]
+                               for (name, labels), series in self._histograms.items()],
+            }
+
+
+def merge_snapshots(snapshots):
+    """
+    Sum snapshots from several processes into {(name, labels): value or series}
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get('counters', ()):
+            key = (name, tuple(labels))
+            merged[key] = merged.get(key, 0) + value
+        for name, labels, series in snapshot.get('histograms', ()):
+            key = (name, tuple(labels))
+            total = merged.get(key)
+            if total is None or len(total) != len(series):
+                merged[key] = list(series)
+            else:
+                merged[key] = [a + b for a, b in zip(total, series)]
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def render(merged):
+    """
+    Prometheus text exposition of merged totals
+    """
+    by_name = {}
+    for (name, labels), value in merged.items():
+        if name in METRICS:
+            by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(by_name.get(name, ())):
+            if kind == 'counter':
+                lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], value):
+                cumulative += count
+                le = f'le="{bound if bound == "+Inf" else _number(float(bound))}"'
+                lines.append(f'{name}_bucket{_labels(label_names, labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(label_names, labels)} {_number(float(value[-2]))}')
+            lines.append(f'{name}_count{_labels(label_names, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsStore:
+    """
+    Publishes this process's registry to the shared directory and reads
+    back every process's totals
+    """
+
+    def __init__(self, registry, directory, interval):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'metrics-{pid}.json')
+
+    def flush(self):
+        """
+        Atomically replace this process's file with its current totals
+        """
+        snapshot = self.registry.snapshot()
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix='.metrics-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            # Keyed by pid at flush time, so forked workers get their own file
+            os.replace(temporary, self._path(os.getpid()))
+        except OSError:
+            os.unlink(temporary)
+            raise
+
+    def maybe_flush(self, force=False):
+        if not self.directory or (not force and time.monotonic() - self._flushed_at < self.interval):
+            return
+        # One flush at a time; others skip rather than wait
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._flushed_at = time.monotonic()
+            self.flush()
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.directory}: {str(e)}")
+        finally:
+            self._lock.release()
+
+    def collect(self):
+        """
+        Totals of every process that has written to the directory, with
+        this process's own totals read live
+        """
+        if not self.directory:
+            return merge_snapshots([self.registry.snapshot()])
+
+        own = f'metrics-{os.getpid()}.json'
+        snapshots = [self.registry.snapshot()]
+        for filename in os.listdir(self.directory):
+            if not filename.startswith('metrics-') or not filename.endswith('.json') or filename == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                # Deleted or replaced between listdir and open
+                logger.debug(f"Skipping metrics file {filename}: {str(e)}")
+        return merge_snapshots(snapshots)
+
+
+def _route_labels():
+    rule = request.url_rule
+    return (rule.rule if rule is not None else UNMATCHED_ROUTE, request.method)
+
+
+def _before_request():
+    g.metrics_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'metrics_started', None)
+    # SQL run outside a request (workers, CLI) isn't attributed to a route
+    if started is None or not has_request_context() or 'metrics_started' not in g:
+        return
+    g.sql_statements += 1
+    g.sql_seconds += time.perf_counter() - started
+
+
+def _time_pool_checkouts(engine, registry):
+    # The pool has no event before checkout; every Connection gets its
+    # DBAPI connection through engine.raw_connection(), which survives
+    # engine.dispose() replacing the pool
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection():
+        started = time.perf_counter()
+        try:
+            return raw_connection()
+        finally:
+            registry.observe('db_pool_wait_seconds', (), time.perf_counter() - started)
+
+    engine.raw_connection = timed_raw_connection
+
+
+def init_metrics(app):
+    """
+    Time every request and its SQL, and attach the metrics store to the app
+    """
+    for key, value in DEFAULT_METRICS_CONFIG.items():
+        app.config.setdefault(key, value)
+    if app.config['METRICS_DIR'] is None:
+        app.config['METRICS_DIR'] = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+    registry = MetricsRegistry()
+    store = MetricsStore(registry, app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+    app.extensions['metrics'] = store
+    if not app.config['METRICS_ENABLED']:
+        return store
+
+    if store.directory:
+        os.makedirs(store.directory, exist_ok=True)
+        atexit.register(store.maybe_flush, force=True)
+
+    from backend.app import db
+    event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    _time_pool_checkouts(db.engine, registry)
+
+    def after_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        labels = _route_labels()
+        registry.observe('http_request_duration_seconds', labels, time.perf_counter() - started)
+        registry.observe('http_request_sql_statements', labels, g.pop('sql_statements', 0))
+        registry.observe('http_request_db_seconds', labels, g.pop('sql_seconds', 0.0))
+        if not response.is_streamed and response.content_length is not None:
+            registry.observe('http_response_size_bytes', labels, response.content_length)
+        registry.inc('http_requests_total', labels + (str(response.status_code),))
+        store.maybe_flush()
+        return response
+
+    app.before_request(_before_request)
+    app.after_request(after_request)
+    return store
@@ -0,0 +1,275 @@
+import importlib
+import logging
+import pkgutil
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+import click
+from sqlalchemy import insert, inspect, select, text
+from backend.app import db
+from backend.models import SchemaMigration
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_PACKAGE = 'backend.migrations.versions'
+
+# Migration modules are named NNNN_description.py
+_MODULE_NAME = re.compile(r'^(\d{4})_(\w+)$')
+
+# Arbitrary key for the PostgreSQL advisory lock held while migrating
+_ADVISORY_LOCK_KEY = 7310424
+
+# How long a transactional migration waits for a table lock before giving up,
+# so a migration queued behind a long query doesn't stall every request behind it
+LOCK_TIMEOUT = '5s'
+
+MIGRATION_TEMPLATE = '''"""
+{description}
+"""
+
+# Set to False for statements that can't run in a transaction, such as
+# create_index() on PostgreSQL; every step must then be idempotent
+TRANSACTIONAL = True
+
+
+def upgrade(connection):
+    pass
+'''
+
+Migration = namedtuple('Migration', ['version', 'name', 'module'])
+
+
+class MigrationError(RuntimeError):
+    """
+    Raised when the migrations on disk are inconsistent
+    """
+
+
+def discover_migrations():
+    """
+    Return every migration module, ordered by version
+    """
+    package = importlib.import_module(VERSIONS_PACKAGE)
+    migrations = []
+    for module_info in pkgutil.iter_modules(package.__path__):
+        match = _MODULE_NAME.match(module_info.name)
+        if not match:
+            continue
+        module = importlib.import_module(f'{VERSIONS_PACKAGE}.{module_info.name}')
+        migrations.append(Migration(match.group(1), match.group(2), module))
+    migrations.sort(key=lambda migration: migration.version)
+
+    versions = [migration.version for migration in migrations]
+    duplicates = sorted({version for version in versions if versions.count(version) > 1})
+    if duplicates:
+        raise MigrationError(f"Duplicate migration versions: {', '.join(duplicates)}")
+    return migrations
+
+
+def applied_versions():
+    """
+    Versions recorded in schema_migration; empty before the first upgrade
+    """
+    if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+        return set()
+    with db.engine.connect() as connection:
+        return {version for (version,) in connection.execute(select(SchemaMigration.version))}
+
+
+def pending_migrations():
+    applied = applied_versions()
+    return [migration for migration in discover_migrations() if migration.version not in applied]
+
+
+@contextmanager
+def _migration_lock():
+    """
+    Serialize concurrent upgrades (e.g. several containers starting at once)
+    """
+    if db.engine.dialect.name != 'postgresql':
+        yield
+        return
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': _ADVISORY_LOCK_KEY})
+        try:
+            yield
+        finally:
+            connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': _ADVISORY_LOCK_KEY})
+
+
+def _record(connection, migration):
+    connection.execute(insert(SchemaMigration.__table__).values(
+        version=migration.version,
+        name=migration.name,
+        applied_at=datetime.utcnow()
+    ))
+
+
+def _apply(migration):
+    module = migration.module
+    if getattr(module, 'TRANSACTIONAL', True):
+        with db.engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'"))
+            module.upgrade(connection)
+            _record(connection, migration)
+        return
+
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        module.upgrade(connection)
+    with db.engine.begin() as connection:
+        _record(connection, migration)
+
+
+def upgrade(target=None):
+    """
+    Apply pending migrations in order, up to and including target when
+    given. Each migration is recorded once it has fully succeeded.
+    """
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    applied = []
+    with _migration_lock():
+        for migration in pending_migrations():
+            if target is not None and migration.version > target:
+                break
+            logger.info(f"Applying migration {migration.version}_{migration.name}")
+            _apply(migration)
+            applied.append(migration)
+    return applied
+
+
+def _in_autocommit(connection):
+    return connection.get_execution_options().get('isolation_level') == 'AUTOCOMMIT'
+
+
+def create_index(connection, name, table, columns, unique=False, using=None):
+    """
+    Create an index if it doesn't exist; using names an index method such
+    as 'gin'.
+
+    On PostgreSQL, from a non-transactional migration, the index is built
+    CONCURRENTLY so writes to the table carry on during the build; an
+    invalid index left behind by an interrupted build is dropped first.
+    """
+    unique_sql = 'UNIQUE ' if unique else ''
+    column_sql = ', '.join(columns)
+    if using:
+        column_sql = f'USING {using} ({column_sql})'
+    else:
+        column_sql = f'({column_sql})'
+
+    if connection.dialect.name == 'postgresql' and _in_autocommit(connection):
+        invalid = connection.execute(text("""
+            SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+            WHERE pg_class.relname = :name AND NOT pg_index.indisvalid
+        """), {'name': name}).first()
+        if invalid:
+            connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+        connection.execute(text(
+            f'CREATE {unique_sql}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {column_sql}'
+        ))
+        return
+
+    connection.execute(text(f'CREATE {unique_sql}INDEX IF NOT EXISTS {name} ON {table} {column_sql}'))
+
+
+def drop_index(connection, name):
+    """
+    Drop an index if it exists, CONCURRENTLY on PostgreSQL from a
+    non-transactional migration
+    """
+    if connection.dialect.name == 'postgresql' and _in_autocommit(connection):
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS {name}'))
+        return
+    connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+
+def trigger_exists(connection, name):
+    """
+    Whether a trigger called name is installed
+    """
+    if connection.dialect.name == 'sqlite':
+        query = "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+    else:
+        query = "SELECT 1 FROM pg_trigger WHERE tgname = :name"
+    return connection.execute(text(query), {'name': name}).first() is not None
+
+
+def new_migration(description):
+    """
+    Write an empty migration module with the next version number and
+    return its path
+    """
+    migrations = discover_migrations()
+    version = int(migrations[-1].version) + 1 if migrations else 1
+    slug = re.sub(r'\W+', '_', description.strip().lower()).strip('_')
+    package = importlib.import_module(VERSIONS_PACKAGE)
+    path = f'{package.__path__[0]}/{version:04d}_{slug}.py'
+    with open(path, 'x') as f:
+        f.write(MIGRATION_TEMPLATE.format(description=description.strip()))
+    return path
+
+
+def warn_if_pending():
+    """
+    Log the migrations the database is missing
+    """
+    pending = pending_migrations()
+    if pending:
+        names = ', '.join(f'{migration.version}_{migration.name}' for migration in pending)
+        logger.warning(f"Database has pending migrations ({names}); run `flask db upgrade`")
+
+
+def create_schema():
+    """
+    Create missing tables; safe to rerun. A new database then gets every
+    migration applied, which installs the triggers and derived indexes
+    the app relies on; an existing one only has its pending migrations
+    reported, for `flask db upgrade` to apply.
+    """
+    new_database = not inspect(db.engine).get_table_names()
+    db.create_all()
+    if new_database:
+        upgrade()
+    else:
+        warn_if_pending()
+
+
+def init_migrations(app):
+    """
+    Register the `flask db` commands
+    """
+    @app.cli.group('db')
+    def db_command():
+        """Manage the database schema."""
+
+    @db_command.command('create')
+    def create_command():
+        """Create the tables, triggers and derived indexes."""
+        create_schema()
+        click.echo('Database schema ready')
+
+    @db_command.command('upgrade')
+    @click.option('--target', help='Stop after this migration version.')
+    def upgrade_command(target):
+        """Apply pending migrations."""
+        applied = upgrade(target)
+        for migration in applied:
+            click.echo(f'Applied {migration.version}_{migration.name}')
+        if not applied:
+            click.echo('Database is up to date')
+
+    @db_command.command('status')
+    def status_command():
+        """List migrations and whether they are applied."""
+        applied = applied_versions()
+        for migration in discover_migrations():
+            state = 'applied' if migration.version in applied else 'pending'
+            click.echo(f'{migration.version}_{migration.name}  {state}')
+
+    @db_command.command('new')
+    @click.argument('description')
+    def new_command(description):
+        """Create an empty migration."""
+        click.echo(f'Created {new_migration(description)}')
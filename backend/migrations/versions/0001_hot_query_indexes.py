@@ -0,0 +1,21 @@
+"""
+Indexes for the status filter, created_at / updated_at sorts and the
+lead -> notes and lead -> tags joins
+"""
+from backend.migrations import create_index
+
+# Built CONCURRENTLY on PostgreSQL, which can't run inside a transaction
+TRANSACTIONAL = False
+
+INDEXES = (
+    ('ix_lead_status', 'lead', ['status']),
+    ('ix_lead_created_at', 'lead', ['created_at']),
+    ('ix_lead_updated_at', 'lead', ['updated_at']),
+    ('ix_note_lead_id', 'note', ['lead_id']),
+    ('ix_lead_tag_lead_id_tag_id', 'lead_tag', ['lead_id', 'tag_id']),
+)
+
+
+def upgrade(connection):
+    for name, table, columns in INDEXES:
+        create_index(connection, name, table, columns)
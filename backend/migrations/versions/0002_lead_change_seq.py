@@ -0,0 +1,152 @@
+"""
+lead.change_seq for delta sync, with its keyset index, the 'lead'
+table_version counter and the triggers that bump the counter and stamp
+change_seq from it
+"""
+from sqlalchemy import inspect, text
+from backend.migrations import create_index
+
+# Built CONCURRENTLY on PostgreSQL, which can't run inside a transaction;
+# every trigger statement below can be rerun
+TRANSACTIONAL = False
+
+# Tables whose writes change a lead's payload
+VERSIONED_TABLES = ('lead', 'note', 'tag', 'lead_tag')
+
+# Child tables, and the column naming the lead whose change_seq they touch
+CHILD_TABLES = (('note', 'lead_id'), ('lead_tag', 'lead_id'))
+
+STAMP = "(SELECT version FROM table_version WHERE name = 'lead')"
+BUMP = "UPDATE table_version SET version = version + 1 WHERE name = 'lead';"
+
+
+def _sqlite_statements():
+    statements = []
+    for table in VERSIONED_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            statements.append(f"""
+                CREATE TRIGGER IF NOT EXISTS table_version_lead_{table}_{event.lower()}
+                AFTER {event} ON {table} BEGIN
+                    {BUMP}
+                END
+            """)
+    statements += [
+        f"""CREATE TRIGGER IF NOT EXISTS lead_changes_insert AFTER INSERT ON lead BEGIN
+            {BUMP}
+            UPDATE lead SET change_seq = {STAMP} WHERE id = new.id;
+        END""",
+        # The WHEN clause skips the trigger's own change_seq update, and
+        # bulk updates that stamp change_seq themselves
+        f"""CREATE TRIGGER IF NOT EXISTS lead_changes_update AFTER UPDATE ON lead
+        WHEN new.change_seq IS old.change_seq BEGIN
+            {BUMP}
+            UPDATE lead SET change_seq = {STAMP} WHERE id = new.id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS lead_changes_delete AFTER DELETE ON lead BEGIN
+            {BUMP}
+            INSERT INTO lead_tombstone (lead_id, change_seq, deleted_at)
+            VALUES (old.id, {STAMP}, CURRENT_TIMESTAMP);
+        END""",
+    ]
+    for table, column in CHILD_TABLES:
+        for event, row in (('INSERT', 'new'), ('UPDATE', 'new'), ('DELETE', 'old')):
+            statements.append(f"""
+                CREATE TRIGGER IF NOT EXISTS lead_changes_{table}_{event.lower()} AFTER {event} ON {table} BEGIN
+                    {BUMP}
+                    UPDATE lead SET change_seq = {STAMP} WHERE id = {row}.{column};
+                END
+            """)
+    return statements
+
+
+def _postgresql_statements():
+    statements = [
+        f"""CREATE OR REPLACE FUNCTION table_version_bump_lead() RETURNS trigger AS $$
+        BEGIN
+            {BUMP}
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+    ]
+    for table in VERSIONED_TABLES:
+        # Statement-level, so a 50k-row UPDATE bumps the counter once
+        statements.append(f"DROP TRIGGER IF EXISTS table_version_lead ON {table}")
+        statements.append(f"""
+            CREATE TRIGGER table_version_lead
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION table_version_bump_lead()
+        """)
+    statements += [
+        # Bumping once per statement takes the counter's row lock until
+        # commit, so change_seq values become visible in increasing order
+        f"""CREATE OR REPLACE FUNCTION lead_changes_bump() RETURNS trigger AS $$
+        BEGIN
+            {BUMP}
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        f"""CREATE OR REPLACE FUNCTION lead_changes_stamp() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_seq := {STAMP};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql""",
+        f"""CREATE OR REPLACE FUNCTION lead_changes_tombstone() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO lead_tombstone (lead_id, change_seq, deleted_at)
+            SELECT id, {STAMP}, now() AT TIME ZONE 'utc' FROM old_rows;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        """CREATE OR REPLACE FUNCTION lead_changes_touch() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP <> 'DELETE' THEN
+                UPDATE lead SET change_seq = 0 WHERE id = NEW.lead_id;
+            END IF;
+            IF TG_OP <> 'INSERT' THEN
+                UPDATE lead SET change_seq = 0 WHERE id = OLD.lead_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS lead_changes_bump ON lead",
+        """CREATE TRIGGER lead_changes_bump BEFORE INSERT OR UPDATE OR DELETE ON lead
+        FOR EACH STATEMENT EXECUTE FUNCTION lead_changes_bump()""",
+        "DROP TRIGGER IF EXISTS lead_changes_stamp ON lead",
+        """CREATE TRIGGER lead_changes_stamp BEFORE INSERT OR UPDATE ON lead
+        FOR EACH ROW EXECUTE FUNCTION lead_changes_stamp()""",
+        "DROP TRIGGER IF EXISTS lead_changes_tombstone ON lead",
+        """CREATE TRIGGER lead_changes_tombstone AFTER DELETE ON lead
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION lead_changes_tombstone()""",
+    ]
+    for table, _ in CHILD_TABLES:
+        # The touched lead is restamped by its own BEFORE UPDATE trigger
+        statements.append(f"DROP TRIGGER IF EXISTS lead_changes_touch ON {table}")
+        statements.append(f"""CREATE TRIGGER lead_changes_touch AFTER INSERT OR UPDATE OR DELETE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION lead_changes_touch()""")
+    return statements
+
+
+def upgrade(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('lead')}
+    if 'change_seq' not in columns:
+        # Existing leads get 0, i.e. they predate every sync token
+        connection.execute(text('ALTER TABLE lead ADD COLUMN change_seq BIGINT NOT NULL DEFAULT 0'))
+    create_index(connection, 'ix_lead_change_seq_id', 'lead', ['change_seq', 'id'])
+
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        statements = _sqlite_statements()
+    elif dialect == 'postgresql':
+        statements = _postgresql_statements()
+    else:
+        return
+
+    # The triggers stamp from the counter row, which must exist first
+    connection.execute(text("""
+        INSERT INTO table_version (name, version)
+        SELECT 'lead', 0 WHERE NOT EXISTS (SELECT 1 FROM table_version WHERE name = 'lead')
+    """))
+    for statement in statements:
+        connection.execute(text(statement))
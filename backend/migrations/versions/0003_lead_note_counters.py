@@ -0,0 +1,105 @@
+"""
+lead.notes_count and lead.latest_note_id, kept by triggers on note, and
+the (lead_id, created_at) index behind the notes page
+"""
+from sqlalchemy import inspect, text
+from backend.migrations import create_index, drop_index
+
+# Built CONCURRENTLY on PostgreSQL, which can't run inside a transaction;
+# every trigger statement below can be rerun
+TRANSACTIONAL = False
+
+# Recomputes lead.latest_note_id with one probe of ix_note_lead_id_created_at
+LATEST_NOTE = """(
+    SELECT note.id FROM note WHERE note.lead_id = {lead_id}
+    ORDER BY note.created_at DESC, note.id DESC LIMIT 1
+)"""
+
+
+def _sqlite_statements():
+    latest_new = LATEST_NOTE.format(lead_id='new.lead_id')
+    latest_old = LATEST_NOTE.format(lead_id='old.lead_id')
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS note_counts_insert AFTER INSERT ON note BEGIN
+            UPDATE lead SET notes_count = notes_count + 1, latest_note_id = {latest_new}
+            WHERE id = new.lead_id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS note_counts_delete AFTER DELETE ON note BEGIN
+            UPDATE lead SET notes_count = notes_count - 1, latest_note_id = {latest_old}
+            WHERE id = old.lead_id;
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS note_counts_update AFTER UPDATE OF lead_id, created_at ON note BEGIN
+            UPDATE lead SET notes_count = notes_count - 1, latest_note_id = {latest_old}
+            WHERE id = old.lead_id;
+            UPDATE lead SET notes_count = notes_count + 1, latest_note_id = {latest_new}
+            WHERE id = new.lead_id;
+        END""",
+    ]
+
+
+def _postgresql_statements():
+    # Statement-level over transition tables, so a batch of notes updates
+    # each lead once
+    deltas = {
+        'INSERT': "SELECT lead_id, 1 AS delta FROM new_rows",
+        'DELETE': "SELECT lead_id, -1 AS delta FROM old_rows",
+        'UPDATE': "SELECT lead_id, 1 AS delta FROM new_rows UNION ALL SELECT lead_id, -1 FROM old_rows",
+    }
+    latest = LATEST_NOTE.format(lead_id='lead.id')
+    statements = []
+    for event, delta_rows in deltas.items():
+        name = f'note_counts_{event.lower()}'
+        transitions = []
+        if event in ('UPDATE', 'DELETE'):
+            transitions.append('OLD TABLE AS old_rows')
+        if event in ('UPDATE', 'INSERT'):
+            transitions.append('NEW TABLE AS new_rows')
+        statements.append(f"""
+            CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$
+            BEGIN
+                UPDATE lead SET notes_count = lead.notes_count + changed.delta, latest_note_id = {latest}
+                FROM (
+                    SELECT lead_id, SUM(delta) AS delta FROM ({delta_rows}) AS deltas GROUP BY lead_id
+                ) AS changed
+                WHERE lead.id = changed.lead_id;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        statements.append(f"DROP TRIGGER IF EXISTS {name} ON note")
+        statements.append(f"""
+            CREATE TRIGGER {name} AFTER {event} ON note
+            REFERENCING {' '.join(transitions)}
+            FOR EACH STATEMENT EXECUTE FUNCTION {name}()
+        """)
+    return statements
+
+
+def upgrade(connection):
+    columns = {column['name'] for column in inspect(connection).get_columns('lead')}
+    if 'notes_count' not in columns:
+        connection.execute(text('ALTER TABLE lead ADD COLUMN notes_count INTEGER NOT NULL DEFAULT 0'))
+    if 'latest_note_id' not in columns:
+        connection.execute(text('ALTER TABLE lead ADD COLUMN latest_note_id INTEGER'))
+
+    create_index(connection, 'ix_note_lead_id_created_at', 'note', ['lead_id', 'created_at'])
+    # Covered by the leading column of the new index
+    drop_index(connection, 'ix_note_lead_id')
+
+    # Triggers first, so notes written during the backfill are counted by
+    # both and the backfill's recount settles them
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        statements = _sqlite_statements()
+    elif dialect == 'postgresql':
+        statements = _postgresql_statements()
+    else:
+        statements = []
+    for statement in statements:
+        connection.execute(text(statement))
+
+    connection.execute(text(f"""
+        UPDATE lead SET
+            notes_count = (SELECT COUNT(*) FROM note WHERE note.lead_id = lead.id),
+            latest_note_id = {LATEST_NOTE.format(lead_id='lead.id')}
+    """))
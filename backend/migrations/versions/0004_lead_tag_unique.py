@@ -0,0 +1,19 @@
+"""
+Unique (tag_id, lead_id) index on lead_tag for tag filters and counts
+"""
+from sqlalchemy import text
+from backend.migrations import create_index
+
+# Built CONCURRENTLY on PostgreSQL, which can't run inside a transaction
+TRANSACTIONAL = False
+
+
+def upgrade(connection):
+    # Drop repeated tag assignments first; if one is written again before
+    # the index is built, the build fails and the migration can be rerun
+    connection.execute(text("""
+        DELETE FROM lead_tag WHERE id NOT IN (
+            SELECT MIN(id) FROM lead_tag GROUP BY lead_id, tag_id
+        )
+    """))
+    create_index(connection, 'uq_lead_tag_tag_id_lead_id', 'lead_tag', ['tag_id', 'lead_id'], unique=True)
@@ -0,0 +1,49 @@
+"""
+funnel_suspension, which lets bulk status changes on SQLite update the
+funnel counters once per statement instead of once per row
+"""
+from sqlalchemy import text
+from backend.migrations import trigger_exists
+
+TRANSACTIONAL = True
+
+UPSERT = """
+    INSERT INTO funnel_count (dimension, value, status, count)
+    SELECT dimension, value, status, SUM(delta) FROM ({deltas}) AS deltas
+    WHERE true
+    GROUP BY dimension, value, status
+    HAVING SUM(delta) <> 0
+    ON CONFLICT (dimension, value, status) DO UPDATE SET count = funnel_count.count + excluded.count
+"""
+
+
+def _lead_deltas(row, sign):
+    return [
+        f"SELECT 'all' AS dimension, '' AS value, {row}.status AS status, {sign} AS delta",
+        f"SELECT 'resort' AS dimension, coalesce({row}.resort, '') AS value, {row}.status AS status, "
+        f"{sign} AS delta",
+        f"SELECT 'tag' AS dimension, CAST(tag_id AS TEXT) AS value, {row}.status AS status, {sign} AS delta "
+        f"FROM lead_tag WHERE lead_id = {row}.id",
+    ]
+
+
+# The per-row update trigger stands down while a funnel_suspension row exists
+LEAD_UPDATE_TRIGGER = f"""
+    CREATE TRIGGER funnel_count_lead_update AFTER UPDATE OF status, resort ON lead
+    WHEN NOT EXISTS (SELECT 1 FROM funnel_suspension)
+    AND (old.status IS NOT new.status OR old.resort IS NOT new.resort)
+    BEGIN {UPSERT.format(deltas=' UNION ALL '.join(_lead_deltas('old', -1) + _lead_deltas('new', 1)))}; END
+"""
+
+
+def upgrade(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('CREATE TABLE IF NOT EXISTS funnel_suspension (id SERIAL PRIMARY KEY)'))
+    else:
+        connection.execute(text('CREATE TABLE IF NOT EXISTS funnel_suspension (id INTEGER PRIMARY KEY)'))
+
+    # An installed trigger keeps its old definition until replaced; a new
+    # database gets this one from 0007
+    if connection.dialect.name == 'sqlite' and trigger_exists(connection, 'funnel_count_lead_update'):
+        connection.execute(text('DROP TRIGGER funnel_count_lead_update'))
+        connection.execute(text(LEAD_UPDATE_TRIGGER))
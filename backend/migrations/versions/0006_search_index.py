@@ -0,0 +1,120 @@
+"""
+Full-text search structures: FTS5 tables on SQLite; on PostgreSQL,
+trigger-maintained tsvector columns with GIN indexes
+"""
+from sqlalchemy import text
+from backend.migrations import create_index, trigger_exists
+
+# GIN indexes are built CONCURRENTLY on PostgreSQL, which can't run inside
+# a transaction, and the backfill commits batch by batch; every step can
+# be rerun
+TRANSACTIONAL = False
+
+LEAD_COLUMNS = ('first_name', 'last_name', 'email', 'address', 'resort')
+
+# Columns behind each table's search vector on PostgreSQL
+SEARCH_COLUMNS = {'lead': LEAD_COLUMNS, 'note': ('content',)}
+
+# Rows per UPDATE when backfilling search vectors on PostgreSQL
+BACKFILL_BATCH_SIZE = 10000
+
+
+def _sqlite_statements():
+    columns = ', '.join(LEAD_COLUMNS)
+    new_values = ', '.join(f'new.{c}' for c in LEAD_COLUMNS)
+    old_values = ', '.join(f'old.{c}' for c in LEAD_COLUMNS)
+    return [
+        # External-content FTS5 tables: the index stores only the postings,
+        # the text itself stays in lead / note
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS lead_fts USING fts5({columns}, content='lead', content_rowid='id')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS note_fts USING fts5(content, content='note', content_rowid='id')",
+
+        # Triggers keep the index in sync for every writer, including bulk inserts
+        f"""CREATE TRIGGER IF NOT EXISTS lead_fts_ai AFTER INSERT ON lead BEGIN
+            INSERT INTO lead_fts(rowid, {columns}) VALUES (new.id, {new_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS lead_fts_ad AFTER DELETE ON lead BEGIN
+            INSERT INTO lead_fts(lead_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS lead_fts_au AFTER UPDATE OF {columns} ON lead BEGIN
+            INSERT INTO lead_fts(lead_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO lead_fts(rowid, {columns}) VALUES (new.id, {new_values});
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS note_fts_ai AFTER INSERT ON note BEGIN
+            INSERT INTO note_fts(rowid, content) VALUES (new.id, new.content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS note_fts_ad AFTER DELETE ON note BEGIN
+            INSERT INTO note_fts(note_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS note_fts_au AFTER UPDATE OF content ON note BEGIN
+            INSERT INTO note_fts(note_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO note_fts(rowid, content) VALUES (new.id, new.content);
+        END""",
+
+        # Index the rows that existed before the index did
+        "INSERT INTO lead_fts(lead_fts) VALUES ('rebuild')",
+        "INSERT INTO note_fts(note_fts) VALUES ('rebuild')",
+    ]
+
+
+def _document(columns, row=''):
+    return " || ' ' || ".join(f"coalesce({row}{column}, '')" for column in columns)
+
+
+def _postgresql_search_vector(connection, table, columns):
+    """
+    Add table.search_vector as a plain nullable column, which needs no
+    table rewrite, keep it with a BEFORE trigger, backfill it in keyset
+    batches and index it with GIN
+    """
+    generated = connection.execute(text("""
+        SELECT is_generated FROM information_schema.columns
+        WHERE table_name = :table AND column_name = 'search_vector'
+    """), {'table': table}).scalar()
+    if generated is None:
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector'))
+
+    # Databases set up before migrations have a stored generated column,
+    # which PostgreSQL keeps up to date itself
+    if generated != 'ALWAYS':
+        function = f'{table}_search_vector'
+        connection.execute(text(f"""
+            CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := to_tsvector('simple', {_document(columns, 'NEW.')});
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """))
+        if not trigger_exists(connection, function):
+            connection.execute(text(f"""
+                CREATE TRIGGER {function} BEFORE INSERT OR UPDATE OF {', '.join(columns)} ON {table}
+                FOR EACH ROW EXECUTE FUNCTION {function}()
+            """))
+
+        last_id = 0
+        while True:
+            upper = connection.execute(text(f"""
+                SELECT max(id) FROM (
+                    SELECT id FROM {table} WHERE id > :last_id ORDER BY id LIMIT :batch_size
+                ) AS batch
+            """), {'last_id': last_id, 'batch_size': BACKFILL_BATCH_SIZE}).scalar()
+            if upper is None:
+                break
+            connection.execute(text(f"""
+                UPDATE {table} SET search_vector = to_tsvector('simple', {_document(columns)})
+                WHERE id > :last_id AND id <= :upper AND search_vector IS NULL
+            """), {'last_id': last_id, 'upper': upper})
+            last_id = upper
+
+    create_index(connection, f'ix_{table}_search_vector', table, ['search_vector'], using='gin')
+
+
+def upgrade(connection):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        for statement in _sqlite_statements():
+            connection.execute(text(statement))
+    elif dialect == 'postgresql':
+        for table, columns in SEARCH_COLUMNS.items():
+            _postgresql_search_vector(connection, table, columns)
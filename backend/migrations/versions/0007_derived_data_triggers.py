@@ -0,0 +1,155 @@
+"""
+Triggers keeping funnel_count in step with lead and lead_tag, and the
+counters built from the existing leads. The table version, change_seq and
+note counter triggers come from 0002 and 0003.
+"""
+from sqlalchemy import text
+from backend.migrations import trigger_exists
+
+# Installs the triggers and rebuilds the counters in one transaction, so no
+# write is counted twice or missed
+TRANSACTIONAL = True
+
+UPSERT = """
+    INSERT INTO funnel_count (dimension, value, status, count)
+    SELECT dimension, value, status, SUM(delta) FROM ({deltas}) AS deltas
+    WHERE true
+    GROUP BY dimension, value, status
+    HAVING SUM(delta) <> 0
+    ON CONFLICT (dimension, value, status) DO UPDATE SET count = funnel_count.count + excluded.count
+"""
+
+REBUILD = (
+    "DELETE FROM funnel_count",
+    """INSERT INTO funnel_count (dimension, value, status, count)
+    SELECT 'all', '', CAST(status AS VARCHAR), COUNT(*) FROM lead GROUP BY status""",
+    """INSERT INTO funnel_count (dimension, value, status, count)
+    SELECT 'resort', coalesce(resort, ''), CAST(status AS VARCHAR), COUNT(*) FROM lead
+    GROUP BY coalesce(resort, ''), status""",
+    """INSERT INTO funnel_count (dimension, value, status, count)
+    SELECT 'tag', CAST(lead_tag.tag_id AS VARCHAR), CAST(lead.status AS VARCHAR), COUNT(*)
+    FROM lead_tag JOIN lead ON lead.id = lead_tag.lead_id
+    GROUP BY lead_tag.tag_id, lead.status""",
+)
+
+
+def _upsert(deltas):
+    return UPSERT.format(deltas='\nUNION ALL\n'.join(deltas))
+
+
+def _delta(dimension, value, status, sign, source=''):
+    return f"SELECT {dimension} AS dimension, {value} AS value, {status} AS status, {sign} AS delta {source}"
+
+
+def _sqlite_lead_deltas(row, sign):
+    return [
+        _delta("'all'", "''", f'{row}.status', sign),
+        _delta("'resort'", f"coalesce({row}.resort, '')", f'{row}.status', sign),
+    ]
+
+
+def _sqlite_tag_deltas(row, sign):
+    return [_delta("'tag'", 'CAST(tag_id AS TEXT)', f'{row}.status', sign, f'FROM lead_tag WHERE lead_id = {row}.id')]
+
+
+def _sqlite_lead_tag_deltas(row, sign):
+    return [_delta("'tag'", f'CAST({row}.tag_id AS TEXT)', 'status', sign, f'FROM lead WHERE lead.id = {row}.lead_id')]
+
+
+def _sqlite_statements():
+    triggers = {
+        'funnel_count_lead_insert': ('AFTER INSERT ON lead', _sqlite_lead_deltas('new', 1)),
+        'funnel_count_lead_delete': (
+            'AFTER DELETE ON lead',
+            _sqlite_lead_deltas('old', -1) + _sqlite_tag_deltas('old', -1)
+        ),
+        # Bulk status changes count themselves once per statement instead
+        'funnel_count_lead_update': (
+            'AFTER UPDATE OF status, resort ON lead '
+            'WHEN NOT EXISTS (SELECT 1 FROM funnel_suspension) '
+            'AND (old.status IS NOT new.status OR old.resort IS NOT new.resort)',
+            _sqlite_lead_deltas('old', -1) + _sqlite_lead_deltas('new', 1)
+            + _sqlite_tag_deltas('old', -1) + _sqlite_tag_deltas('new', 1)
+        ),
+        'funnel_count_lead_tag_insert': ('AFTER INSERT ON lead_tag', _sqlite_lead_tag_deltas('new', 1)),
+        'funnel_count_lead_tag_delete': ('AFTER DELETE ON lead_tag', _sqlite_lead_tag_deltas('old', -1)),
+        'funnel_count_lead_tag_update': (
+            'AFTER UPDATE OF lead_id, tag_id ON lead_tag',
+            _sqlite_lead_tag_deltas('old', -1) + _sqlite_lead_tag_deltas('new', 1)
+        ),
+    }
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {_upsert(deltas)}; END"
+        for name, (event, deltas) in triggers.items()
+    ]
+
+
+def _postgresql_lead_deltas(rows, sign):
+    return [
+        _delta("'all'", "''", 'r.status::text', sign, f'FROM {rows} AS r'),
+        _delta("'resort'", "coalesce(r.resort, '')", 'r.status::text', sign, f'FROM {rows} AS r'),
+        _delta("'tag'", 'lt.tag_id::text', 'r.status::text', sign,
+               f'FROM {rows} AS r JOIN lead_tag AS lt ON lt.lead_id = r.id'),
+    ]
+
+
+def _postgresql_lead_tag_deltas(rows, sign):
+    return [_delta("'tag'", 'r.tag_id::text', 'l.status::text', sign, f'FROM {rows} AS r JOIN lead AS l ON l.id = r.lead_id')]
+
+
+def _postgresql_statements():
+    # Statement-level triggers over transition tables, so a 50k-row bulk
+    # status change is applied as one grouped upsert. PostgreSQL allows
+    # transition tables only on single-event triggers, hence one per event.
+    triggers = {
+        ('lead', 'INSERT'): _postgresql_lead_deltas('new_rows', 1),
+        ('lead', 'DELETE'): _postgresql_lead_deltas('old_rows', -1),
+        ('lead', 'UPDATE'): _postgresql_lead_deltas('old_rows', -1) + _postgresql_lead_deltas('new_rows', 1),
+        ('lead_tag', 'INSERT'): _postgresql_lead_tag_deltas('new_rows', 1),
+        ('lead_tag', 'DELETE'): _postgresql_lead_tag_deltas('old_rows', -1),
+        ('lead_tag', 'UPDATE'): _postgresql_lead_tag_deltas('old_rows', -1) + _postgresql_lead_tag_deltas('new_rows', 1),
+    }
+    statements = []
+    for (table, event), deltas in triggers.items():
+        name = f'funnel_count_{table}_{event.lower()}'
+        transitions = []
+        if event in ('UPDATE', 'DELETE'):
+            transitions.append('OLD TABLE AS old_rows')
+        if event in ('UPDATE', 'INSERT'):
+            transitions.append('NEW TABLE AS new_rows')
+        statements.append(f"""
+            CREATE OR REPLACE FUNCTION {name}() RETURNS trigger AS $$
+            BEGIN
+                {_upsert(deltas)};
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        statements.append(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+        statements.append(f"""
+            CREATE TRIGGER {name} AFTER {event} ON {table}
+            REFERENCING {' '.join(transitions)}
+            FOR EACH STATEMENT EXECUTE FUNCTION {name}()
+        """)
+    return statements
+
+
+def upgrade(connection):
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        statements = _sqlite_statements()
+    elif dialect == 'postgresql':
+        statements = _postgresql_statements()
+    else:
+        return
+    # Databases set up before migrations already have the triggers
+    if trigger_exists(connection, 'funnel_count_lead_insert'):
+        return
+
+    if dialect == 'postgresql':
+        # Block writers (not readers) so no delta lands between the delete and the recount
+        connection.execute(text('LOCK TABLE lead, lead_tag IN SHARE MODE'))
+    for statement in statements:
+        connection.execute(text(statement))
+    for statement in REBUILD:
+        connection.execute(text(statement))
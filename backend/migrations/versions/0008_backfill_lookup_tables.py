@@ -0,0 +1,14 @@
+"""
+Fill lead_phone and lead_block_key for leads written before they existed
+"""
+from backend.dedup import backfill_block_keys
+from backend.phones import backfill_phone_index
+
+# Each backfill batch commits by itself, and a table that has rows is skipped
+TRANSACTIONAL = False
+
+
+def upgrade(connection):
+    # The keys are computed by the same normalization lookups use
+    backfill_phone_index(connection)
+    backfill_block_keys(connection)
@@ -0,0 +1,84 @@
+"""
+On PostgreSQL, stamp lead.change_seq from the writing transaction's id
+instead of the 'lead' table_version row, so lead writers no longer queue
+on one row lock; the table version triggers go too. SQLite, which has a
+single writer, keeps the counter row. Needs PostgreSQL 13+.
+"""
+from sqlalchemy import text
+
+TRANSACTIONAL = True
+
+# Tables whose table_version_lead trigger is dropped
+VERSIONED_TABLES = ('lead', 'note', 'tag', 'lead_tag')
+
+
+def _statements(offset):
+    return [
+        # Transaction ids are handed out without locking and only grow; the
+        # offset keeps new values above those stamped from the counter
+        f"""CREATE OR REPLACE FUNCTION lead_change_seq() RETURNS bigint AS $$
+            SELECT pg_current_xact_id()::text::bigint + {offset}
+        $$ LANGUAGE sql VOLATILE""",
+        # Every transaction below the snapshot's xmin has finished, so no
+        # change_seq at or below this can still become visible
+        f"""CREATE OR REPLACE FUNCTION lead_change_watermark() RETURNS bigint AS $$
+            SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint + {offset} - 1
+        $$ LANGUAGE sql VOLATILE""",
+        # The highest visible change_seq, plus the transactions still open
+        # below it: when one of those commits, the highest value doesn't
+        # move but the list does
+        f"""CREATE OR REPLACE FUNCTION lead_change_version() RETURNS text AS $$
+            SELECT concat_ws('.', newest.seq, pruned.version, pending.xids)
+            FROM (
+                SELECT greatest(
+                    (SELECT coalesce(max(change_seq), 0) FROM lead),
+                    (SELECT coalesce(max(change_seq), 0) FROM lead_tombstone)
+                ) AS seq
+            ) AS newest,
+            (
+                SELECT coalesce(max(version), 0) AS version FROM table_version
+                WHERE name = 'lead_tombstone_floor'
+            ) AS pruned,
+            LATERAL (
+                SELECT string_agg(running::text, '.' ORDER BY running::text::bigint) AS xids
+                FROM pg_snapshot_xip(pg_current_snapshot()) AS running
+                WHERE running::text::bigint + {offset} < newest.seq
+            ) AS pending
+        $$ LANGUAGE sql VOLATILE""",
+        """CREATE OR REPLACE FUNCTION lead_changes_stamp() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_seq := lead_change_seq();
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql""",
+        """CREATE OR REPLACE FUNCTION lead_changes_tombstone() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO lead_tombstone (lead_id, change_seq, deleted_at)
+            SELECT id, lead_change_seq(), now() AT TIME ZONE 'utc' FROM old_rows;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        "DROP TRIGGER IF EXISTS lead_changes_bump ON lead",
+        "DROP FUNCTION IF EXISTS lead_changes_bump()",
+    ] + [
+        f"DROP TRIGGER IF EXISTS table_version_lead ON {table}" for table in VERSIONED_TABLES
+    ] + [
+        "DROP FUNCTION IF EXISTS table_version_bump_lead()",
+    ]
+
+
+def upgrade(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+    # Writers wait until the new stamps are in place, so nothing is stamped
+    # from the counter after the offset is taken; readers carry on
+    connection.execute(text('LOCK TABLE lead, lead_tombstone IN EXCLUSIVE MODE'))
+    offset = connection.execute(text("""
+        SELECT greatest(0, greatest(
+            (SELECT coalesce(max(change_seq), 0) FROM lead),
+            (SELECT coalesce(max(change_seq), 0) FROM lead_tombstone),
+            (SELECT coalesce(max(version), 0) FROM table_version WHERE name = 'lead')
+        ) + 1 - pg_current_xact_id()::text::bigint)
+    """)).scalar()
+    for statement in _statements(offset):
+        connection.execute(text(statement))
@@ -0,0 +1,165 @@
+"""
+Spread each funnel counter over FUNNEL_SLOTS rows on PostgreSQL, picked by
+lead id, so concurrent lead writers update different rows instead of
+queueing on the few overall ('all', '', status) counters. Readers sum the
+slots. SQLite serializes writers anyway and keeps everything in slot 0.
+"""
+from sqlalchemy import inspect, text
+
+TRANSACTIONAL = True
+
+FUNNEL_SLOTS = 16
+
+UPSERT = """
+    INSERT INTO funnel_count (dimension, value, status, slot, count)
+    SELECT dimension, value, status, slot, SUM(delta) FROM ({deltas}) AS deltas
+    WHERE true
+    GROUP BY dimension, value, status, slot
+    HAVING SUM(delta) <> 0
+    ON CONFLICT (dimension, value, status, slot) DO UPDATE SET count = funnel_count.count + excluded.count
+"""
+
+TRIGGER_EVENTS = (
+    ('lead', 'INSERT'), ('lead', 'DELETE'), ('lead', 'UPDATE'),
+    ('lead_tag', 'INSERT'), ('lead_tag', 'DELETE'), ('lead_tag', 'UPDATE'),
+)
+
+
+def _upsert(deltas):
+    return UPSERT.format(deltas='\nUNION ALL\n'.join(deltas))
+
+
+def _delta(dimension, value, status, slot, sign, source=''):
+    return (f"SELECT {dimension} AS dimension, {value} AS value, {status} AS status, "
+            f"{slot} AS slot, {sign} AS delta {source}")
+
+
+def _sqlite_lead_deltas(row, sign):
+    return [
+        _delta("'all'", "''", f'{row}.status', 0, sign),
+        _delta("'resort'", f"coalesce({row}.resort, '')", f'{row}.status', 0, sign),
+    ]
+
+
+def _sqlite_tag_deltas(row, sign):
+    return [_delta("'tag'", 'CAST(tag_id AS TEXT)', f'{row}.status', 0, sign,
+                   f'FROM lead_tag WHERE lead_id = {row}.id')]
+
+
+def _sqlite_lead_tag_deltas(row, sign):
+    return [_delta("'tag'", f'CAST({row}.tag_id AS TEXT)', 'status', 0, sign,
+                   f'FROM lead WHERE lead.id = {row}.lead_id')]
+
+
+def _sqlite_statements():
+    triggers = {
+        'funnel_count_lead_insert': ('AFTER INSERT ON lead', _sqlite_lead_deltas('new', 1)),
+        'funnel_count_lead_delete': (
+            'AFTER DELETE ON lead',
+            _sqlite_lead_deltas('old', -1) + _sqlite_tag_deltas('old', -1)
+        ),
+        # Bulk status changes count themselves once per statement instead
+        'funnel_count_lead_update': (
+            'AFTER UPDATE OF status, resort ON lead '
+            'WHEN NOT EXISTS (SELECT 1 FROM funnel_suspension) '
+            'AND (old.status IS NOT new.status OR old.resort IS NOT new.resort)',
+            _sqlite_lead_deltas('old', -1) + _sqlite_lead_deltas('new', 1)
+            + _sqlite_tag_deltas('old', -1) + _sqlite_tag_deltas('new', 1)
+        ),
+        'funnel_count_lead_tag_insert': ('AFTER INSERT ON lead_tag', _sqlite_lead_tag_deltas('new', 1)),
+        'funnel_count_lead_tag_delete': ('AFTER DELETE ON lead_tag', _sqlite_lead_tag_deltas('old', -1)),
+        'funnel_count_lead_tag_update': (
+            'AFTER UPDATE OF lead_id, tag_id ON lead_tag',
+            _sqlite_lead_tag_deltas('old', -1) + _sqlite_lead_tag_deltas('new', 1)
+        ),
+    }
+    return [
+        f"CREATE TRIGGER {name} {event} BEGIN {_upsert(deltas)}; END"
+        for name, (event, deltas) in triggers.items()
+    ]
+
+
+def _postgresql_lead_deltas(rows, sign):
+    slot = f'r.id % {FUNNEL_SLOTS}'
+    return [
+        _delta("'all'", "''", 'r.status::text', slot, sign, f'FROM {rows} AS r'),
+        _delta("'resort'", "coalesce(r.resort, '')", 'r.status::text', slot, sign, f'FROM {rows} AS r'),
+        _delta("'tag'", 'lt.tag_id::text', 'r.status::text', slot, sign,
+               f'FROM {rows} AS r JOIN lead_tag AS lt ON lt.lead_id = r.id'),
+    ]
+
+
+def _postgresql_lead_tag_deltas(rows, sign):
+    return [_delta("'tag'", 'r.tag_id::text', 'l.status::text', f'r.lead_id % {FUNNEL_SLOTS}', sign,
+                   f'FROM {rows} AS r JOIN lead AS l ON l.id = r.lead_id')]
+
+
+def _postgresql_functions():
+    deltas = {
+        ('lead', 'INSERT'): _postgresql_lead_deltas('new_rows', 1),
+        ('lead', 'DELETE'): _postgresql_lead_deltas('old_rows', -1),
+        ('lead', 'UPDATE'): _postgresql_lead_deltas('old_rows', -1) + _postgresql_lead_deltas('new_rows', 1),
+        ('lead_tag', 'INSERT'): _postgresql_lead_tag_deltas('new_rows', 1),
+        ('lead_tag', 'DELETE'): _postgresql_lead_tag_deltas('old_rows', -1),
+        ('lead_tag', 'UPDATE'): _postgresql_lead_tag_deltas('old_rows', -1) + _postgresql_lead_tag_deltas('new_rows', 1),
+    }
+    # The triggers from 0007 keep calling these by name
+    return [
+        f"""
+            CREATE OR REPLACE FUNCTION funnel_count_{table}_{event.lower()}() RETURNS trigger AS $$
+            BEGIN
+                {_upsert(deltas[(table, event)])};
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """
+        for table, event in TRIGGER_EVENTS
+    ]
+
+
+def _sqlite_upgrade(connection):
+    # Triggers go first: renaming a table checks every trigger that names it
+    for table, event in TRIGGER_EVENTS:
+        connection.execute(text(f'DROP TRIGGER IF EXISTS funnel_count_{table}_{event.lower()}'))
+
+    columns = {column['name'] for column in inspect(connection).get_columns('funnel_count')}
+    if 'slot' not in columns:
+        # SQLite can't change a primary key in place
+        connection.execute(text("""
+            CREATE TABLE funnel_count_slotted (
+                dimension VARCHAR(20) NOT NULL,
+                value VARCHAR(100) NOT NULL,
+                status VARCHAR(20) NOT NULL,
+                slot INTEGER DEFAULT 0 NOT NULL,
+                count BIGINT NOT NULL,
+                PRIMARY KEY (dimension, value, status, slot)
+            )
+        """))
+        connection.execute(text("""
+            INSERT INTO funnel_count_slotted (dimension, value, status, slot, count)
+            SELECT dimension, value, status, 0, count FROM funnel_count
+        """))
+        connection.execute(text('DROP TABLE funnel_count'))
+        connection.execute(text('ALTER TABLE funnel_count_slotted RENAME TO funnel_count'))
+
+    for statement in _sqlite_statements():
+        connection.execute(text(statement))
+
+
+def _postgresql_upgrade(connection):
+    # Block writers (not readers) while the key and the triggers change
+    connection.execute(text('LOCK TABLE lead, lead_tag IN SHARE MODE'))
+    columns = {column['name'] for column in inspect(connection).get_columns('funnel_count')}
+    if 'slot' not in columns:
+        connection.execute(text('ALTER TABLE funnel_count ADD COLUMN slot INTEGER NOT NULL DEFAULT 0'))
+        connection.execute(text('ALTER TABLE funnel_count DROP CONSTRAINT funnel_count_pkey'))
+        connection.execute(text('ALTER TABLE funnel_count ADD PRIMARY KEY (dimension, value, status, slot)'))
+    for statement in _postgresql_functions():
+        connection.execute(text(statement))
+
+
+def upgrade(connection):
+    if connection.dialect.name == 'sqlite':
+        _sqlite_upgrade(connection)
+    elif connection.dialect.name == 'postgresql':
+        _postgresql_upgrade(connection)
@@ -2,6 +2,9 @@ from backend.app import db
 from datetime import datetime
 from sqlalchemy import Enum
 
+# Campaign workflow states, in funnel order
+LEAD_STATUSES = ('NEW', 'SENT', 'REPLIED', 'BOOKED')
+
 class Lead(db.Model):
     """
     Lead model representing potential customers in the CRM.
@@ -11,12 +14,13 @@ class Lead(db.Model):
     last_name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     status = db.Column(
-        Enum('NEW', 'SENT', 'REPLIED', 'BOOKED', name='lead_status'),
+        Enum(*LEAD_STATUSES, name='lead_status'),
         default='NEW',
-        nullable=False
+        nullable=False,
+        index=True
     )
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
     # New fields
     address = db.Column(db.String(255))
@@ -34,11 +38,47 @@ class Lead(db.Model):
     phone_3 = db.Column(db.String(20))
     phone_4 = db.Column(db.String(20))
 
+    # Stamped by database triggers on every write; see backend.changes
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+
+    # Maintained by database triggers on note; see backend.notes
+    notes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    latest_note_id = db.Column(db.Integer)
+
     # Relationship with notes
-    notes = db.relationship('Note', backref='lead', lazy=True, cascade="all, delete-orphan")
-    tags = db.relationship('Tag', secondary='lead_tag', backref=db.backref('leads', lazy='dynamic'))
+    notes = db.relationship('Note', backref='lead', lazy=True, cascade="all, delete-orphan", order_by='Note.id')
+    latest_note = db.relationship(
+        'Note', primaryjoin='Lead.latest_note_id == Note.id', foreign_keys=[latest_note_id], viewonly=True
+    )
+    phones = db.relationship('LeadPhone', backref='lead', lazy=True, cascade="all, delete-orphan")
+    block_keys = db.relationship('LeadBlockKey', backref='lead', lazy=True, cascade="all, delete-orphan")
+    tags = db.relationship('Tag', secondary='lead_tag', backref=db.backref('leads', lazy='dynamic'), order_by='Tag.id')
+
+    __table_args__ = (
+        db.Index('ix_lead_change_seq_id', 'change_seq', 'id'),
+    )
+
+    # Relationships that to_dict() can embed
+    RELATIONSHIPS = ('notes', 'tags', 'latest_note')
+
+    # Embedded unless ?include= says otherwise; full notes are paged separately
+    DEFAULT_INCLUDE = ('tags', 'latest_note')
+
+    # Scalar keys that to_dict() can emit
+    SERIALIZABLE_FIELDS = (
+        'id', 'first_name', 'last_name', 'email', 'status', 'created_at', 'updated_at',
+        'address', 'zip', 'resort', 'mortgaged', 'phone_1', 'phone_2', 'phone_3', 'phone_4',
+        'last_text_sent', 'last_text_content', 'last_response', 'response_timestamp', 'notes_count'
+    )
     
-    def to_dict(self):
+    def to_dict(self, fields=None, include=DEFAULT_INCLUDE):
+        """
+        Serialize the lead.
+
+        fields limits the scalar keys (None means all of them) and include
+        names the relationships to embed. List endpoints should eager-load
+        the included relationships so this does not lazy-load per lead.
+        """
         result = {
             'id': self.id,
             'first_name': self.first_name,
@@ -59,9 +99,16 @@ class Lead(db.Model):
             'last_text_content': self.last_text_content,
             'last_response': self.last_response,
             'response_timestamp': self.response_timestamp.isoformat() if self.response_timestamp else None,
-            'notes': [note.to_dict() for note in self.notes],
-            'tags': [tag.to_dict() for tag in self.tags]
+            'notes_count': self.notes_count
         }
+        if fields is not None:
+            result = {key: result[key] for key in fields}
+        if 'notes' in include:
+            result['notes'] = [note.to_dict() for note in self.notes]
+        if 'tags' in include:
+            result['tags'] = [tag.to_dict() for tag in self.tags]
+        if 'latest_note' in include:
+            result['latest_note'] = self.latest_note.preview() if self.latest_note else None
         return result
 
 
@@ -74,6 +121,14 @@ class Note(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=False)
+
+    __table_args__ = (
+        # A lead's notes newest first; also serves plain lead_id lookups
+        db.Index('ix_note_lead_id_created_at', 'lead_id', 'created_at'),
+    )
+
+    # Characters of content kept in a lead's latest_note preview
+    PREVIEW_LENGTH = 140
     
     def to_dict(self):
         return {
@@ -84,6 +139,22 @@ class Note(db.Model):
             'lead_id': self.lead_id
         }
 
+    @classmethod
+    def preview_dict(cls, note_id, content, created_at):
+        """
+        Short form of a note embedded in lead payloads; created_at is passed
+        through as given
+        """
+        return {
+            'id': note_id,
+            'content': content[:cls.PREVIEW_LENGTH],
+            'truncated': len(content) > cls.PREVIEW_LENGTH,
+            'created_at': created_at
+        }
+
+    def preview(self):
+        return self.preview_dict(self.id, self.content, self.created_at.isoformat())
+
 
 class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -100,3 +171,189 @@ class LeadTag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=False)
     tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), nullable=False)
+
+    __table_args__ = (
+        # Lead -> tags lookups, including the funnel counter triggers
+        db.Index('ix_lead_tag_lead_id_tag_id', 'lead_id', 'tag_id'),
+        # Tag -> leads lookups for tag filters; a lead carries a tag at most once
+        db.Index('uq_lead_tag_tag_id_lead_id', 'tag_id', 'lead_id', unique=True),
+    )
+
+
+class LeadPhone(db.Model):
+    """
+    Normalized (E.164) copy of a lead's phone_1..phone_4 columns, used to
+    resolve a phone number to its lead(s) with one index probe. Rows are
+    maintained by backend.phones; never write them directly.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    phone = db.Column(db.String(16), nullable=False)
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id', ondelete='CASCADE'), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('phone', 'lead_id', name='uq_lead_phone_phone_lead_id'),
+    )
+
+
+class LeadBlockKey(db.Model):
+    """
+    Normalized blocking key of a lead (e.g. 'name_zip:smith|02134'); leads
+    sharing a key are the only ones compared for duplicates. Rows are
+    maintained by backend.dedup; never write them directly.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(200), nullable=False)
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id', ondelete='CASCADE'), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('key', 'lead_id', name='uq_lead_block_key_key_lead_id'),
+        db.Index('ix_lead_block_key_lead_id', 'lead_id'),
+    )
+
+
+class LeadDuplicate(db.Model):
+    """
+    A scored pair of leads that look like the same person, found by
+    backend.dedup. lead_id is always the lower id of the pair.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id', ondelete='CASCADE'), nullable=False)
+    duplicate_id = db.Column(db.Integer, db.ForeignKey('lead.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    reasons = db.Column(db.JSON, nullable=False, default=list)
+    detected_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('lead_id', 'duplicate_id', name='uq_lead_duplicate_lead_id_duplicate_id'),
+        db.Index('ix_lead_duplicate_duplicate_id', 'duplicate_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'lead_id': self.lead_id,
+            'duplicate_id': self.duplicate_id,
+            'score': self.score,
+            'reasons': self.reasons,
+            'detected_at': self.detected_at.isoformat()
+        }
+
+
+class Campaign(db.Model):
+    """
+    Outbound SMS campaign: a message template sent to the leads matching a
+    filter spec. Recipients are materialized into CampaignMessage rows.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    template = db.Column(db.Text, nullable=False)
+    filter_spec = db.Column(db.JSON, nullable=False, default=dict)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'template': self.template,
+            'filter': self.filter_spec,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+
+class CampaignMessage(db.Model):
+    """
+    One recipient of a campaign. status moves pending -> claimed -> sent or
+    failed; claimed rows whose lease has expired are picked up again, so a
+    crashed run resumes where it stopped.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id', ondelete='CASCADE'), nullable=False)
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(
+        Enum('pending', 'claimed', 'sent', 'failed', name='campaign_message_status'),
+        default='pending',
+        nullable=False
+    )
+    claim_token = db.Column(db.String(36))
+    claimed_at = db.Column(db.DateTime)
+    sent_at = db.Column(db.DateTime)
+    from_number = db.Column(db.String(16))
+    provider_message_id = db.Column(db.String(100))
+    error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'lead_id', name='uq_campaign_message_campaign_id_lead_id'),
+        db.Index('ix_campaign_message_campaign_id_status', 'campaign_id', 'status'),
+    )
+
+
+class RateLimitBucket(db.Model):
+    """
+    Shared token bucket state, so every worker process draws from the same
+    send rate
+    """
+    name = db.Column(db.String(100), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)
+
+
+class TableVersion(db.Model):
+    """
+    Monotonic change counters, bumped by database triggers on every write to
+    the tables behind a payload; used to build cheap ETags. On PostgreSQL the
+    'lead' row is no longer bumped (see backend.versioning.current_version)
+    """
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class FunnelCount(db.Model):
+    """
+    Lead counts per status, overall ('all') and per breakdown value (a
+    resort name, a tag id). Maintained in the same transaction as the lead
+    write, by database triggers or, for bulk status changes on SQLite, by
+    backend.funnel.counted_status_change; rebuilt from scratch by backend.funnel.
+    On PostgreSQL each count is spread over slot rows picked by lead id, so
+    concurrent writers don't contend for one row; readers sum the slots.
+    """
+    dimension = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.String(100), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    slot = db.Column(db.Integer, primary_key=True, default=0, server_default='0', autoincrement=False)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class FunnelSuspension(db.Model):
+    """
+    Has a row only inside a transaction that counts its own lead status
+    changes (see backend.funnel.counted_status_change); the SQLite per-row
+    update trigger skips rows while it does
+    """
+    id = db.Column(db.Integer, primary_key=True)
+
+
+class SchemaMigration(db.Model):
+    """
+    Migrations applied to this database; maintained by backend.migrations
+    """
+    version = db.Column(db.String(4), primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class LeadTombstone(db.Model):
+    """
+    Record of a deleted lead, written by a database trigger so that delta
+    sync clients learn about deletes
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    lead_id = db.Column(db.Integer, nullable=False)
+    change_seq = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_lead_tombstone_change_seq_id', 'change_seq', 'id'),
+        db.Index('ix_lead_tombstone_deleted_at', 'deleted_at'),
+    )
@@ -0,0 +1,112 @@
+import logging
+from collections import defaultdict, deque
+from datetime import datetime
+from sqlalchemy import insert, select
+from backend.app import db
+from backend.models import Lead, Note
+from backend.pagination import paginate
+
+logger = logging.getLogger(__name__)
+
+# Newest first, backed by ix_note_lead_id_created_at
+NOTES_SORT = '-created_at'
+
+# Most notes accepted by one POST /api/notes/batch
+MAX_BATCH_NOTES = 5000
+
+# Rows per multi-row INSERT; also bounds the lead id IN list
+INSERT_CHUNK_SIZE = 1000
+
+class NoteBatchError(ValueError):
+    """
+    Raised when a batch of notes is malformed as a whole
+    """
+
+
+def notes_page(lead_id, limit, cursor=None):
+    """
+    One page of a lead's notes, newest first. Returns (notes, next_cursor).
+    """
+    query = Note.query.filter(Note.lead_id == lead_id)
+    return paginate(query, Note, limit, cursor=cursor, sort=NOTES_SORT)
+
+
+def _validate_item(item):
+    """
+    Returns (lead_id, content, error)
+    """
+    if not isinstance(item, dict):
+        return None, None, 'Each note must be an object'
+    lead_id = item.get('lead_id')
+    content = item.get('content')
+    if not isinstance(lead_id, int) or isinstance(lead_id, bool):
+        return lead_id, None, 'lead_id must be an integer'
+    if not isinstance(content, str) or not content.strip():
+        return lead_id, None, 'Note content is required'
+    return lead_id, content, None
+
+
+def create_notes(items):
+    """
+    Add notes to many leads at once. items is a list of
+    {"lead_id": ..., "content": ...}.
+
+    Lead ids are checked with one IN query and the valid notes are written
+    with one multi-row INSERT ... RETURNING per INSERT_CHUNK_SIZE notes, so
+    a thousand notes cost two round-trips. Returns one result per item, in
+    order. The caller commits.
+    """
+    if not isinstance(items, list):
+        raise NoteBatchError('notes must be a list')
+    if len(items) > MAX_BATCH_NOTES:
+        raise NoteBatchError(f'At most {MAX_BATCH_NOTES} notes per batch')
+
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        lead_id, content, error = _validate_item(item)
+        if error:
+            results[index] = {'index': index, 'lead_id': lead_id, 'success': False, 'error': error}
+        else:
+            valid.append((index, lead_id, content))
+
+    lead_ids = sorted({lead_id for _, lead_id, _ in valid})
+    found = set()
+    for start in range(0, len(lead_ids), INSERT_CHUNK_SIZE):
+        chunk = lead_ids[start:start + INSERT_CHUNK_SIZE]
+        found.update(db.session.execute(select(Lead.id).where(Lead.id.in_(chunk))).scalars())
+
+    rows = []
+    for index, lead_id, content in valid:
+        if lead_id not in found:
+            results[index] = {'index': index, 'lead_id': lead_id, 'success': False, 'error': 'Lead not found'}
+        else:
+            rows.append((index, lead_id, content))
+
+    now = datetime.utcnow()
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + INSERT_CHUNK_SIZE]
+        # A single INSERT ... VALUES (...), (...) statement. RETURNING rows
+        # come back in no guaranteed order, so they are matched to the
+        # request by (lead_id, content); identical notes are interchangeable
+        inserted = defaultdict(deque)
+        for note in db.session.execute(
+            insert(Note.__table__)
+            .values([
+                {'lead_id': lead_id, 'content': content, 'created_at': now, 'updated_at': now}
+                for _, lead_id, content in chunk
+            ])
+            .returning(Note.id, Note.lead_id, Note.content, Note.created_at, Note.updated_at)
+        ):
+            inserted[note.lead_id, note.content].append(note)
+        for index, lead_id, content in chunk:
+            note = inserted[lead_id, content].popleft()
+            results[index] = {
+                'index': index,
+                'lead_id': note.lead_id,
+                'success': True,
+                # Transient, never added to the session; just for to_dict()
+                'note': Note(**note._mapping).to_dict()
+            }
+
+    return results
@@ -0,0 +1,111 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+# Page size bounds for list endpoints
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+# Supported keyset orderings; every ordering ends in the primary key, and a
+# leading '-' sorts newest first
+SORT_KEYS = ('id', 'updated_at', '-created_at')
+
+# Sort columns whose cursor values are datetimes
+DATETIME_COLUMNS = ('created_at', 'updated_at')
+
+# Orderings whose cursor is a float score and an id, e.g. search relevance
+SCORE_SORTS = ('search',)
+
+
+class PaginationError(ValueError):
+    """
+    Raised when a limit, sort or cursor parameter is invalid
+    """
+
+
+def parse_limit(value):
+    """
+    Parse the ?limit= parameter, clamping it to MAX_LIMIT
+    """
+    if value is None or value == '':
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise PaginationError('limit must be an integer')
+    if limit < 1:
+        raise PaginationError('limit must be positive')
+    return min(limit, MAX_LIMIT)
+
+
+def encode_cursor(sort, values):
+    """
+    Encode the keyset position of the last returned row as an opaque token
+    """
+    payload = [sort] + [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, sort):
+    """
+    Decode a cursor produced by encode_cursor for the given sort order
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if payload[0] != sort:
+            raise PaginationError('cursor does not match sort order')
+        if sort.lstrip('-') in DATETIME_COLUMNS:
+            return [datetime.fromisoformat(payload[1]), int(payload[2])]
+        if sort in SCORE_SORTS:
+            return [float(payload[1]), int(payload[2])]
+        return [int(value) for value in payload[1:]]
+    except PaginationError:
+        raise
+    except Exception:
+        raise PaginationError('Invalid cursor')
+
+
+def sort_column_names(sort):
+    """
+    Names of the columns a sort orders by, e.g. ['updated_at', 'id']
+    """
+    if sort not in SORT_KEYS:
+        raise PaginationError(f"sort must be one of: {', '.join(SORT_KEYS)}")
+    name = sort.lstrip('-')
+    return ['id'] if name == 'id' else [name, 'id']
+
+
+def paginate(query, model, limit, cursor=None, sort='id'):
+    """
+    Apply keyset pagination to a query.
+
+    Rows are ordered by the sort column(s) and the primary key, and the cursor
+    is turned into a WHERE clause on those columns, so every page costs an
+    index range scan regardless of how deep into the table it is.
+
+    Returns a (items, next_cursor) tuple; next_cursor is None on the last page.
+    """
+    columns = [getattr(model, name) for name in sort_column_names(sort)]
+    descending = sort.startswith('-')
+
+    if cursor:
+        values = decode_cursor(cursor, sort)
+        if len(columns) == 1:
+            key, position = columns[0], values[0]
+        else:
+            key, position = tuple_(*columns), tuple_(*values)
+        query = query.filter(key < position if descending else key > position)
+
+    order = [column.desc() for column in columns] if descending else columns
+    items = query.order_by(*order).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(sort, [getattr(last, c.key) for c in columns])
+
+    return items, next_cursor
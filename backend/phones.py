@@ -0,0 +1,149 @@
+import logging
+import re
+from sqlalchemy import event, insert, inspect, select
+from backend.app import db
+from backend.models import Lead, LeadPhone
+
+logger = logging.getLogger(__name__)
+
+# Lead columns mirrored into lead_phone
+PHONE_COLUMNS = ('phone_1', 'phone_2', 'phone_3', 'phone_4')
+
+# Country code assumed for numbers written without one (NANP)
+DEFAULT_COUNTRY_CODE = '1'
+
+_NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_phone(raw):
+    """
+    Normalize a free-text phone number to E.164 (e.g. '+14176191055').
+
+    Ten-digit numbers get DEFAULT_COUNTRY_CODE; numbers written with a
+    leading '+' or '00' keep their own country code. Returns None when the
+    value cannot be a valid E.164 number.
+    """
+    if not raw:
+        return None
+    text = str(raw).strip()
+    digits = _NON_DIGITS.sub('', text)
+
+    if text.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif len(digits) == 10:
+        digits = DEFAULT_COUNTRY_CODE + digits
+    elif not (len(digits) == 11 and digits.startswith(DEFAULT_COUNTRY_CODE)):
+        return None
+
+    if not 8 <= len(digits) <= 15 or digits.startswith('0'):
+        return None
+    return '+' + digits
+
+
+def normalized_phones(values):
+    """
+    Return the distinct valid E.164 numbers among values, in order
+    """
+    phones = []
+    for value in values:
+        phone = normalize_phone(value)
+        if phone and phone not in phones:
+            phones.append(phone)
+    return phones
+
+
+def _sync_lead_phones(lead):
+    """
+    Reconcile lead.phones with the lead's phone columns, keeping rows for
+    numbers that didn't change so the unique index never sees a transient
+    duplicate within the flush
+    """
+    wanted = normalized_phones(getattr(lead, column) for column in PHONE_COLUMNS)
+    for row in list(lead.phones):
+        if row.phone in wanted:
+            wanted.remove(row.phone)
+        else:
+            lead.phones.remove(row)
+    for phone in wanted:
+        lead.phones.append(LeadPhone(phone=phone))
+
+
+def _phones_changed(lead):
+    state = inspect(lead)
+    return any(state.attrs[column].history.has_changes() for column in PHONE_COLUMNS)
+
+
+def _before_flush(session, flush_context, instances):
+    for lead in session.new:
+        if isinstance(lead, Lead):
+            _sync_lead_phones(lead)
+    for lead in session.dirty:
+        if isinstance(lead, Lead) and _phones_changed(lead):
+            _sync_lead_phones(lead)
+
+
+def install_phone_sync():
+    """
+    Keep lead_phone in step with every ORM insert or update of a lead.
+    Core bulk inserts bypass the ORM and must call index_phones_for_emails.
+    """
+    if not event.contains(db.session, 'before_flush', _before_flush):
+        event.listen(db.session, 'before_flush', _before_flush)
+
+
+def _phone_rows(lead_rows):
+    rows = []
+    for lead_id, *values in lead_rows:
+        rows.extend({'lead_id': lead_id, 'phone': phone} for phone in normalized_phones(values))
+    return rows
+
+
+def index_phones_for_emails(emails):
+    """
+    Index the phones of freshly bulk-inserted leads, found by email with one
+    IN query, using one multi-row INSERT. The caller commits.
+    """
+    columns = [getattr(Lead, column) for column in PHONE_COLUMNS]
+    lead_rows = db.session.execute(select(Lead.id, *columns).where(Lead.email.in_(emails)))
+    rows = _phone_rows(lead_rows)
+    if rows:
+        db.session.execute(insert(LeadPhone), rows)
+
+
+def backfill_phone_index(connection, batch_size=10000):
+    """
+    Populate lead_phone from the lead table when it is empty; run by
+    migration 0008 for leads written before lead_phone was introduced.
+    On an autocommit connection, such as the migration's, each batch
+    commits as it goes.
+    """
+    if connection.execute(select(LeadPhone.id).limit(1)).first() is not None:
+        return
+
+    columns = [getattr(Lead, column) for column in PHONE_COLUMNS]
+    last_id = 0
+    indexed = 0
+    while True:
+        lead_rows = connection.execute(
+            select(Lead.id, *columns).where(Lead.id > last_id).order_by(Lead.id).limit(batch_size)
+        ).all()
+        if not lead_rows:
+            break
+        last_id = lead_rows[-1][0]
+        rows = _phone_rows(lead_rows)
+        if rows:
+            connection.execute(insert(LeadPhone), rows)
+            indexed += len(rows)
+    logger.debug(f"Backfilled {indexed} lead phone numbers")
+
+
+def find_lead_ids_by_phone(phone):
+    """
+    Return the ids of the leads that have the (already normalized) phone
+    """
+    return [
+        lead_id for (lead_id,) in
+        db.session.execute(select(LeadPhone.lead_id).where(LeadPhone.phone == phone).order_by(LeadPhone.lead_id))
+    ]
@@ -0,0 +1,311 @@
+"""
+Opt-in per-request profiling for finding where a route's time goes under
+real traffic.
+
+A request is profiled when it carries PROFILER_SECRET in the X-Profile
+header, or, with PROFILER_ENABLED, for a PROFILER_SAMPLE_RATE fraction of
+requests. The default 'sample' mode has one background thread read the
+profiled request's stack every PROFILER_INTERVAL seconds, which costs the
+request next to nothing; 'cprofile' traces every call instead and is used
+when the interpreter can't read other threads' stacks. Profiles are kept
+per route in this process and listed at /api/debug/profiles, with sampled
+stacks in the collapsed format flamegraph.pl and speedscope read.
+"""
+import cProfile
+import hmac
+import itertools
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from flask import g, request
+from backend.metrics import UNMATCHED_ROUTE
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the request profiler; override in app.config
+DEFAULT_PROFILER_CONFIG = {
+    # Profile a PROFILER_SAMPLE_RATE fraction of all requests
+    'PROFILER_ENABLED': False,
+    'PROFILER_SAMPLE_RATE': 0.01,
+    # Requests sending this in X-Profile are always profiled; None disables the header
+    'PROFILER_SECRET': None,
+    # 'sample' or 'cprofile'
+    'PROFILER_MODE': 'sample',
+    # Seconds between stack samples
+    'PROFILER_INTERVAL': 0.005,
+    # Profiles kept per route; the oldest are dropped first
+    'PROFILER_PROFILES_PER_ROUTE': 20,
+}
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+PROFILER_MODES = ('sample', 'cprofile')
+
+# Functions listed per cProfile profile, by cumulative time
+CPROFILE_TOP_FUNCTIONS = 50
+
+
+class ProfilerError(ValueError):
+    """
+    Raised for an unknown profiler mode
+    """
+
+
+def _short_filename(filename):
+    # Paths under the project are shown relative to it, the rest by file name
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if filename.startswith(root + os.sep):
+        return os.path.relpath(filename, root)
+    return os.path.basename(filename)
+
+
+_labels = {}
+
+
+def _frame_label(code):
+    label = _labels.get(code)
+    if label is None:
+        label = f'{code.co_qualname} ({_short_filename(code.co_filename)}:{code.co_firstlineno})'
+        # ';' separates frames in the collapsed format
+        label = _labels[code] = label.replace(';', ':')
+    return label
+
+
+def collapse_stack(frame):
+    """
+    A frame's call stack as 'outermost;...;innermost'
+    """
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """
+    One daemon thread sampling the stacks of every thread being profiled.
+    It starts with the first profiled request and exits when none are left.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._targets[thread_id] = Counter()
+            # Threads don't survive a fork, so check it's still running
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        """
+        The stacks sampled for thread_id, as {collapsed stack: samples}
+        """
+        with self._lock:
+            return self._targets.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                if not self._targets:
+                    self._thread = None
+                    return
+                for thread_id, stacks in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[collapse_stack(frame)] += 1
+
+
+def _cprofile_functions(profile):
+    rows = []
+    for (filename, line, name), (_, calls, total, cumulative, _) in pstats.Stats(profile).stats.items():
+        rows.append({
+            'function': f'{name} ({_short_filename(filename)}:{line})',
+            'calls': calls,
+            'total_ms': round(total * 1000, 3),
+            'cumulative_ms': round(cumulative * 1000, 3),
+        })
+    rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+    return rows[:CPROFILE_TOP_FUNCTIONS]
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile, records them and keeps the results
+    per route
+    """
+
+    def __init__(self, enabled, sample_rate, secret, mode, interval, per_route):
+        if mode not in PROFILER_MODES:
+            raise ProfilerError(f"PROFILER_MODE must be one of {', '.join(PROFILER_MODES)}")
+        if mode == 'sample' and not hasattr(sys, '_current_frames'):
+            logger.info("Stack sampling is unavailable on this interpreter; profiling with cProfile")
+            mode = 'cprofile'
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.mode = mode
+        self.per_route = per_route
+        self._sampler = StackSampler(interval)
+        self._profiles = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def authorized(self, headers):
+        """
+        Whether headers carry the profiler secret, or no secret is needed;
+        also guards /api/debug/slow-queries
+        """
+        if self.secret:
+            return hmac.compare_digest(headers.get(PROFILE_HEADER, '').encode(), self.secret.encode())
+        return self.enabled
+
+    def should_profile(self, headers):
+        if self.secret and PROFILE_HEADER in headers:
+            return self.authorized(headers)
+        return self.enabled and random.random() < self.sample_rate
+
+    def start(self):
+        """
+        Begin profiling the current thread; returns what stop() needs, or
+        None if it can't be profiled now
+        """
+        if self.mode == 'cprofile':
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Python 3.12+ allows one cProfile at a time per process
+                return None
+            return profile
+        thread_id = threading.get_ident()
+        self._sampler.start(thread_id)
+        return thread_id
+
+    def stop(self, token):
+        """
+        End profiling; returns the sampled stacks or the cProfile functions
+        """
+        if self.mode == 'cprofile':
+            token.disable()
+            return _cprofile_functions(token)
+        return self._sampler.stop(token)
+
+    def record(self, route, method, status, seconds, result):
+        profile = {
+            'id': next(self._ids),
+            'route': route,
+            'method': method,
+            'status': status,
+            'at': datetime.utcnow().isoformat(),
+            'duration_ms': round(seconds * 1000, 3),
+            'mode': self.mode,
+        }
+        if self.mode == 'cprofile':
+            profile['functions'] = result
+        else:
+            profile['samples'] = sum(result.values())
+            profile['stacks'] = dict(result)
+        with self._lock:
+            profiles = self._profiles.get(route)
+            if profiles is None:
+                profiles = self._profiles[route] = deque(maxlen=self.per_route)
+            profiles.append(profile)
+        return profile
+
+    def profiles(self, route=None):
+        """
+        Kept profiles, newest first, optionally for one route
+        """
+        with self._lock:
+            if route is not None:
+                kept = list(self._profiles.get(route, ()))
+            else:
+                kept = [profile for profiles in self._profiles.values() for profile in profiles]
+        return sorted(kept, key=lambda profile: profile['id'], reverse=True)
+
+    def get(self, profile_id):
+        for profile in self.profiles():
+            if profile['id'] == profile_id:
+                return profile
+        return None
+
+
+def summary(profile):
+    """
+    A profile without its stacks or functions, for listings
+    """
+    return {key: value for key, value in profile.items() if key not in ('stacks', 'functions')}
+
+
+def collapsed(profiles):
+    """
+    The sampled stacks of profiles merged into collapsed-stack text, one
+    'frame;frame;frame count' line per distinct stack
+    """
+    merged = Counter()
+    for profile in profiles:
+        merged.update(profile.get('stacks', {}))
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(merged.items()))
+
+
+def init_profiler(app):
+    """
+    Profile the requests selected by header or sampling, and attach the
+    profiler to the app
+    """
+    for key, value in DEFAULT_PROFILER_CONFIG.items():
+        app.config.setdefault(key, value)
+    profiler = RequestProfiler(
+        app.config['PROFILER_ENABLED'],
+        app.config['PROFILER_SAMPLE_RATE'],
+        app.config['PROFILER_SECRET'],
+        app.config['PROFILER_MODE'],
+        app.config['PROFILER_INTERVAL'],
+        app.config['PROFILER_PROFILES_PER_ROUTE'],
+    )
+    app.extensions['profiler'] = profiler
+    if not profiler.enabled and not profiler.secret:
+        return profiler
+
+    def before_request():
+        if profiler.should_profile(request.headers):
+            token = profiler.start()
+            if token is not None:
+                g.profile_token = token
+                g.profile_started = time.perf_counter()
+
+    def after_request(response):
+        started = g.pop('profile_started', None)
+        if started is None:
+            return response
+        result = profiler.stop(g.pop('profile_token'))
+        route = request.url_rule.rule if request.url_rule is not None else UNMATCHED_ROUTE
+        profile = profiler.record(route, request.method, response.status_code,
+                                  time.perf_counter() - started, result)
+        response.headers[PROFILE_ID_HEADER] = str(profile['id'])
+        return response
+
+    def teardown_request(exception):
+        # after_request didn't run; don't leave the thread being sampled
+        if g.pop('profile_started', None) is not None:
+            profiler.stop(g.pop('profile_token'))
+
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    return profiler
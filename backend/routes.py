@@ -1,8 +1,26 @@
 import logging
 import os
-from flask import jsonify, request, send_from_directory, current_app
+from flask import Response, jsonify, request, send_from_directory, current_app, stream_with_context
+from sqlalchemy import or_, select
 from backend.app import db
-from backend.models import Lead, Note
+from backend.bulk import BulkUpdateError, bulk_update_status, bulk_update_tags
+from backend.changes import SyncTokenExpired, lead_changes
+from backend.dedup import DedupError, detect_duplicates, merge_leads
+from backend.dispatcher import DispatchError, campaign_progress, create_campaign
+from backend.exporter import EXPORT_FORMATS, EXPORT_MIMETYPES, generate_export
+from backend.filters import FilterError, lead_filter_clauses
+from backend.funnel import FunnelError, funnel_counts, tag_counts
+from backend.importer import DEFAULT_BATCH_SIZE, ImportFormatError, detect_format, import_leads
+from backend.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render as render_metrics
+from backend.models import Campaign, Lead, LeadDuplicate, Note
+from backend.notes import NoteBatchError, create_notes, notes_page
+from backend.pagination import PaginationError, decode_cursor, encode_cursor, paginate, parse_limit, sort_column_names
+from backend.phones import PHONE_COLUMNS, find_lead_ids_by_phone, normalize_phone
+from backend.profiler import collapsed, summary as profile_summary
+from backend.search import search_leads, search_truncated
+from backend.sms import PROVIDERS, PayloadError
+from backend.versioning import current_version, make_etag, not_modified, request_etag
+from backend.serialization import FieldsetError, eager_load, encode_json, lead_payloads, lead_row_query, parse_fieldset
 
 logger = logging.getLogger(__name__)
 
@@ -14,21 +32,77 @@ def register_routes(app):
     @app.route('/api/leads', methods=['GET'])
     def get_leads():
         """
-        Get all leads with optional status filtering
+        Get a page of leads with optional status and tag filtering.
+
+        ?tag= may be repeated; ?tag_mode=any (the default) returns leads
+        with any of the tags and ?tag_mode=all leads with every one.
+
+        Pages are keyset-based: pass the returned next_cursor back as
+        ?cursor= to fetch the following page. ?sort=updated_at orders by
+        (updated_at, id) instead of id, ?sort=-created_at newest first.
+
+        ?fields= and ?include= select a sparse fieldset; included
+        relationships are batch-loaded with one IN query each. By default a
+        lead carries notes_count and a latest_note preview rather than its
+        notes; ?include=notes embeds them all. Leads are
+        read as row tuples and encoded without building ORM objects; the
+        output is identical to Lead.to_dict() through jsonify.
+
+        Responses carry an ETag derived from the lead table version, and a
+        matching If-None-Match gets a 304 without running the query.
+        Serialized bodies are cached by lead table version and query string.
         """
         try:
+            # Read before the data, like request_etag, so the ETag and the
+            # cache key can only be older than the body, never newer
+            version = current_version()
+            query_string = request.query_string.decode('latin-1')
+            etag = make_etag(version, request.path, query_string)
+            cached = not_modified(request, etag)
+            if cached:
+                return cached
+
             status = request.args.get('status')
-            
-            if status:
-                leads = Lead.query.filter_by(status=status).all()
-            else:
-                leads = Lead.query.all()
-                
+            cache = current_app.extensions['response_cache']
+            cache_key = cache.key_for(version, query_string)
+            body = cache.get(cache_key)
+
+            if body is None:
+                sort = request.args.get('sort', 'id')
+                limit = parse_limit(request.args.get('limit'))
+                cursor = request.args.get('cursor')
+                fields, include = parse_fieldset(request.args)
+
+                # Row tuples rather than Lead objects; paginate needs the keyset columns
+                query, names = lead_row_query(fields, include, extra=sort_column_names(sort))
+                if status:
+                    query = query.filter(Lead.status == status)
+                tags = request.args.getlist('tag')
+                if tags or 'tag_mode' in request.args:
+                    query = query.filter(*lead_filter_clauses({
+                        'tag': tags,
+                        'tag_mode': request.args.get('tag_mode')
+                    }))
+
+                rows, next_cursor = paginate(query, Lead, limit, cursor=cursor, sort=sort)
+
+                body = encode_json({
+                    'success': True,
+                    'data': lead_payloads(rows, names, include),
+                    'limit': limit,
+                    'next_cursor': next_cursor
+                })
+                cache.set(cache_key, body)
+
+            response = current_app.response_class(body, mimetype='application/json')
+            response.set_etag(etag)
+            return response, 200
+
+        except (PaginationError, FieldsetError, FilterError) as e:
             return jsonify({
-                'success': True,
-                'data': [lead.to_dict() for lead in leads]
-            }), 200
-            
+                'success': False,
+                'error': str(e)
+            }), 400
         except Exception as e:
             logger.error(f"Error retrieving leads: {str(e)}")
             return jsonify({
@@ -37,6 +111,159 @@ def register_routes(app):
                 'message': str(e)
             }), 500
     
+    @app.route('/api/leads/search', methods=['GET'])
+    def search_leads_route():
+        """
+        Full-text search over lead names, email, address, resort and notes.
+
+        Results are ranked best match first and paged with ?limit= and the
+        returned next_cursor. ?fields= and ?include= work as in get_leads.
+
+        Only the best 10,000 lead field matches and note matches are ranked.
+        When a query matches more than that, the last page says
+        truncated: true and the leads past the limit are not returned;
+        a narrower q reaches them.
+        """
+        try:
+            q = (request.args.get('q') or '').strip()
+            if not q:
+                return jsonify({
+                    'success': False,
+                    'error': 'Query parameter q is required'
+                }), 400
+
+            limit = parse_limit(request.args.get('limit'))
+            cursor = request.args.get('cursor')
+            after = decode_cursor(cursor, 'search') if cursor else None
+            fields, include = parse_fieldset(request.args)
+
+            hits = search_leads(q, limit + 1, after)
+            next_cursor = None
+            if len(hits) > limit:
+                hits = hits[:limit]
+                last_id, last_score = hits[-1]
+                next_cursor = encode_cursor('search', [last_score, last_id])
+            # Only checked once the pages run out
+            truncated = next_cursor is None and search_truncated(q)
+
+            leads_by_id = {
+                lead.id: lead for lead in
+                eager_load(Lead.query, include).filter(Lead.id.in_([lead_id for lead_id, _ in hits]))
+            }
+
+            data = []
+            for lead_id, score in hits:
+                lead = leads_by_id.get(lead_id)
+                if lead:
+                    result = lead.to_dict(fields=fields, include=include)
+                    result['score'] = score
+                    data.append(result)
+
+            return jsonify({
+                'success': True,
+                'data': data,
+                'limit': limit,
+                'next_cursor': next_cursor,
+                'truncated': truncated
+            }), 200
+
+        except (PaginationError, FieldsetError) as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"Error searching leads: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to search leads',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/leads/changes', methods=['GET'])
+    def get_lead_changes():
+        """
+        Delta sync: leads created or updated and ids of leads deleted since
+        ?since=<token>. Omit since for a full sync; keep following next_token
+        while has_more is true, then poll with the last token.
+        """
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            fields, include = parse_fieldset(request.args)
+            leads, deleted_ids, next_token, has_more = lead_changes(
+                request.args.get('since'), limit, include=include
+            )
+            return jsonify({
+                'success': True,
+                'data': {
+                    'changed': [lead.to_dict(fields=fields, include=include) for lead in leads],
+                    'deleted': deleted_ids
+                },
+                'next_token': next_token,
+                'has_more': has_more
+            }), 200
+
+        except SyncTokenExpired as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 410
+        except (PaginationError, FieldsetError) as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"Error retrieving lead changes: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to retrieve lead changes',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/leads/by-phone/<path:number>', methods=['GET'])
+    def get_leads_by_phone(number):
+        """
+        Find the leads that have a phone number, in any format, in any of
+        their phone_1..phone_4 columns
+        """
+        try:
+            phone = normalize_phone(number)
+            if not phone:
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid phone number'
+                }), 400
+
+            lead_ids = find_lead_ids_by_phone(phone)
+            if not lead_ids:
+                return jsonify({
+                    'success': False,
+                    'error': 'Lead not found'
+                }), 404
+
+            fields, include = parse_fieldset(request.args)
+            leads = eager_load(Lead.query, include).filter(Lead.id.in_(lead_ids)).order_by(Lead.id)
+
+            return jsonify({
+                'success': True,
+                'data': [lead.to_dict(fields=fields, include=include) for lead in leads],
+                'phone': phone
+            }), 200
+
+        except FieldsetError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"Error looking up lead by phone: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to look up lead',
+                'message': str(e)
+            }), 500
+
     @app.route('/api/leads', methods=['POST'])
     def create_lead():
         """
@@ -45,8 +272,12 @@ def register_routes(app):
         try:
             data = request.get_json()
             
+            # 'phone' is accepted as an alias for phone_1
+            if 'phone' in data and 'phone_1' not in data:
+                data['phone_1'] = data['phone']
+
             # Validate required fields
-            required_fields = ['first_name', 'last_name', 'email', 'phone']
+            required_fields = ['first_name', 'last_name', 'email', 'phone_1']
             for field in required_fields:
                 if field not in data:
                     return jsonify({
@@ -54,21 +285,36 @@ def register_routes(app):
                         'error': f'Missing required field: {field}'
                     }), 400
             
-            # Create new lead
+            existing = db.session.execute(select(Lead.id).where(Lead.email == data['email'])).scalar()
+            if existing is not None:
+                return jsonify({
+                    'success': False,
+                    'error': 'A lead with this email already exists',
+                    'lead_id': existing
+                }), 409
+
+            # Create new lead; lead_phone and lead_block_key rows are derived on flush
             new_lead = Lead(
                 first_name=data['first_name'],
                 last_name=data['last_name'],
                 email=data['email'],
-                phone=data['phone'],
+                phone_1=data['phone_1'],
+                phone_2=data.get('phone_2'),
+                phone_3=data.get('phone_3'),
+                phone_4=data.get('phone_4'),
                 status=data.get('status', 'NEW')
             )
             
             db.session.add(new_lead)
+            db.session.flush()
+            possible_duplicates = detect_duplicates([new_lead.id])
             db.session.commit()
+            current_app.extensions['events'].publish('lead-created', new_lead.to_dict(include=()))
             
             return jsonify({
                 'success': True,
                 'data': new_lead.to_dict(),
+                'possible_duplicates': possible_duplicates,
                 'message': 'Lead created successfully'
             }), 201
             
@@ -81,6 +327,312 @@ def register_routes(app):
                 'message': str(e)
             }), 500
     
+    @app.route('/api/leads/import', methods=['POST'])
+    def import_leads_upload():
+        """
+        Bulk-import leads from a CSV or NDJSON upload.
+
+        Accepts either a multipart 'file' field or the raw request body.
+        The format comes from ?format=, the file name or the content type.
+        Rows are validated and inserted in batches as they stream in, and
+        rejected rows are reported by row number.
+        """
+        try:
+            upload = request.files.get('file')
+            if upload:
+                fmt = detect_format(request.args.get('format'), upload.mimetype, upload.filename)
+                stream = upload.stream
+            else:
+                fmt = detect_format(request.args.get('format'), request.mimetype)
+                stream = request.stream
+
+            batch_size = request.args.get('batch_size', DEFAULT_BATCH_SIZE, type=int)
+            result = import_leads(stream, fmt, batch_size=max(1, batch_size))
+
+            return jsonify({
+                'success': True,
+                'data': result.to_dict(),
+                'message': f'Imported {result.inserted} leads'
+            }), 200
+
+        except ImportFormatError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error importing leads: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to import leads',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/leads/export', methods=['GET'])
+    def export_leads():
+        """
+        Stream all leads, optionally filtered by status, as CSV or NDJSON
+        """
+        fmt = request.args.get('format', 'csv').lower()
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({
+                'success': False,
+                'error': f"Unsupported export format: {fmt}"
+            }), 400
+
+        try:
+            # Checked before streaming starts, while an error can still be a 400
+            clauses = lead_filter_clauses({'status': request.args.get('status')})
+            chunks = generate_export(fmt, clauses)
+        except FilterError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"Error exporting leads: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to export leads',
+                'message': str(e)
+            }), 500
+
+        response = Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename=leads.{fmt}'
+        return response
+
+    @app.route('/api/leads/bulk', methods=['PATCH'])
+    def bulk_update_leads():
+        """
+        Move many leads to a new status in one set-based UPDATE.
+
+        Body: {"status": "SENT", "ids": [...]} and/or
+        {"status": "SENT", "filter": {"status": "NEW", "tag": "...",
+        "zip_prefix": "...", "created_after": "...", "created_before": "..."}}
+        """
+        try:
+            data = request.get_json() or {}
+
+            ids = bulk_update_status(
+                data.get('status'),
+                ids=data.get('ids'),
+                filter_spec=data.get('filter')
+            )
+            db.session.commit()
+            if ids:
+                # One event for the batch rather than one per lead
+                current_app.extensions['events'].publish('statuses-changed', {
+                    'to': data['status'].upper(),
+                    'lead_ids': ids
+                })
+
+            return jsonify({
+                'success': True,
+                'data': {
+                    'count': len(ids),
+                    'ids': ids
+                },
+                'message': f'Updated {len(ids)} leads'
+            }), 200
+
+        except (BulkUpdateError, FilterError) as e:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error bulk updating leads: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to update leads',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/leads/tags', methods=['POST'])
+    def bulk_tag_leads():
+        """
+        Add and/or remove tags on many leads with set-based statements.
+
+        Body: {"add": ["hot"], "remove": ["cold"], "ids": [...]} and/or
+        "filter": {...} as for PATCH /api/leads/bulk. Tags being added are
+        created if they don't exist.
+        """
+        try:
+            data = request.get_json() or {}
+
+            counts = bulk_update_tags(
+                add=data.get('add'),
+                remove=data.get('remove'),
+                ids=data.get('ids'),
+                filter_spec=data.get('filter')
+            )
+            db.session.commit()
+
+            return jsonify({
+                'success': True,
+                'data': counts,
+                'message': f"Added {counts['added']} and removed {counts['removed']} tag assignments"
+            }), 200
+
+        except (BulkUpdateError, FilterError) as e:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error bulk tagging leads: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to update tags',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/leads/duplicates', methods=['GET'])
+    def get_duplicates():
+        """
+        Get a page of likely duplicate lead pairs, each with both leads.
+
+        ?min_score= raises the bar above the recorded threshold and
+        ?lead_id= limits the pairs to one lead. Pairs are found at create
+        and import time and rebuilt by `flask find-duplicates`.
+        """
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            min_score = request.args.get('min_score', 0.0, type=float)
+            lead_id = request.args.get('lead_id', type=int)
+
+            query = LeadDuplicate.query.filter(LeadDuplicate.score >= min_score)
+            if lead_id is not None:
+                query = query.filter(or_(LeadDuplicate.lead_id == lead_id, LeadDuplicate.duplicate_id == lead_id))
+            pairs, next_cursor = paginate(query, LeadDuplicate, limit, cursor=request.args.get('cursor'))
+
+            lead_ids = {pair.lead_id for pair in pairs} | {pair.duplicate_id for pair in pairs}
+            leads = {lead.id: lead for lead in Lead.query.filter(Lead.id.in_(lead_ids))} if lead_ids else {}
+
+            data = []
+            for pair in pairs:
+                result = pair.to_dict()
+                result['lead'] = leads[pair.lead_id].to_dict(include=())
+                result['duplicate'] = leads[pair.duplicate_id].to_dict(include=())
+                data.append(result)
+
+            return jsonify({
+                'success': True,
+                'data': data,
+                'limit': limit,
+                'next_cursor': next_cursor
+            }), 200
+
+        except PaginationError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"Error retrieving duplicates: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to retrieve duplicates',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/leads/<int:lead_id>/merge', methods=['POST'])
+    def merge_lead(lead_id):
+        """
+        Merge another lead into this one.
+
+        Body: {"duplicate_id": 42}. The duplicate's notes and tags move to
+        this lead, this lead's blank fields are filled from it, and the
+        duplicate is deleted.
+        """
+        try:
+            data = request.get_json() or {}
+            duplicate_id = data.get('duplicate_id')
+            if not isinstance(duplicate_id, int):
+                raise DedupError('duplicate_id must be an integer')
+
+            merged = merge_leads(lead_id, duplicate_id)
+            if merged is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Lead not found'
+                }), 404
+            lead, moved_notes, moved_tags = merged
+            db.session.commit()
+
+            current_app.extensions['events'].publish('lead-merged', {
+                'lead_id': lead.id,
+                'merged_id': duplicate_id
+            })
+
+            return jsonify({
+                'success': True,
+                'data': lead.to_dict(),
+                'moved_notes': moved_notes,
+                'moved_tags': moved_tags,
+                'message': 'Leads merged successfully'
+            }), 200
+
+        except DedupError as e:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error merging leads: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to merge leads',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/leads/<int:lead_id>', methods=['GET'])
+    def get_lead(lead_id):
+        """
+        Get a single lead, with ETag / If-None-Match support
+        """
+        try:
+            etag = request_etag(request)
+            cached = not_modified(request, etag)
+            if cached:
+                return cached
+
+            fields, include = parse_fieldset(request.args)
+            lead = eager_load(Lead.query, include).filter(Lead.id == lead_id).first()
+
+            if not lead:
+                return jsonify({
+                    'success': False,
+                    'error': 'Lead not found'
+                }), 404
+
+            response = jsonify({
+                'success': True,
+                'data': lead.to_dict(fields=fields, include=include)
+            })
+            response.set_etag(etag)
+            return response, 200
+
+        except FieldsetError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"Error retrieving lead: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to retrieve lead',
+                'message': str(e)
+            }), 500
+
     @app.route('/api/leads/<int:lead_id>', methods=['PATCH'])
     def update_lead(lead_id):
         """
@@ -96,6 +648,7 @@ def register_routes(app):
                 }), 404
             
             data = request.get_json()
+            previous_status = lead.status
             
             # Update fields if provided
             if 'status' in data:
@@ -107,9 +660,20 @@ def register_routes(app):
             if 'email' in data:
                 lead.email = data['email']
             if 'phone' in data:
-                lead.phone = data['phone']
+                lead.phone_1 = data['phone']
+            for field in PHONE_COLUMNS:
+                if field in data:
+                    setattr(lead, field, data[field])
             
             db.session.commit()
+            events = current_app.extensions['events']
+            events.publish('lead-updated', lead.to_dict(include=()))
+            if lead.status != previous_status:
+                events.publish('status-changed', {
+                    'lead_id': lead.id,
+                    'from': previous_status,
+                    'to': lead.status
+                })
             
             return jsonify({
                 'success': True,
@@ -126,6 +690,53 @@ def register_routes(app):
                 'message': str(e)
             }), 500
     
+    @app.route('/api/notes/batch', methods=['POST'])
+    def add_notes_batch():
+        """
+        Add notes to many leads in one request.
+
+        Body: {"notes": [{"lead_id": 1, "content": "..."}, ...]}. Each note
+        gets a result in request order; notes for missing leads or with no
+        content are reported and skipped, the rest are written together.
+        """
+        try:
+            data = request.get_json() or {}
+
+            results = create_notes(data.get('notes'))
+            db.session.commit()
+
+            created = [result['note'] for result in results if result['success']]
+            if created:
+                # One event for the batch rather than one per note
+                current_app.extensions['events'].publish('notes-added', {
+                    'count': len(created),
+                    'lead_ids': sorted({note['lead_id'] for note in created})
+                })
+
+            return jsonify({
+                'success': True,
+                'data': {
+                    'created': len(created),
+                    'failed': len(results) - len(created),
+                    'results': results
+                },
+                'message': f'Added {len(created)} notes'
+            }), 200
+
+        except NoteBatchError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error adding notes: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to add notes',
+                'message': str(e)
+            }), 500
+    
     @app.route('/api/notes/<int:lead_id>', methods=['POST'])
     def add_note(lead_id):
         """
@@ -155,6 +766,7 @@ def register_routes(app):
             
             db.session.add(new_note)
             db.session.commit()
+            current_app.extensions['events'].publish('note-added', new_note.to_dict())
             
             return jsonify({
                 'success': True,
@@ -171,6 +783,335 @@ def register_routes(app):
                 'message': str(e)
             }), 500
     
+    @app.route('/api/leads/<int:lead_id>/notes', methods=['GET'])
+    def get_lead_notes(lead_id):
+        """
+        Get a page of a lead's notes, newest first. Pass next_cursor back as
+        ?cursor= for older notes.
+        """
+        try:
+            limit = parse_limit(request.args.get('limit'))
+            if db.session.get(Lead, lead_id) is None:
+                return jsonify({
+                    'success': False,
+                    'error': 'Lead not found'
+                }), 404
+
+            notes, next_cursor = notes_page(lead_id, limit, cursor=request.args.get('cursor'))
+
+            return jsonify({
+                'success': True,
+                'data': [note.to_dict() for note in notes],
+                'limit': limit,
+                'next_cursor': next_cursor
+            }), 200
+
+        except PaginationError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"Error retrieving notes: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to retrieve notes',
+                'message': str(e)
+            }), 500
+    
+    @app.route('/api/events', methods=['GET'])
+    def lead_events():
+        """
+        Server-Sent Events stream of lead-created, lead-updated,
+        status-changed, statuses-changed, note-added, notes-added and
+        lead-merged events. A reconnecting client's Last-Event-ID header
+        (or ?last_event_id=) replays what it missed.
+        """
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        if last_event_id is not None:
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'Last-Event-ID must be an integer'
+                }), 400
+
+        stream = current_app.extensions['events'].stream(last_event_id)
+        return Response(stream, mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            # Stop nginx from buffering the stream
+            'X-Accel-Buffering': 'no'
+        })
+
+    @app.route('/api/events/stats', methods=['GET'])
+    def lead_events_stats():
+        """
+        Connected streams and delivery counters for this process
+        """
+        return jsonify({
+            'success': True,
+            'data': current_app.extensions['events'].stats()
+        }), 200
+
+    @app.route('/api/webhooks/sms/inbound', methods=['POST'])
+    def sms_inbound_webhook():
+        """
+        Accept an inbound SMS from the provider and queue it for the
+        write-behind worker; the reply is applied to the lead asynchronously
+        """
+        provider = request.args.get('provider', current_app.config['SMS_PROVIDER'])
+        parser = PROVIDERS.get(provider)
+        if not parser:
+            return jsonify({
+                'success': False,
+                'error': f'Unknown SMS provider: {provider}'
+            }), 400
+
+        try:
+            message = parser(request.form, request.get_json(silent=True))
+        except PayloadError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+
+        if not current_app.extensions['sms_inbound'].enqueue(message):
+            # Ask the provider to retry rather than blocking on the database
+            return jsonify({
+                'success': False,
+                'error': 'Inbound queue is full'
+            }), 503
+
+        return jsonify({
+            'success': True,
+            'message': 'Accepted'
+        }), 202
+
+    @app.route('/api/webhooks/sms/inbound/stats', methods=['GET'])
+    def sms_inbound_stats():
+        """
+        Queue depth, lag and throughput counters for the inbound SMS worker
+        """
+        return jsonify({
+            'success': True,
+            'data': current_app.extensions['sms_inbound'].stats()
+        }), 200
+
+    @app.route('/api/campaigns', methods=['POST'])
+    def create_campaign_route():
+        """
+        Create an outbound campaign.
+
+        Body: {"name": "...", "template": "Hi $first_name ...",
+        "filter": {"status": "NEW", "tag": "..."}}. Recipients are fixed
+        when the campaign is created.
+        """
+        try:
+            data = request.get_json() or {}
+            campaign, recipients = create_campaign(data.get('name'), data.get('template'), data.get('filter'))
+            db.session.commit()
+
+            return jsonify({
+                'success': True,
+                'data': {
+                    'campaign': campaign.to_dict(),
+                    'recipients': recipients
+                },
+                'message': 'Campaign created successfully'
+            }), 201
+
+        except (DispatchError, FilterError) as e:
+            db.session.rollback()
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error creating campaign: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to create campaign',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/campaigns/<int:campaign_id>/run', methods=['POST'])
+    def run_campaign(campaign_id):
+        """
+        Start (or resume) sending a campaign in the background. Safe to call
+        on several workers at once; they share the pending messages.
+        """
+        if not db.session.get(Campaign, campaign_id):
+            return jsonify({
+                'success': False,
+                'error': 'Campaign not found'
+            }), 404
+
+        run = current_app.extensions['dispatcher'].start(campaign_id)
+        return jsonify({
+            'success': True,
+            'data': run.to_dict(),
+            'message': 'Campaign dispatch started'
+        }), 202
+
+    @app.route('/api/campaigns/<int:campaign_id>', methods=['GET'])
+    def get_campaign(campaign_id):
+        """
+        Campaign definition, delivery progress and this worker's run stats
+        """
+        campaign = db.session.get(Campaign, campaign_id)
+        if not campaign:
+            return jsonify({
+                'success': False,
+                'error': 'Campaign not found'
+            }), 404
+
+        run = current_app.extensions['dispatcher'].runs.get(campaign_id)
+        return jsonify({
+            'success': True,
+            'data': {
+                'campaign': campaign.to_dict(),
+                'progress': campaign_progress(campaign_id),
+                'run': run.to_dict() if run else None
+            }
+        }), 200
+
+    @app.route('/api/tags', methods=['GET'])
+    def get_tags():
+        """
+        Get every tag with its lead count, from the funnel counters
+        """
+        try:
+            return jsonify({
+                'success': True,
+                'data': tag_counts()
+            }), 200
+
+        except Exception as e:
+            logger.error(f"Error retrieving tags: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to retrieve tags',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/stats/funnel', methods=['GET'])
+    def get_funnel():
+        """
+        Lead counts per status, optionally broken down with ?by=tag|resort.
+        Served from maintained counter rows, not by scanning leads.
+        """
+        try:
+            return jsonify({
+                'success': True,
+                'data': funnel_counts(request.args.get('by') or None)
+            }), 200
+        except FunnelError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        except Exception as e:
+            logger.error(f"Error fetching funnel counts: {str(e)}")
+            return jsonify({
+                'success': False,
+                'error': 'Failed to fetch funnel counts',
+                'message': str(e)
+            }), 500
+
+    @app.route('/api/cache/stats', methods=['GET'])
+    def cache_stats():
+        """
+        Hit, miss and eviction counters for the lead list cache
+        """
+        return jsonify({
+            'success': True,
+            'data': current_app.extensions['response_cache'].stats()
+        }), 200
+
+    @app.route('/api/metrics', methods=['GET'])
+    def metrics():
+        """
+        Request, SQL and pool metrics in Prometheus text format, summed
+        over every worker sharing METRICS_DIR
+        """
+        totals = current_app.extensions['metrics'].collect()
+        return Response(render_metrics(totals), content_type=METRICS_CONTENT_TYPE)
+
+    @app.route('/api/debug/slow-queries', methods=['GET'])
+    def slow_queries():
+        """
+        Statements over SLOW_QUERY_THRESHOLD_MS captured by this process,
+        newest first, with their normalized SQL, parameter types, route and
+        query plan. Guarded like the profiles, since it exposes SQL.
+        """
+        if not current_app.extensions['profiler'].authorized(request.headers):
+            return jsonify({
+                'success': False,
+                'error': 'Debug endpoints are not enabled'
+            }), 403
+
+        log = current_app.extensions['slow_queries']
+        return jsonify({
+            'success': True,
+            'data': {
+                'stats': log.stats(),
+                'queries': log.entries()
+            }
+        }), 200
+
+    @app.route('/api/debug/profiles', methods=['GET'])
+    def list_profiles():
+        """
+        Request profiles kept by this process, newest first; ?route= limits
+        them to one route template and ?format=collapsed merges their
+        sampled stacks into one flame graph input
+        """
+        profiler = current_app.extensions['profiler']
+        if not profiler.authorized(request.headers):
+            return jsonify({
+                'success': False,
+                'error': 'Profiling is not enabled'
+            }), 403
+
+        profiles = profiler.profiles(request.args.get('route'))
+        if request.args.get('format') == 'collapsed':
+            return Response(collapsed(profiles), mimetype='text/plain')
+        return jsonify({
+            'success': True,
+            'data': {
+                'mode': profiler.mode,
+                'profiles': [profile_summary(profile) for profile in profiles]
+            }
+        }), 200
+
+    @app.route('/api/debug/profiles/<int:profile_id>', methods=['GET'])
+    def get_profile(profile_id):
+        """
+        One request profile with its sampled stacks or cProfile functions;
+        ?format=collapsed returns just the stacks
+        """
+        profiler = current_app.extensions['profiler']
+        if not profiler.authorized(request.headers):
+            return jsonify({
+                'success': False,
+                'error': 'Profiling is not enabled'
+            }), 403
+
+        profile = profiler.get(profile_id)
+        if profile is None:
+            return jsonify({
+                'success': False,
+                'error': 'Profile not found'
+            }), 404
+        if request.args.get('format') == 'collapsed':
+            return Response(collapsed([profile]), mimetype='text/plain')
+        return jsonify({
+            'success': True,
+            'data': profile
+        }), 200
+
     @app.route('/api/health', methods=['GET'])
     def health_check():
         """
@@ -312,8 +1253,22 @@ def register_routes(app):
                     };
                 
                     const fetchLeads = async (status = null) => {
-                        const endpoint = status ? `/leads?status=${status}` : '/leads';
-                        return apiRequest(endpoint);
+                        // Follow next_cursor until every page has been loaded
+                        let allLeads = [];
+                        let cursor = null;
+                        do {
+                            const params = new URLSearchParams();
+                            if (status) params.set('status', status);
+                            if (cursor) params.set('cursor', cursor);
+                            const response = await fetch(`/api/leads?${params}`);
+                            const result = await response.json();
+                            if (!response.ok) {
+                                throw new Error(result.message || result.error || 'API request failed');
+                            }
+                            allLeads = allLeads.concat(result.data);
+                            cursor = result.next_cursor;
+                        } while (cursor);
+                        return allLeads;
                     };
                 
                     const createLead = async (leadData) => {
@@ -398,7 +1353,8 @@ def register_routes(app):
                                 if (lead.id === selectedLead.id) {
                                     return {
                                         ...lead,
-                                        notes: [...lead.notes, newNote]
+                                        notes_count: lead.notes_count + 1,
+                                        latest_note: newNote
                                     };
                                 }
                                 return lead;
@@ -494,8 +1450,8 @@ def register_routes(app):
                                                     </a>
                                                 </td>
                                                 <td>
-                                                    <a href={`tel:${lead.phone}`} className="text-decoration-none">
-                                                        {lead.phone}
+                                                    <a href={`tel:${lead.phone_1}`} className="text-decoration-none">
+                                                        {lead.phone_1}
                                                     </a>
                                                 </td>
                                                 <td>
@@ -512,7 +1468,7 @@ def register_routes(app):
                                                 </td>
                                                 <td>
                                                     <span className="badge bg-secondary">
-                                                        {lead.notes.length} notes
+                                                        {lead.notes_count} notes
                                                     </span>
                                                 </td>
                                                 <td>
@@ -0,0 +1,141 @@
+import logging
+import re
+from sqlalchemy import text
+from backend.app import db
+
+logger = logging.getLogger(__name__)
+
+# Best matches per source (lead fields, notes) a search ranks; leads that
+# only match further down are not returned
+MAX_CANDIDATES = 10000
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _fts5_query(q):
+    """
+    Turn free text into an FTS5 query: every word must match, as a prefix
+    """
+    tokens = _TOKEN_RE.findall(q)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_leads(q, limit, after=None):
+    """
+    Rank leads whose fields or notes match q.
+
+    Returns a list of (lead_id, score) tuples, best match first, where a
+    lead's score is its best score across its own fields and its notes.
+    after is the (score, lead_id) of the last lead of the previous page.
+
+    Only the best MAX_CANDIDATES field matches and note matches are
+    grouped and ranked, so a page costs the same however deep it is.
+    """
+    dialect = db.engine.dialect.name
+    params = {'limit': limit, 'candidates': MAX_CANDIDATES}
+
+    # Keyset on (score DESC, lead_id) instead of an OFFSET
+    having = ''
+    if after is not None:
+        having = 'HAVING MAX(score) < :score OR (MAX(score) = :score AND lead_id > :lead_id)'
+        params['score'], params['lead_id'] = after
+
+    if dialect == 'sqlite':
+        match = _fts5_query(q)
+        if not match:
+            return []
+        # bm25() is lower-is-better, so negate it into a score
+        statement = text(f"""
+            SELECT lead_id, MAX(score) AS score FROM (
+                SELECT * FROM (
+                    SELECT rowid AS lead_id, -bm25(lead_fts) AS score
+                    FROM lead_fts WHERE lead_fts MATCH :match
+                    ORDER BY score DESC LIMIT :candidates
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT note.lead_id AS lead_id, -bm25(note_fts) AS score
+                    FROM note_fts JOIN note ON note.id = note_fts.rowid
+                    WHERE note_fts MATCH :match
+                    ORDER BY score DESC LIMIT :candidates
+                )
+            ) AS hits
+            GROUP BY lead_id
+            {having}
+            ORDER BY score DESC, lead_id
+            LIMIT :limit
+        """)
+        params['match'] = match
+
+    elif dialect == 'postgresql':
+        statement = text(f"""
+            SELECT lead_id, MAX(score) AS score FROM (
+                (SELECT lead.id AS lead_id, ts_rank(lead.search_vector, query)::float8 AS score
+                 FROM lead, websearch_to_tsquery('simple', :q) AS query
+                 WHERE lead.search_vector @@ query
+                 ORDER BY score DESC LIMIT :candidates)
+                UNION ALL
+                (SELECT note.lead_id AS lead_id, ts_rank(note.search_vector, query)::float8 AS score
+                 FROM note, websearch_to_tsquery('simple', :q) AS query
+                 WHERE note.search_vector @@ query
+                 ORDER BY score DESC LIMIT :candidates)
+            ) AS hits
+            GROUP BY lead_id
+            {having}
+            ORDER BY score DESC, lead_id
+            LIMIT :limit
+        """)
+        # ts_rank() is a real; as a double the score in a cursor compares
+        # equal to the one it was read from
+        params['q'] = q
+
+    else:
+        raise NotImplementedError(f"Full-text search is not supported on {dialect}")
+
+    return [(row.lead_id, float(row.score)) for row in db.session.execute(statement, params)]
+
+
+def search_truncated(q):
+    """
+    Whether the lead fields or the notes match q more than MAX_CANDIDATES
+    times, i.e. whether search_leads() left some matching leads out.
+
+    Each source is only counted up to one past the limit.
+    """
+    dialect = db.engine.dialect.name
+    params = {'candidates': MAX_CANDIDATES}
+
+    if dialect == 'sqlite':
+        match = _fts5_query(q)
+        if not match:
+            return False
+        statement = text("""
+            SELECT
+                (SELECT COUNT(*) FROM (
+                    SELECT 1 FROM lead_fts WHERE lead_fts MATCH :match LIMIT :candidates + 1
+                )) AS lead_hits,
+                (SELECT COUNT(*) FROM (
+                    SELECT 1 FROM note_fts WHERE note_fts MATCH :match LIMIT :candidates + 1
+                )) AS note_hits
+        """)
+        params['match'] = match
+
+    elif dialect == 'postgresql':
+        statement = text("""
+            SELECT
+                (SELECT COUNT(*) FROM (
+                    SELECT 1 FROM lead WHERE lead.search_vector @@ websearch_to_tsquery('simple', :q)
+                    LIMIT :candidates + 1
+                ) AS hits) AS lead_hits,
+                (SELECT COUNT(*) FROM (
+                    SELECT 1 FROM note WHERE note.search_vector @@ websearch_to_tsquery('simple', :q)
+                    LIMIT :candidates + 1
+                ) AS hits) AS note_hits
+        """)
+        params['q'] = q
+
+    else:
+        raise NotImplementedError(f"Full-text search is not supported on {dialect}")
+
+    row = db.session.execute(statement, params).one()
+    return max(row.lead_hits, row.note_hits) > MAX_CANDIDATES
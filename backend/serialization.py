@@ -0,0 +1,196 @@
+import json
+import re
+from collections import defaultdict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+from backend.app import db
+from backend.models import Lead, LeadTag, Note, Tag
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Ids per IN query when loading relationships for a page of rows
+RELATIONSHIP_CHUNK_SIZE = 10000
+
+# Keys of Note.to_dict() and Tag.to_dict(), in column order
+NOTE_FIELDS = ('id', 'content', 'created_at', 'updated_at', 'lead_id')
+TAG_FIELDS = ('id', 'name')
+
+
+class FieldsetError(ValueError):
+    """
+    Raised when ?fields= or ?include= names something Lead cannot serialize
+    """
+
+
+def _split(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def parse_fieldset(args):
+    """
+    Read the sparse fieldset parameters from a request's query args.
+
+    ?fields=id,first_name,status limits the scalar keys in each lead, and
+    ?include=notes,tags,latest_note picks the embedded relationships (an
+    empty value embeds none). Without ?include= Lead.DEFAULT_INCLUDE is used.
+
+    Returns a (fields, include) tuple suitable for Lead.to_dict().
+    """
+    fields = None
+    if args.get('fields'):
+        fields = _split(args['fields'])
+        unknown = [f for f in fields if f not in Lead.SERIALIZABLE_FIELDS]
+        if unknown:
+            raise FieldsetError(f"Unknown fields: {', '.join(unknown)}")
+
+    include = Lead.DEFAULT_INCLUDE
+    if 'include' in args:
+        include = tuple(_split(args['include']))
+        unknown = [r for r in include if r not in Lead.RELATIONSHIPS]
+        if unknown:
+            raise FieldsetError(f"Unknown relationships: {', '.join(unknown)}")
+
+    return fields, include
+
+
+def eager_load(query, include):
+    """
+    Batch-load the included relationships with one IN query each instead of
+    one lazy load per lead
+    """
+    options = [selectinload(getattr(Lead, name)) for name in include]
+    if options:
+        query = query.options(*options)
+    return query
+
+
+def lead_row_query(fields=None, include=Lead.DEFAULT_INCLUDE, extra=()):
+    """
+    Query for a lead list as plain row tuples, skipping ORM hydration.
+
+    Selects the serialized columns (fields, or all of them) followed by
+    the columns lead_payloads() needs for include and any extra columns
+    the caller needs, e.g. pagination keys. Returns (query, names) where
+    names are the serialized columns.
+    """
+    names = tuple(fields) if fields is not None else Lead.SERIALIZABLE_FIELDS
+    needed = list(extra)
+    if include:
+        needed.append('id')
+    if 'latest_note' in include:
+        needed.append('latest_note_id')
+    selected = list(names)
+    for name in needed:
+        if name not in selected:
+            selected.append(name)
+    return db.session.query(*[Lead.__table__.c[name] for name in selected]), names
+
+
+def _chunks(values, size=RELATIONSHIP_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _related_rows(rows, include):
+    """
+    Load the included relationships for many leads with one IN query per
+    chunk, grouped by lead id and in the same order as the ORM collections
+    """
+    # The id column may be selected as an extra when a fieldset omits it
+    lead_ids = [row.id for row in rows]
+    related = {}
+    if 'notes' in include:
+        notes = defaultdict(list)
+        columns = [Note.__table__.c[name] for name in NOTE_FIELDS]
+        for chunk in _chunks(lead_ids):
+            for row in db.session.execute(select(*columns).where(Note.lead_id.in_(chunk)).order_by(Note.id)):
+                notes[row.lead_id].append(dict(zip(NOTE_FIELDS, row)))
+        related['notes'] = notes
+    if 'tags' in include:
+        tags = defaultdict(list)
+        for chunk in _chunks(lead_ids):
+            tag_rows = db.session.execute(
+                select(LeadTag.lead_id, Tag.id, Tag.name)
+                .join(Tag, Tag.id == LeadTag.tag_id)
+                .where(LeadTag.lead_id.in_(chunk))
+                .order_by(Tag.id)
+            )
+            for lead_id, tag_id, name in tag_rows:
+                tags[lead_id].append({'id': tag_id, 'name': name})
+        related['tags'] = tags
+    if 'latest_note' in include:
+        note_ids = [row.latest_note_id for row in rows if row.latest_note_id is not None]
+        previews = {}
+        for chunk in _chunks(note_ids):
+            for note_id, content, created_at in db.session.execute(
+                select(Note.id, Note.content, Note.created_at).where(Note.id.in_(chunk))
+            ):
+                previews[note_id] = Note.preview_dict(note_id, content, created_at)
+        related['latest_note'] = {row.id: previews.get(row.latest_note_id) for row in rows}
+    return related
+
+
+def lead_payloads(rows, names, include=Lead.DEFAULT_INCLUDE):
+    """
+    Turn rows from lead_row_query() into the dicts Lead.to_dict() builds.
+    Datetimes are left as datetime objects for encode_json() to format.
+    """
+    width = len(names)
+    payloads = [dict(zip(names, row[:width])) for row in rows]
+    if not include or not payloads:
+        return payloads
+
+    related = _related_rows(rows, include)
+    for row, payload in zip(rows, payloads):
+        for name in include:
+            payload[name] = related[name].get(row.id, None if name == 'latest_note' else [])
+    return payloads
+
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# Characters the stdlib encoder escapes under ensure_ascii (DEL included)
+_NON_ASCII = re.compile('[^\x00-\x7e]')
+
+
+def _escape_non_ascii(match):
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return '\\u{0:04x}\\u{1:04x}'.format(0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return '\\u{0:04x}'.format(code)
+
+
+def encode_json(obj):
+    """
+    Encode obj exactly as jsonify() would once datetimes are isoformatted,
+    using orjson when it is installed and the app's JSON settings allow it
+    """
+    provider = current_app.json
+    compact = provider.compact or (provider.compact is None and not current_app.debug)
+
+    if orjson is not None and compact and provider.sort_keys:
+        body = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE)
+        if provider.ensure_ascii and (not body.isascii() or b'\x7f' in body):
+            # Non-ASCII only occurs inside strings, so escaping the whole body is safe
+            body = _NON_ASCII.sub(_escape_non_ascii, body.decode('utf-8')).encode('ascii')
+        return body
+
+    options = {'separators': (',', ':')} if compact else {'indent': 2}
+    text = json.dumps(
+        obj,
+        sort_keys=provider.sort_keys,
+        ensure_ascii=provider.ensure_ascii,
+        default=_isoformat,
+        **options
+    )
+    return f'{text}\n'.encode('utf-8')
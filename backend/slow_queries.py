@@ -0,0 +1,244 @@
+"""
+Log statements slower than SLOW_QUERY_THRESHOLD_MS with their query plan.
+
+Captured statements go into a bounded in-process ring buffer served at
+/api/debug/slow-queries to callers the request profiler authorizes (see
+PROFILER_SECRET). Bind values are never kept, only their types.
+Only a SLOW_QUERY_SAMPLE_RATE fraction of slow statements is captured, and
+each distinct statement is EXPLAINed at most once per
+SLOW_QUERY_EXPLAIN_INTERVAL seconds, so a slow hot path can't turn the log
+itself into extra load.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from flask import has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the slow query log; override in app.config
+DEFAULT_SLOW_QUERY_CONFIG = {
+    'SLOW_QUERY_ENABLED': True,
+    'SLOW_QUERY_THRESHOLD_MS': 200,
+    # Entries kept per process; the oldest are dropped first
+    'SLOW_QUERY_LOG_SIZE': 200,
+    # Fraction of slow statements captured; all are counted
+    'SLOW_QUERY_SAMPLE_RATE': 1.0,
+    # Seconds before the same normalized statement is EXPLAINed again
+    'SLOW_QUERY_EXPLAIN_INTERVAL': 60,
+}
+
+# Statements EXPLAIN accepts; DDL, PRAGMA and transaction control are skipped
+EXPLAINABLE = ('select', 'insert', 'update', 'delete', 'with')
+
+# Distinct statements remembered for the EXPLAIN interval before forgetting all
+MAX_EXPLAIN_FINGERPRINTS = 1000
+
+EXPLAIN_SAVEPOINT = 'slow_query_explain'
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'\?|%\(\w+\)s|%s|(?<!:):\w+|\$\d+')
+# Expanded IN lists differ only in length; fold them into one shape
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(statement):
+    """
+    Statement text with literals and placeholders replaced by ? and IN
+    lists folded, so the same query always normalizes the same way
+    """
+    sql = _STRING_LITERAL.sub('?', statement)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(?, ...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def _type_name(value):
+    if value is None:
+        return 'null'
+    return type(value).__name__
+
+
+def parameter_shape(parameters, executemany=False):
+    """
+    Types of the bind parameters without their values, e.g.
+    {'rows': 1000, 'each': ['int', 'str']} for an executemany
+    """
+    if executemany:
+        rows = list(parameters or ())
+        return {'rows': len(rows), 'each': parameter_shape(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {name: _type_name(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_type_name(value) for value in parameters]
+    return None
+
+
+def _explain_prefix(dialect):
+    if dialect == 'sqlite':
+        return 'EXPLAIN QUERY PLAN '
+    if dialect == 'postgresql':
+        return 'EXPLAIN '
+    return None
+
+
+def explain(dbapi_connection, dialect, statement, parameters):
+    """
+    Plan lines for a statement, from a separate cursor on the connection
+    that ran it so the statement's own results are untouched.
+
+    A failed statement aborts the whole transaction on PostgreSQL, so
+    there the EXPLAIN runs inside a savepoint that is rolled back if it
+    fails, leaving the caller's transaction as it was. SQLite's EXPLAIN
+    QUERY PLAN only compiles the statement and can't affect it.
+    """
+    prefix = _explain_prefix(dialect)
+    if prefix is None:
+        return None
+    savepoint = dialect == 'postgresql' and not getattr(dbapi_connection, 'autocommit', False)
+    cursor = dbapi_connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute(f'SAVEPOINT {EXPLAIN_SAVEPOINT}')
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        except Exception:
+            if savepoint:
+                cursor.execute(f'ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}')
+            raise
+        finally:
+            if savepoint:
+                cursor.execute(f'RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}')
+    finally:
+        cursor.close()
+    if dialect == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+class SlowQueryLog:
+    """
+    Bounded, thread-safe record of slow statements for one process
+    """
+
+    def __init__(self, threshold_ms, size, sample_rate, explain_interval):
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        self.explain_interval = explain_interval
+        self._entries = deque(maxlen=size)
+        self._explained_at = {}
+        self._lock = threading.Lock()
+        self._counters = {'slow': 0, 'captured': 0, 'explained': 0, 'explain_errors': 0}
+
+    def _should_explain(self, fingerprint):
+        now = time.monotonic()
+        with self._lock:
+            explained_at = self._explained_at.get(fingerprint)
+            if explained_at is not None and now - explained_at < self.explain_interval:
+                return False
+            if len(self._explained_at) >= MAX_EXPLAIN_FINGERPRINTS:
+                self._explained_at.clear()
+            self._explained_at[fingerprint] = now
+            return True
+
+    def record(self, conn, statement, parameters, executemany, seconds):
+        """
+        Count a statement that took seconds, and capture a sample of them
+        """
+        with self._lock:
+            self._counters['slow'] += 1
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+
+        sql = normalize_sql(statement)
+        entry = {
+            'at': datetime.utcnow().isoformat(),
+            'duration_ms': round(seconds * 1000, 3),
+            'sql': sql,
+            'parameters': parameter_shape(parameters, executemany),
+            'executemany': executemany,
+            'route': None,
+            'method': None,
+            'plan': None,
+        }
+        if has_request_context():
+            entry['route'] = request.url_rule.rule if request.url_rule is not None else None
+            entry['method'] = request.method
+
+        verb = sql.split(' ', 1)[0].lower()
+        if verb in EXPLAINABLE and self._should_explain(sql):
+            plan_parameters = parameters
+            if executemany:
+                plan_parameters = parameters[0] if parameters else ()
+            try:
+                entry['plan'] = explain(conn.connection.dbapi_connection, conn.dialect.name,
+                                        statement, plan_parameters)
+                self._count('explained')
+            except Exception as e:
+                self._count('explain_errors')
+                logger.debug(f"Could not explain slow query: {str(e)}")
+
+        logger.warning(f"Slow query ({entry['duration_ms']} ms) on {entry['route'] or 'no route'}: {sql}")
+        with self._lock:
+            self._entries.append(entry)
+            self._counters['captured'] += 1
+        return entry
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def entries(self):
+        """
+        Captured statements, newest first
+        """
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def stats(self):
+        with self._lock:
+            return {'threshold_ms': self.threshold * 1000, 'kept': len(self._entries), **self._counters}
+
+
+def init_slow_queries(app):
+    """
+    Time every statement on the app's engine and attach the slow query log
+    """
+    for key, value in DEFAULT_SLOW_QUERY_CONFIG.items():
+        app.config.setdefault(key, value)
+    log = SlowQueryLog(
+        app.config['SLOW_QUERY_THRESHOLD_MS'],
+        app.config['SLOW_QUERY_LOG_SIZE'],
+        app.config['SLOW_QUERY_SAMPLE_RATE'],
+        app.config['SLOW_QUERY_EXPLAIN_INTERVAL'],
+    )
+    app.extensions['slow_queries'] = log
+    if not app.config['SLOW_QUERY_ENABLED']:
+        return log
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.slow_query_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'slow_query_started', None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        if seconds >= log.threshold:
+            log.record(conn, statement, parameters, executemany, seconds)
+
+    from backend.app import db
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+    return log
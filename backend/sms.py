@@ -0,0 +1,320 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from sqlalchemy import bindparam, or_, select, update
+from backend.app import db
+from backend.bulk import update_leads
+from backend.models import Lead, LeadPhone
+from backend.phones import normalize_phone
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the write-behind queue; override in app.config
+DEFAULT_SMS_CONFIG = {
+    'SMS_PROVIDER': 'fake',
+    'SMS_QUEUE_MAXSIZE': 50000,
+    'SMS_BATCH_SIZE': 500,
+    'SMS_BATCH_INTERVAL': 0.2,
+    # Tries per batch before its messages are counted failed and dropped
+    'SMS_BATCH_ATTEMPTS': 3,
+    'SMS_RETRY_DELAY': 0.5,
+}
+
+# Statuses that an inbound reply moves to REPLIED; later stages are kept
+REPLY_PROMOTES_FROM = ('NEW', 'SENT')
+
+InboundSms = namedtuple('InboundSms', ['sender', 'recipient', 'body', 'sent_at', 'received_at'])
+
+
+class PayloadError(ValueError):
+    """
+    Raised when a provider payload can't be parsed into an inbound SMS
+    """
+
+
+def _parse_timestamp(value):
+    if not value:
+        return datetime.utcnow()
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise PayloadError(f'Invalid timestamp: {value}')
+    # Stored as naive UTC; a timestamp without an offset is taken as UTC
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def parse_fake(form, json_body):
+    """
+    Local stand-in provider: JSON {"from", "to", "body", "timestamp"}
+    """
+    data = json_body or {}
+    if not data.get('from') or 'body' not in data:
+        raise PayloadError('from and body are required')
+    return InboundSms(
+        sender=data['from'],
+        recipient=data.get('to'),
+        body=data['body'],
+        sent_at=_parse_timestamp(data.get('timestamp')),
+        received_at=time.monotonic()
+    )
+
+
+def parse_twilio(form, json_body):
+    """
+    Twilio-style form post with From, To and Body fields
+    """
+    if not form.get('From') or 'Body' not in form:
+        raise PayloadError('From and Body are required')
+    return InboundSms(
+        sender=form['From'],
+        recipient=form.get('To'),
+        body=form['Body'],
+        sent_at=datetime.utcnow(),
+        received_at=time.monotonic()
+    )
+
+
+# Payload parsers by provider name
+PROVIDERS = {
+    'fake': parse_fake,
+    'twilio': parse_twilio,
+}
+
+
+class InboundSmsProcessor:
+    """
+    Write-behind queue for inbound SMS replies.
+
+    The webhook only enqueues; a background thread drains the queue in
+    batches, resolves every sender in the batch with one lead_phone IN query
+    and applies the reply fields with one executemany UPDATE per batch.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.queue = queue.Queue(maxsize=app.config['SMS_QUEUE_MAXSIZE'])
+        self.batch_size = app.config['SMS_BATCH_SIZE']
+        self.batch_interval = app.config['SMS_BATCH_INTERVAL']
+        self.batch_attempts = app.config['SMS_BATCH_ATTEMPTS']
+        self.retry_delay = app.config['SMS_RETRY_DELAY']
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+        self._counters = {
+            'received': 0,
+            'rejected': 0,
+            'applied': 0,
+            'unmatched': 0,
+            'failed': 0,
+            'retried': 0,
+            'batches': 0,
+        }
+        self._last_batch = {'size': 0, 'seconds': 0.0, 'max_lag_seconds': 0.0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def start(self):
+        """
+        Start the worker thread if it isn't running in this process. Called
+        lazily so each forked worker gets its own thread.
+        """
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='sms-inbound', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Stop the worker and apply whatever is still queued
+        """
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.drain()
+
+    def enqueue(self, message):
+        """
+        Queue a message without blocking; returns False when the queue is full
+        """
+        self.start()
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('received')
+        return True
+
+    def _next_batch(self, wait):
+        batch = []
+        deadline = time.monotonic() + wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._next_batch(self.batch_interval)
+            if batch:
+                self._process(batch)
+
+    def drain(self):
+        """
+        Apply everything currently queued in the calling thread
+        """
+        while True:
+            batch = self._next_batch(0)
+            if not batch:
+                return
+            self._process(batch)
+
+    def _process(self, batch):
+        started = time.monotonic()
+        for attempt in range(1, self.batch_attempts + 1):
+            try:
+                with self.app.app_context():
+                    applied, unmatched = self._apply_batch(batch)
+            except Exception as e:
+                if attempt < self.batch_attempts:
+                    self._count('retried')
+                    logger.warning(f"Error applying inbound SMS batch, retrying: {str(e)}")
+                    time.sleep(self.retry_delay * attempt)
+                    continue
+                self._count('failed', len(batch))
+                logger.error(f"Error applying inbound SMS batch after {attempt} attempts: {str(e)}")
+            else:
+                self._count('applied', applied)
+                self._count('unmatched', unmatched)
+            break
+        finished = time.monotonic()
+        with self._lock:
+            self._counters['batches'] += 1
+            self._last_batch = {
+                'size': len(batch),
+                'seconds': finished - started,
+                'max_lag_seconds': max(finished - message.received_at for message in batch)
+            }
+
+    def _apply_batch(self, batch):
+        """
+        Write one batch and commit. Returns (applied, unmatched) counts;
+        nothing is counted here, so a retried batch is only counted once.
+        """
+        unmatched = 0
+        # Keep only the newest reply per sender
+        latest = {}
+        for message in batch:
+            phone = normalize_phone(message.sender)
+            if not phone:
+                unmatched += 1
+                continue
+            if phone not in latest or message.sent_at >= latest[phone].sent_at:
+                latest[phone] = message
+
+        if not latest:
+            return 0, unmatched
+
+        lead_ids_by_phone = {}
+        rows = db.session.execute(
+            select(LeadPhone.phone, LeadPhone.lead_id).where(LeadPhone.phone.in_(list(latest)))
+        )
+        for phone, lead_id in rows:
+            lead_ids_by_phone.setdefault(phone, []).append(lead_id)
+
+        updates = {}
+        for phone, message in latest.items():
+            lead_ids = lead_ids_by_phone.get(phone)
+            if not lead_ids:
+                unmatched += 1
+                logger.info(f"Inbound SMS from unknown number {phone}")
+                continue
+            for lead_id in lead_ids:
+                current = updates.get(lead_id)
+                if current is None or message.sent_at >= current['b_response_timestamp']:
+                    updates[lead_id] = {
+                        'b_id': lead_id,
+                        'b_last_response': message.body,
+                        'b_response_timestamp': message.sent_at,
+                    }
+
+        if not updates:
+            return 0, unmatched
+
+        now = datetime.utcnow()
+        params = list(updates.values())
+        for row in params:
+            row['b_updated_at'] = now
+
+        lead = Lead.__table__.c
+        db.session.execute(
+            update(Lead.__table__)
+            .where(lead.id == bindparam('b_id'))
+            # A reply that arrives late doesn't replace a newer one
+            .where(or_(lead.response_timestamp.is_(None),
+                       lead.response_timestamp < bindparam('b_response_timestamp')))
+            .values(
+                last_response=bindparam('b_last_response'),
+                response_timestamp=bindparam('b_response_timestamp'),
+                updated_at=bindparam('b_updated_at')
+            ),
+            params
+        )
+        promoted = update_leads(
+            [Lead.id.in_(list(updates)), Lead.status.in_(REPLY_PROMOTES_FROM)],
+            {'status': 'REPLIED'}
+        )
+        db.session.commit()
+        if promoted:
+            self.app.extensions['events'].publish('statuses-changed', {
+                'to': 'REPLIED',
+                'lead_ids': sorted(promoted)
+            })
+        return len(params), unmatched
+
+    def oldest_queued_age(self):
+        with self.queue.mutex:
+            if not self.queue.queue:
+                return 0.0
+            return time.monotonic() - self.queue.queue[0].received_at
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            last_batch = dict(self._last_batch)
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_capacity': self.queue.maxsize,
+            'lag_seconds': self.oldest_queued_age(),
+            'worker_alive': bool(self._thread and self._thread.is_alive()),
+            'last_batch': last_batch,
+            **counters
+        }
+
+
+def init_sms(app):
+    """
+    Attach the inbound SMS processor to the app
+    """
+    for key, value in DEFAULT_SMS_CONFIG.items():
+        app.config.setdefault(key, value)
+    processor = InboundSmsProcessor(app)
+    app.extensions['sms_inbound'] = processor
+    atexit.register(processor.stop)
+    return processor
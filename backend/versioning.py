@@ -0,0 +1,54 @@
+import hashlib
+import logging
+from flask import Response
+from sqlalchemy import select, text
+from backend.app import db
+from backend.models import TableVersion
+
+logger = logging.getLogger(__name__)
+
+def current_version(name='lead'):
+    """
+    Read a change counter with one primary-key lookup.
+
+    On PostgreSQL the 'lead' version is not a counter row, which every
+    writer would have to lock, but lead_change_version() (migration 0009):
+    the highest change_seq of leads and tombstones plus the transactions
+    still open below it. It is an opaque string that changes whenever
+    committed lead data does.
+    """
+    if name == 'lead' and db.engine.dialect.name == 'postgresql':
+        return db.session.execute(text('SELECT lead_change_version()')).scalar()
+    version = db.session.execute(
+        select(TableVersion.version).where(TableVersion.name == name)
+    ).scalar()
+    return version or 0
+
+
+def make_etag(version, *parts):
+    """
+    Build a strong ETag from a table version and whatever identifies the
+    representation (path, query string), without looking at the body
+    """
+    key = '\x1f'.join(str(part) for part in parts)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return f'v{version}-{digest}'
+
+
+def request_etag(request, name='lead'):
+    """
+    ETag for a GET of the current request's URL. Read the version before
+    the data so a concurrent write can only make the ETag older, never newer.
+    """
+    return make_etag(current_version(name), request.path, request.query_string.decode('latin-1'))
+
+
+def not_modified(request, etag):
+    """
+    Return a 304 response if the client already has etag, else None
+    """
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
@@ -35,8 +35,15 @@ function App() {
   const loadLeads = async () => {
     setIsLoading(true);
     try {
-      const data = await fetchLeads();
-      setLeads(data.leads);
+      // Follow next_cursor until every page has been loaded
+      let allLeads = [];
+      let cursor = null;
+      do {
+        const data = await fetchLeads(null, cursor);
+        allLeads = allLeads.concat(data.leads);
+        cursor = data.next_cursor;
+      } while (cursor);
+      setLeads(allLeads);
       setError(null);
     } catch (err) {
       setError('Failed to load leads. Please try again.');
@@ -23,12 +23,15 @@ api.interceptors.response.use(
 // API functions
 
 /**
- * Fetch all leads
+ * Fetch a page of leads
  * @param {string} [status] - Optional status filter
- * @returns {Promise<{leads: Array}>}
+ * @param {string} [cursor] - next_cursor from the previous page
+ * @returns {Promise<{leads: Array, limit: number, next_cursor: ?string}>}
  */
-export const fetchLeads = (status) => {
-  const params = status ? { status } : {};
+export const fetchLeads = (status, cursor) => {
+  const params = {};
+  if (status) params.status = status;
+  if (cursor) params.cursor = cursor;
   return api.get('/leads', { params });
 };
 
@@ -1,13 +1,9 @@
 from flask import send_from_directory, send_file
 import os
 import logging
-from app import app
+from app import create_app, db
 
-# Set up logging to see what's happening
-logging.basicConfig(level=logging.DEBUG)
-
-# Import routes to register them with Flask
-# We don't need to import routes here because it's already imported in app.py
+app = create_app()
 
 # Serve static files
 @app.route('/static/<path:path>')
@@ -39,4 +35,8 @@ def serve(path):
     return send_file('static/index.html')
 
 if __name__ == "__main__":
+    # Set up logging to see what's happening
+    logging.basicConfig(level=logging.DEBUG)
+    with app.app_context():
+        db.create_all()
     app.run(host="0.0.0.0", port=5001, debug=True)
@@ -36,18 +36,31 @@ class Lead(db.Model):
     status = db.Column(
         Enum('NEW', 'SENT', 'REPLIED', 'BOOKED', name='lead_status'),
         default='NEW',
-        nullable=False
+        nullable=False,
+        index=True
     )
     
-    # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Timestamps; never NULL, since the keyset cursors of ?sort=updated_at
+    # and ?sort=-created_at hold their values
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
     
     # Relationship with notes
     notes = db.relationship('Note', backref='lead', lazy=True, cascade="all, delete-orphan")
+
+    # Relationships that to_dict() can embed
+    RELATIONSHIPS = ('notes',)
+
+    # Scalar keys that to_dict() can emit
+    SERIALIZABLE_FIELDS = (
+        'id', 'owner1_first_name', 'owner1_last_name', 'owner1_full_name',
+        'owner2_first_name', 'owner2_last_name', 'owner2_full_name', 'email',
+        'phone1', 'phone2', 'phone3', 'phone4', 'city', 'state', 'zip_code',
+        'developer_name', 'purchase_date', 'deed_type', 'status', 'created_at', 'updated_at'
+    )
     
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None, include=RELATIONSHIPS):
+        result = {
             'id': self.id,
             'owner1_first_name': self.owner1_first_name,
             'owner1_last_name': self.owner1_last_name,
@@ -68,15 +81,20 @@ class Lead(db.Model):
             'deed_type': self.deed_type,
             'status': self.status,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'notes': [note.to_dict() for note in self.notes]
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+        if fields is not None:
+            result = {key: result[key] for key in fields}
+        # List endpoints eager-load notes so this does not lazy-load per lead
+        if 'notes' in include:
+            result['notes'] = [note.to_dict() for note in self.notes]
+        return result
 
 class Note(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=False)
+    lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=False, index=True)
     
     def to_dict(self):
         return {
@@ -0,0 +1,50 @@
+from sqlalchemy.orm import selectinload
+from models import Lead
+
+
+class FieldsetError(ValueError):
+    """
+    Raised when ?fields= or ?include= names something Lead cannot serialize
+    """
+
+
+def _split(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def parse_fieldset(args):
+    """
+    Read the sparse fieldset parameters from a request's query args.
+
+    ?fields=id,first_name,status limits the scalar keys in each lead, and
+    ?include=notes picks the embedded relationships (an empty value
+    embeds none). Without ?include= every relationship is embedded, as before.
+
+    Returns a (fields, include) tuple suitable for Lead.to_dict().
+    """
+    fields = None
+    if args.get('fields'):
+        fields = _split(args['fields'])
+        unknown = [f for f in fields if f not in Lead.SERIALIZABLE_FIELDS]
+        if unknown:
+            raise FieldsetError(f"Unknown fields: {', '.join(unknown)}")
+
+    include = Lead.RELATIONSHIPS
+    if 'include' in args:
+        include = tuple(_split(args['include']))
+        unknown = [r for r in include if r not in Lead.RELATIONSHIPS]
+        if unknown:
+            raise FieldsetError(f"Unknown relationships: {', '.join(unknown)}")
+
+    return fields, include
+
+
+def eager_load(query, include):
+    """
+    Batch-load the included relationships with one IN query each instead of
+    one lazy load per lead
+    """
+    options = [selectinload(getattr(Lead, name)) for name in include]
+    if options:
+        query = query.options(*options)
+    return query
@@ -0,0 +1,23 @@
+import pytest
+from backend.app import create_app, db
+from backend.migrations import create_schema
+
+
+@pytest.fixture
+def app(tmp_path):
+    """
+    An app over a new SQLite database with every migration applied
+    """
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'leads.db'}",
+        'SLOW_QUERY_ENABLED': False,
+    })
+    with app.app_context():
+        create_schema()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
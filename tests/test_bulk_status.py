@@ -0,0 +1,66 @@
+"""
+PATCH /api/leads/bulk moves leads selected by ids and/or a filter with
+set-based UPDATEs, and rejects malformed requests with a 400.
+"""
+from datetime import datetime
+import pytest
+from sqlalchemy import select
+from backend.app import db
+from backend.benchmarks.generator import generate
+from backend.models import Lead, LeadTag, Tag
+
+
+def statuses():
+    return dict(db.session.execute(select(Lead.id, Lead.status)).all())
+
+
+def test_bulk_update_by_filter(app, client):
+    generate(db, 200, tag_rate=0.5)
+    before = statuses()
+    golf = db.session.execute(select(Tag.id).where(Tag.name == 'golf')).scalar_one()
+    tagged = set(db.session.execute(select(LeadTag.lead_id).where(LeadTag.tag_id == golf)).scalars())
+    expected = sorted(lead_id for lead_id, status in before.items() if status == 'NEW' and lead_id in tagged)
+
+    response = client.patch('/api/leads/bulk', json={'status': 'sent', 'filter': {'status': 'NEW', 'tag': 'golf'}})
+
+    assert response.status_code == 200
+    assert response.get_json()['data'] == {'count': len(expected), 'ids': expected}
+    after = statuses()
+    assert after == {lead_id: 'SENT' if lead_id in expected else status for lead_id, status in before.items()}
+
+
+def test_bulk_update_by_ids_within_filter(app, client):
+    generate(db, 50)
+    before = statuses()
+    ids = list(range(1, 31)) + [999]
+    expected = sorted(lead_id for lead_id in range(1, 31) if before[lead_id] in ('NEW', 'SENT'))
+    started = datetime.utcnow()
+
+    response = client.patch('/api/leads/bulk', json={
+        'status': 'REPLIED', 'ids': ids, 'filter': {'status': ['NEW', 'SENT']}
+    })
+
+    assert response.status_code == 200
+    assert response.get_json()['data']['ids'] == expected
+    lead = db.session.get(Lead, expected[0])
+    assert lead.status == 'REPLIED'
+    assert lead.updated_at >= started
+
+
+@pytest.mark.parametrize('body', [
+    {'status': 'LOST', 'ids': [1]},
+    {'status': 'SENT'},
+    {'status': 'SENT', 'ids': 'all'},
+    {'status': 'SENT', 'filter': {'status': 5}},
+    {'status': 'SENT', 'filter': {'status': 'ARCHIVED'}},
+    {'status': 'SENT', 'filter': {'owner': 'me'}},
+])
+def test_bulk_update_rejects_bad_requests(app, client, body):
+    generate(db, 5)
+    before = statuses()
+
+    response = client.patch('/api/leads/bulk', json=body)
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+    assert statuses() == before
@@ -0,0 +1,85 @@
+"""
+GET /api/leads/changes returns every lead written since a token, and
+tombstones for the ones deleted, paging through large deltas.
+"""
+from sqlalchemy import delete
+from backend.app import db
+from backend.benchmarks.generator import generate
+from backend.changes import prune_tombstones
+from backend.models import Lead
+
+
+def sync(client, since=None, limit=100):
+    """
+    Follow next_token until has_more is false; returns (changed ids,
+    deleted ids, token to poll with)
+    """
+    changed, deleted = [], []
+    while True:
+        query_string = {'limit': limit, 'include': ''}
+        if since:
+            query_string['since'] = since
+        response = client.get('/api/leads/changes', query_string=query_string)
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        changed += [lead['id'] for lead in body['data']['changed']]
+        deleted += body['data']['deleted']
+        since = body['next_token']
+        if not body['has_more']:
+            return changed, deleted, since
+
+
+def test_full_sync_then_nothing_changed(app, client):
+    generate(db, 250)
+
+    changed, deleted, token = sync(client, limit=40)
+
+    assert sorted(changed) == list(range(1, 251))
+    assert len(changed) == len(set(changed))
+    assert deleted == []
+    assert sync(client, token) == ([], [], token)
+
+
+def test_changes_since_token(app, client):
+    generate(db, 100)
+    _, _, token = sync(client)
+
+    assert client.patch('/api/leads/5', json={'status': 'BOOKED'}).status_code == 200
+    assert client.patch('/api/leads/bulk', json={'status': 'SENT', 'ids': [10, 11, 12]}).status_code == 200
+    assert client.post('/api/notes/20', json={'content': 'Called back'}).status_code == 201
+    assert client.post('/api/leads/tags', json={'add': ['vip'], 'ids': [30]}).status_code == 200
+    created = client.post('/api/leads', json={
+        'first_name': 'Zed', 'last_name': 'Quinn', 'email': 'zed@example.com', 'phone_1': '4175559999'
+    }).get_json()['data']['id']
+    db.session.execute(delete(Lead).where(Lead.id.in_([40, 41])))
+    db.session.commit()
+
+    changed, deleted, token = sync(client, token, limit=2)
+
+    assert sorted(changed) == [5, 10, 11, 12, 20, 30, created]
+    assert deleted == [40, 41]
+    assert sync(client, token) == ([], [], token)
+
+
+def test_lead_changed_and_deleted_is_only_a_tombstone(app, client):
+    generate(db, 10)
+    _, _, token = sync(client)
+
+    assert client.patch('/api/leads/3', json={'status': 'SENT'}).status_code == 200
+    db.session.execute(delete(Lead).where(Lead.id == 3))
+    db.session.commit()
+
+    assert sync(client, token)[:2] == ([], [3])
+
+
+def test_token_older_than_pruned_tombstones_expires(app, client):
+    generate(db, 10)
+    _, _, token = sync(client)
+    db.session.execute(delete(Lead).where(Lead.id == 2))
+    db.session.commit()
+
+    assert prune_tombstones(retention_days=-1) == 1
+
+    response = client.get('/api/leads/changes', query_string={'since': token})
+    assert response.status_code == 410
+    assert client.get('/api/leads/changes', query_string={'since': 'garbage'}).status_code == 400
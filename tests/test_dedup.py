@@ -0,0 +1,118 @@
+"""
+Duplicate detection compares only leads sharing a blocking key, finds
+the same pairs incrementally as the batch rebuild does, and merging
+folds one lead into another.
+"""
+import json
+from sqlalchemy import select
+from backend.app import db
+from backend.dedup import find_duplicates
+from backend.models import Lead, LeadDuplicate, LeadTag, Note, Tag
+
+OWNERS = [
+    # Same owner, different email and phone formatting
+    {'first_name': 'Ana', 'last_name': 'Lopez', 'email': 'ana.lopez@example.com',
+     'phone_1': '(417) 555-0101', 'zip': '65801', 'address': '1 Main St'},
+    {'first_name': 'Ana', 'last_name': 'Lopez', 'email': 'analopez+promo@mail.test',
+     'phone_1': '+1 417 555 0101', 'zip': '65801-1234', 'address': '1 Main St'},
+    # Shares only a last name and zip with Bob
+    {'first_name': 'Bea', 'last_name': 'Smith', 'email': 'bea@example.com',
+     'phone_1': '4175550202', 'zip': '65802'},
+    {'first_name': 'Bob', 'last_name': 'Smith', 'email': 'rsmith@example.com',
+     'phone_1': '4175550303', 'zip': '65802'},
+    # Unrelated
+    {'first_name': 'Cy', 'last_name': 'Young', 'email': 'cy@example.com', 'phone_1': '4175550404', 'zip': '10001'},
+]
+
+
+def pairs():
+    return {
+        (pair.lead_id, pair.duplicate_id): (pair.score, sorted(pair.reasons))
+        for pair in db.session.execute(select(LeadDuplicate)).scalars()
+    }
+
+
+def create(client, owner):
+    response = client.post('/api/leads', json=owner)
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()
+
+
+def import_owners(client, owners):
+    """
+    Import leads, which unlike POST /api/leads keeps zip and address
+    """
+    response = client.post('/api/leads/import', data='\n'.join(json.dumps(owner) for owner in owners),
+                           content_type='application/x-ndjson')
+    assert response.status_code == 200, response.get_json()
+    data = response.get_json()['data']
+    assert data['inserted'] == len(owners), data
+    return data
+
+
+def test_duplicates_found_on_create(app, client):
+    first = create(client, OWNERS[0])
+    second = create(client, OWNERS[1])
+
+    assert (first['possible_duplicates'], second['possible_duplicates']) == (0, 1)
+    pair = (first['data']['id'], second['data']['id'])
+    assert pairs() == {pair: (1.0, ['email_local', 'first_name', 'phone'])}
+
+
+def test_duplicates_found_on_import(app, client):
+    data = import_owners(client, OWNERS)
+
+    assert data['possible_duplicates'] == 1
+    assert pairs() == {(1, 2): (1.0, ['address', 'email_local', 'first_name', 'name_zip', 'phone'])}
+
+
+def test_batch_rebuild_matches_incremental_detection(app, client):
+    import_owners(client, OWNERS[:3])
+    import_owners(client, OWNERS[3:])
+    incremental = pairs()
+
+    stats = find_duplicates()
+
+    assert pairs() == incremental
+    assert stats['duplicates'] == len(incremental)
+    # Ana twice; Bea and Bob only share name_zip (0.3) plus an initial (0.1)
+    assert list(incremental) == [(1, 2)]
+    assert find_duplicates(threshold=0.4)['duplicates'] == 2
+
+
+def test_oversized_blocks_are_skipped(app, client):
+    import_owners(client, [
+        {'first_name': f'Switch{n}', 'last_name': f'Board{n}', 'email': f'desk{n}@example.com', 'phone_1': '4175550999'}
+        for n in range(6)
+    ])
+
+    assert find_duplicates(max_block_size=5)['candidates'] == 0
+    assert find_duplicates(max_block_size=6)['candidates'] == 15
+
+
+def test_merge_moves_notes_and_tags_and_fills_blanks(app, client):
+    import_owners(client, [{**OWNERS[0], 'address': None}, {**OWNERS[1], 'phone_2': '212-555-0199'}])
+    keep, duplicate = 1, 2
+    vip, golf = Tag(name='vip'), Tag(name='golf')
+    db.session.add_all([vip, golf, Note(lead_id=keep, content='kept'), Note(lead_id=duplicate, content='moved')])
+    db.session.flush()
+    db.session.add_all([LeadTag(lead_id=keep, tag_id=vip.id), LeadTag(lead_id=duplicate, tag_id=vip.id),
+                        LeadTag(lead_id=duplicate, tag_id=golf.id)])
+    db.session.commit()
+
+    response = client.post(f'/api/leads/{keep}/merge', json={'duplicate_id': duplicate})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['moved_notes'], body['moved_tags']) == (1, 1)
+    db.session.expire_all()
+    assert db.session.get(Lead, duplicate) is None
+    lead = db.session.get(Lead, keep)
+    assert lead.address == '1 Main St'
+    assert lead.phone_2 == '212-555-0199'
+    assert sorted(note.content for note in lead.notes) == ['kept', 'moved']
+    assert sorted(tag.name for tag in lead.tags) == ['golf', 'vip']
+    assert lead.notes_count == 2
+    assert pairs() == {}
+
+    assert client.post(f'/api/leads/{keep}/merge', json={'duplicate_id': keep}).status_code == 400
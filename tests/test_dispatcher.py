@@ -0,0 +1,97 @@
+"""
+Campaign dispatch: recipients come from the campaign's filter, every
+message is sent once even when several dispatchers run the campaign at
+the same time, and sent leads are stamped.
+"""
+import threading
+from collections import Counter
+import pytest
+from sqlalchemy import select
+from backend.app import db
+from backend.benchmarks.generator import generate
+from backend.dispatcher import Dispatcher, DispatchError, SmsProvider, campaign_progress, create_campaign
+from backend.models import CampaignMessage, Lead
+
+
+class CountingProvider(SmsProvider):
+    """
+    Records every call, unlike the stub, which hides repeats behind the
+    idempotency key
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def send(self, from_number, to_number, body, idempotency_key):
+        with self._lock:
+            self.calls[idempotency_key] += 1
+        return f'counted-{idempotency_key}'
+
+
+@pytest.fixture
+def dispatcher_for(app):
+    app.config.update({
+        'DISPATCH_RATE': 100000.0,
+        'DISPATCH_RATE_BACKEND': 'local',
+        'DISPATCH_BATCH_SIZE': 7,
+        'DISPATCH_CONCURRENCY': 4,
+    })
+
+    def make(provider):
+        dispatcher = Dispatcher(app)
+        dispatcher.provider = provider
+        return dispatcher
+
+    return make
+
+
+def test_racing_dispatchers_send_each_message_once(app, dispatcher_for):
+    generate(db, 300)
+    campaign, recipients = create_campaign('wave', 'Hi $first_name from $resort', {'status': ['NEW', 'SENT']})
+    db.session.commit()
+    provider = CountingProvider()
+    dispatchers = [dispatcher_for(provider) for _ in range(3)]
+
+    threads = [threading.Thread(target=dispatcher.run, args=(campaign.id,)) for dispatcher in dispatchers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for dispatcher in dispatchers:
+        assert dispatcher.runs[campaign.id].error is None
+    assert set(provider.calls.values()) == {1}
+    message_ids = db.session.execute(
+        select(CampaignMessage.id).where(CampaignMessage.campaign_id == campaign.id)
+    ).scalars().all()
+    assert set(provider.calls) == {f'campaign-message-{message_id}' for message_id in message_ids}
+    assert campaign_progress(campaign.id) == {'pending': 0, 'claimed': 0, 'sent': recipients, 'failed': 0}
+    assert sum(dispatcher.runs[campaign.id].sent for dispatcher in dispatchers) == recipients
+
+
+def test_sent_leads_are_stamped(app, dispatcher_for):
+    generate(db, 40)
+    targeted = db.session.execute(select(Lead.id).where(Lead.status == 'NEW')).scalars().all()
+    campaign, recipients = create_campaign('wave', 'Hi $first_name', {'status': 'NEW'})
+    db.session.commit()
+
+    run = dispatcher_for(CountingProvider()).run(campaign.id)
+
+    assert (run.error, run.sent, recipients) == (None, len(targeted), len(targeted))
+    db.session.expire_all()
+    for lead_id in targeted:
+        lead = db.session.get(Lead, lead_id)
+        assert lead.status == 'SENT'
+        assert lead.last_text_content == f'Hi {lead.first_name}'
+        assert lead.last_text_sent is not None
+
+
+@pytest.mark.parametrize('name, template, filter_spec', [
+    ('', 'Hi', {'status': 'NEW'}),
+    ('wave', 'Hi $phone_1', {'status': 'NEW'}),
+    ('wave', 'Hi', {}),
+])
+def test_invalid_campaigns_are_rejected(app, name, template, filter_spec):
+    with pytest.raises(DispatchError):
+        create_campaign(name, template, filter_spec)
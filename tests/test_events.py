@@ -0,0 +1,61 @@
+"""
+Status moves made in bulk, by inbound SMS replies and by the campaign
+dispatcher are published once committed, as one statuses-changed event
+per batch.
+"""
+import pytest
+from sqlalchemy import select
+from backend.app import db
+from backend.benchmarks.generator import generate
+from backend.dispatcher import create_campaign
+from backend.models import Lead
+
+
+@pytest.fixture
+def published(app):
+    events = []
+    app.extensions['events'].broker.subscribe(events.append)
+    return events
+
+
+def lead_ids(status):
+    return db.session.execute(select(Lead.id).where(Lead.status == status).order_by(Lead.id)).scalars().all()
+
+
+def statuses_changed(events):
+    return [event.data for event in events if event.type == 'statuses-changed']
+
+
+def test_bulk_status_change_is_published(app, client, published):
+    generate(db, 30)
+    new = lead_ids('NEW')
+
+    response = client.patch('/api/leads/bulk', json={'status': 'booked', 'filter': {'status': 'NEW'}})
+
+    assert response.status_code == 200
+    assert statuses_changed(published) == [{'to': 'BOOKED', 'lead_ids': new}]
+
+
+def test_sms_reply_promotion_is_published(app, client, published):
+    generate(db, 30)
+    lead = db.session.get(Lead, lead_ids('NEW')[0])
+
+    response = client.post('/api/webhooks/sms/inbound', query_string={'provider': 'fake'},
+                           json={'from': lead.phone_1, 'body': 'yes', 'timestamp': '2024-03-01T12:00:00Z'})
+    assert response.status_code == 202
+    app.extensions['sms_inbound'].stop()
+
+    assert statuses_changed(published) == [{'to': 'REPLIED', 'lead_ids': [lead.id]}]
+
+
+def test_dispatcher_promotion_is_published(app, published):
+    generate(db, 30)
+    new = lead_ids('NEW')
+    campaign, _ = create_campaign('spring', 'Hi $first_name', {'status': ['NEW', 'SENT']})
+    db.session.commit()
+
+    run = app.extensions['dispatcher'].run(campaign.id)
+
+    assert run.error is None
+    assert [lead_id for event in statuses_changed(published) for lead_id in event['lead_ids']] == new
+    assert all(event['to'] == 'SENT' for event in statuses_changed(published))
@@ -0,0 +1,107 @@
+"""
+The funnel counters kept by triggers (and by bulk status changes) always
+match a GROUP BY over the leads, whatever mix of writes got them there.
+"""
+import pytest
+from sqlalchemy import delete, func, select, update
+from backend.app import db
+from backend.benchmarks.generator import generate
+from backend.funnel import funnel_counts, rebuild_funnel_counts, tag_counts
+from backend.models import LEAD_STATUSES, Lead, LeadTag, Tag
+
+
+def grouped(*columns, joins=()):
+    query = select(*columns, Lead.status, func.count()).select_from(Lead)
+    for target, on in joins:
+        query = query.join(target, on)
+    return db.session.execute(query.group_by(*columns, Lead.status)).all()
+
+
+def expected_funnel(by=None):
+    overall = dict.fromkeys(LEAD_STATUSES, 0)
+    overall.update({status: count for status, count in grouped()})
+    expected = {'statuses': overall, 'total': sum(overall.values())}
+    if by == 'resort':
+        rows = grouped(Lead.resort)
+    elif by == 'tag':
+        rows = grouped(Tag.name, joins=[(LeadTag, LeadTag.lead_id == Lead.id), (Tag, Tag.id == LeadTag.tag_id)])
+    else:
+        return expected
+    breakdown = {}
+    for value, status, count in rows:
+        breakdown.setdefault(value, dict.fromkeys(LEAD_STATUSES, 0))[status] = count
+    expected['breakdown'] = breakdown
+    return expected
+
+
+def actual_funnel(by=None):
+    counts = funnel_counts(by)
+    actual = {'statuses': counts['statuses'], 'total': counts['total']}
+    if by:
+        actual['breakdown'] = {entry['value']: entry['statuses'] for entry in counts['breakdown']}
+    return actual
+
+
+def assert_counts_match():
+    for by in (None, 'resort', 'tag'):
+        assert actual_funnel(by) == expected_funnel(by), by
+    counted = {tag['name']: tag['lead_count'] for tag in tag_counts()}
+    expected = dict.fromkeys(db.session.execute(select(Tag.name)).scalars(), 0)
+    expected.update(db.session.execute(
+        select(Tag.name, func.count())
+        .join(LeadTag, LeadTag.tag_id == Tag.id).join(Lead, Lead.id == LeadTag.lead_id)
+        .group_by(Tag.name)
+    ).all())
+    assert counted == expected
+
+
+@pytest.fixture
+def leads(app):
+    generate(db, 300, tag_rate=0.6)
+    db.session.commit()
+    assert_counts_match()
+
+
+def test_counts_follow_bulk_status_changes(leads, client):
+    for body in (
+        {'status': 'SENT', 'filter': {'status': 'NEW', 'tag': 'golf'}},
+        {'status': 'REPLIED', 'ids': list(range(1, 150, 3))},
+        {'status': 'BOOKED', 'filter': {'status': ['SENT', 'REPLIED'], 'zip_prefix': '1'}},
+    ):
+        assert client.patch('/api/leads/bulk', json=body).status_code == 200
+        assert_counts_match()
+
+
+def test_counts_follow_single_lead_and_tag_writes(leads, client):
+    assert client.patch('/api/leads/7', json={'status': 'BOOKED', 'resort': 'Harbor'}).status_code == 200
+    assert client.post('/api/leads/tags', json={'add': ['vip', 'new-tag'], 'filter': {'status': 'BOOKED'}}).status_code == 200
+    assert client.post('/api/leads/tags', json={'remove': ['golf'], 'ids': list(range(1, 100))}).status_code == 200
+    assert client.post('/api/leads', json={
+        'first_name': 'Zed', 'last_name': 'Quinn', 'email': 'zed@example.com',
+        'phone_1': '4175559999', 'status': 'SENT', 'resort': 'Pines'
+    }).status_code == 201
+    assert_counts_match()
+
+
+def test_counts_follow_deletes(leads):
+    # Leads 81-120 still have tags when they go
+    db.session.execute(delete(LeadTag).where(LeadTag.lead_id.between(1, 40)))
+    db.session.execute(delete(LeadTag).where(LeadTag.lead_id.between(60, 80)))
+    db.session.execute(delete(Lead).where(Lead.id.between(60, 120)))
+    db.session.execute(update(Lead).where(Lead.id.between(200, 250)).values(resort=None, status='SENT'))
+    db.session.commit()
+    assert_counts_match()
+
+
+def test_rebuild_matches_maintained_counts(leads, client):
+    assert client.patch('/api/leads/bulk', json={'status': 'SENT', 'ids': list(range(1, 300, 2))}).status_code == 200
+    maintained = [funnel_counts(by) for by in (None, 'resort', 'tag')]
+
+    rebuild_funnel_counts()
+
+    assert [funnel_counts(by) for by in (None, 'resort', 'tag')] == maintained
+
+
+def test_funnel_endpoint_rejects_unknown_breakdown(leads, client):
+    assert client.get('/api/stats/funnel', query_string={'by': 'tag'}).status_code == 200
+    assert client.get('/api/stats/funnel', query_string={'by': 'state'}).status_code == 400
@@ -0,0 +1,66 @@
+"""
+POST /api/leads/import streams CSV and NDJSON uploads in batches,
+reports rejected rows by line number and indexes what it inserts.
+"""
+import io
+import json
+from sqlalchemy import func, select
+from backend.app import db
+from backend.models import Lead
+from backend.phones import find_lead_ids_by_phone, normalize_phone
+
+CSV_UPLOAD = """first_name,last_name,email,status,phone_1,mortgaged
+Ana,Lopez,ana@example.com,new,(417) 555-0101,yes
+Bob,Smith,bob@example.com,SENT,417-555-0102,no
+Eve,,eve@example.com,NEW,417-555-0103,
+Dev,Patel,dev@example.com,LOST,417-555-0104,
+Ana,Lopez,ana@example.com,NEW,417-555-0105,
+Finn,Ward,finn@example.com,,,
+"""
+
+
+def test_csv_import_reports_bad_rows_by_line(app, client):
+    db.session.add(Lead(first_name='Finn', last_name='Ward', email='finn@example.com', phone_1='4175550199'))
+    db.session.commit()
+
+    response = client.post(
+        '/api/leads/import', query_string={'format': 'csv', 'batch_size': 2},
+        data={'file': (io.BytesIO(CSV_UPLOAD.encode('utf-8')), 'leads.csv')}
+    )
+
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert (data['inserted'], data['failed']) == (2, 4)
+    assert {error['row']: error['errors'] for error in data['errors']} == {
+        4: ['Missing required field: last_name'],
+        5: ['Invalid status: LOST'],
+        6: ['Duplicate email: ana@example.com'],
+        7: ['Duplicate email: finn@example.com'],
+    }
+
+    ana = db.session.execute(select(Lead).where(Lead.email == 'ana@example.com')).scalar_one()
+    assert (ana.status, ana.mortgaged) == ('NEW', True)
+    assert find_lead_ids_by_phone(normalize_phone('(417) 555-0101')) == [ana.id]
+    assert db.session.execute(select(func.count()).select_from(Lead)).scalar() == 3
+
+
+def test_ndjson_import_from_raw_body(app, client):
+    lines = [json.dumps({'first_name': 'Lead', 'last_name': str(n), 'email': f'lead{n}@example.com'}) for n in range(25)]
+    lines.insert(3, '{not json')
+    lines.insert(7, '[1, 2]')
+
+    response = client.post('/api/leads/import', query_string={'batch_size': 10},
+                           data='\n'.join(lines), content_type='application/x-ndjson')
+
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert (data['inserted'], data['failed']) == (25, 2)
+    assert [error['row'] for error in data['errors']] == [4, 8]
+    assert db.session.execute(select(func.count()).select_from(Lead)).scalar() == 25
+
+
+def test_import_rejects_unknown_format(app, client):
+    response = client.post('/api/leads/import', query_string={'format': 'xml'}, data='<leads/>')
+
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
@@ -0,0 +1,59 @@
+"""
+GET /api/leads runs a fixed number of statements per page, whatever the
+page size and however many notes and tags the leads carry: the version
+read, the page query, and one batch query per included relationship.
+"""
+import pytest
+from sqlalchemy import event
+from backend.app import create_app, db
+from backend.benchmarks.generator import generate
+from backend.migrations import create_schema
+
+LEADS = 1000
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    database = tmp_path_factory.mktemp('leads') / 'leads.db'
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}',
+        'SLOW_QUERY_ENABLED': False,
+    })
+    with app.app_context():
+        create_schema()
+        generate(db, LEADS, notes_per_lead=3, tag_rate=0.5)
+    return app
+
+
+@pytest.fixture
+def statements(app):
+    executed = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', count)
+
+
+@pytest.mark.parametrize('include, relationships', [
+    (None, 2),  # Lead.DEFAULT_INCLUDE: tags and latest_note
+    ('', 0),
+    ('notes', 1),
+    ('tags', 1),
+    ('notes,tags,latest_note', 3),
+])
+@pytest.mark.parametrize('limit', [10, LEADS])
+def test_lead_list_statement_count(app, statements, include, relationships, limit):
+    query_string = {'limit': limit}
+    if include is not None:
+        query_string['include'] = include
+
+    response = app.test_client().get('/api/leads', query_string=query_string)
+
+    assert response.status_code == 200
+    assert len(response.get_json()['data']) == limit
+    assert len(statements) == 2 + relationships, statements
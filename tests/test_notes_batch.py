@@ -0,0 +1,46 @@
+"""
+POST /api/notes/batch writes valid notes in a couple of statements and
+reports each one against the request item it came from.
+"""
+from sqlalchemy import event
+from backend.app import db
+from backend.benchmarks.generator import generate
+from backend.models import Lead, Note
+
+
+def test_notes_batch_results_match_request_order(app, client):
+    generate(db, 20, notes_per_lead=0)
+    items = [
+        {'lead_id': 3, 'content': 'first'},
+        {'lead_id': 999, 'content': 'no such lead'},
+        {'lead_id': 3, 'content': 'second'},
+        {'lead_id': 1, 'content': ''},
+        {'lead_id': 17, 'content': 'third'},
+        {'lead_id': 1, 'content': 'fourth'},
+    ]
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT'):
+            statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        response = client.post('/api/notes/batch', json={'notes': items})
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert (data['created'], data['failed']) == (4, 2)
+    results = data['results']
+    assert [result['success'] for result in results] == [True, False, True, False, True, True]
+    for item, result in zip(items, results):
+        if result['success']:
+            assert result['note']['lead_id'] == item['lead_id']
+            assert result['note']['content'] == item['content']
+            stored = db.session.get(Note, result['note']['id'])
+            assert (stored.lead_id, stored.content) == (item['lead_id'], item['content'])
+    assert len(statements) == 1, statements
+
+    assert db.session.get(Lead, 3).notes_count == 2
@@ -0,0 +1,48 @@
+"""
+GET /api/leads/search pages through every matching lead exactly once,
+and says when a query matches more than the search ranks.
+"""
+from backend import search
+from backend.app import db
+from backend.benchmarks.generator import generate
+
+LEADS = 300
+
+
+def search_pages(client, q, limit):
+    pages = []
+    query_string = {'q': q, 'limit': limit, 'include': ''}
+    while True:
+        response = client.get('/api/leads/search', query_string=query_string)
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        pages.append(body)
+        if not body['next_cursor']:
+            return pages
+        query_string['cursor'] = body['next_cursor']
+
+
+def test_search_pages_return_each_lead_once(app, client):
+    generate(db, LEADS, notes_per_lead=2)
+
+    # Every note starts with "Call", so every lead matches, mostly on
+    # tied scores
+    pages = search_pages(client, 'call', limit=7)
+    ids = [lead['id'] for page in pages for lead in page['data']]
+
+    assert len(ids) == len(set(ids))
+    assert set(ids) == set(range(1, LEADS + 1))
+    scores = [lead['score'] for page in pages for lead in page['data']]
+    assert scores == sorted(scores, reverse=True)
+    assert not any(page['truncated'] for page in pages)
+
+
+def test_search_flags_truncated_results(app, client, monkeypatch):
+    generate(db, 50, notes_per_lead=1)
+    monkeypatch.setattr(search, 'MAX_CANDIDATES', 20)
+
+    pages = search_pages(client, 'call', limit=10)
+
+    assert sum(len(page['data']) for page in pages) == 20
+    assert pages[-1]['truncated'] is True
+    assert not any(page['truncated'] for page in pages[:-1])
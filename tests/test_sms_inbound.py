@@ -0,0 +1,67 @@
+"""
+Inbound SMS replies are applied in batches: offsets are normalized to
+UTC, an older reply never replaces a newer one, and a batch that fails
+to commit is retried before it is dropped.
+"""
+from datetime import datetime
+from backend.app import db
+from backend.benchmarks.generator import generate
+from backend.models import Lead
+
+
+def reply(client, phone, body, timestamp):
+    response = client.post('/api/webhooks/sms/inbound', query_string={'provider': 'fake'},
+                           json={'from': phone, 'body': body, 'timestamp': timestamp})
+    assert response.status_code == 202, response.get_json()
+
+
+def test_reply_timestamps_are_stored_as_utc(app, client):
+    generate(db, 5)
+    lead = db.session.get(Lead, 1)
+
+    reply(client, lead.phone_1, 'yes', '2024-03-01T09:00:00-05:00')
+    app.extensions['sms_inbound'].stop()
+
+    db.session.expire_all()
+    assert lead.response_timestamp == datetime(2024, 3, 1, 14, 0)
+    assert lead.status == 'REPLIED'
+
+
+def test_older_reply_does_not_replace_newer(app, client):
+    generate(db, 5)
+    lead = db.session.get(Lead, 2)
+    processor = app.extensions['sms_inbound']
+
+    reply(client, lead.phone_1, 'newer', '2024-03-01T12:00:00Z')
+    processor.stop()
+    reply(client, lead.phone_1, 'older', '2024-03-01T11:00:00Z')
+    processor.stop()
+
+    db.session.expire_all()
+    assert lead.last_response == 'newer'
+    assert lead.response_timestamp == datetime(2024, 3, 1, 12, 0)
+
+
+def test_failed_batch_is_retried(app, client, monkeypatch):
+    generate(db, 5)
+    lead = db.session.get(Lead, 3)
+    processor = app.extensions['sms_inbound']
+    processor.retry_delay = 0
+    apply_batch = processor._apply_batch
+    calls = []
+
+    def flaky(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError('database is locked')
+        return apply_batch(batch)
+
+    monkeypatch.setattr(processor, '_apply_batch', flaky)
+    reply(client, lead.phone_1, 'retried', '2024-03-01T12:00:00Z')
+    processor.stop()
+
+    db.session.expire_all()
+    assert len(calls) == 2
+    assert lead.last_response == 'retried'
+    stats = processor.stats()
+    assert (stats['applied'], stats['retried'], stats['failed']) == (1, 1, 0)
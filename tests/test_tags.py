@@ -0,0 +1,95 @@
+"""
+Tag filters on GET /api/leads (any / all), bulk tag edits and the
+per-tag lead counts of GET /api/tags.
+"""
+from collections import defaultdict
+import pytest
+from sqlalchemy import select
+from backend.app import db
+from backend.benchmarks.generator import generate
+from backend.models import LeadTag, Tag
+
+
+def tags_by_lead():
+    tagged = defaultdict(set)
+    for lead_id, name in db.session.execute(select(LeadTag.lead_id, Tag.name).join(Tag, Tag.id == LeadTag.tag_id)):
+        tagged[lead_id].add(name)
+    return tagged
+
+
+def listed_ids(client, **query_string):
+    ids, query_string = [], {'limit': 50, 'include': '', **query_string}
+    while True:
+        response = client.get('/api/leads', query_string=query_string)
+        assert response.status_code == 200, response.get_json()
+        body = response.get_json()
+        ids += [lead['id'] for lead in body['data']]
+        if not body['next_cursor']:
+            return ids
+        query_string['cursor'] = body['next_cursor']
+
+
+@pytest.fixture
+def tagged(app, client):
+    generate(db, 200, tag_rate=1.0)
+    # Give a spread of leads a second and third tag
+    assert client.post('/api/leads/tags', json={'add': ['ski', 'vip'], 'ids': list(range(1, 200, 3))}).status_code == 200
+    return tags_by_lead()
+
+
+def test_tag_filter_any_and_all(tagged, client):
+    wanted = {'ski', 'vip'}
+
+    assert listed_ids(client, tag=['ski', 'vip']) == sorted(lead for lead, names in tagged.items() if names & wanted)
+    assert listed_ids(client, tag=['ski', 'vip'], tag_mode='all') == sorted(
+        lead for lead, names in tagged.items() if wanted <= names
+    )
+    assert listed_ids(client, tag='vip', status='NEW') == listed_ids(client, tag=['vip'], tag_mode='all', status='NEW')
+    assert client.get('/api/leads', query_string={'tag': 'vip', 'tag_mode': 'some'}).status_code == 400
+
+
+def test_bulk_tag_edits(tagged, client):
+    response = client.post('/api/leads/tags', json={'add': ['callback'], 'remove': ['vip'], 'ids': [1, 2, 3, 4]})
+
+    assert response.status_code == 200
+    after = tags_by_lead()
+    expected_added = sum('callback' not in tagged[lead] for lead in (1, 2, 3, 4))
+    expected_removed = sum('vip' in tagged[lead] for lead in (1, 2, 3, 4))
+    assert response.get_json()['data'] == {'added': expected_added, 'removed': expected_removed}
+    for lead in (1, 2, 3, 4):
+        assert after[lead] == (tagged[lead] - {'vip'}) | {'callback'}
+    assert {lead: names for lead, names in after.items() if lead > 4} == {
+        lead: names for lead, names in tagged.items() if lead > 4
+    }
+
+    # Adding again changes nothing
+    again = client.post('/api/leads/tags', json={'add': ['callback'], 'ids': [1, 2, 3, 4]})
+    assert again.get_json()['data'] == {'added': 0, 'removed': 0}
+
+
+@pytest.mark.parametrize('body', [
+    {'ids': [1]},
+    {'add': ['vip'], 'remove': ['vip'], 'ids': [1]},
+    {'add': 'vip', 'ids': [1]},
+    {'add': ['x' * 101], 'ids': [1]},
+    {'add': ['vip']},
+])
+def test_bulk_tag_edits_reject_bad_requests(tagged, client, body):
+    assert client.post('/api/leads/tags', json=body).status_code == 400
+    assert tags_by_lead() == tagged
+
+
+def test_tag_counts(tagged, client):
+    assert client.post('/api/leads/tags', json={'add': ['brand-new'], 'ids': [5, 6]}).status_code == 200
+
+    response = client.get('/api/tags')
+
+    assert response.status_code == 200
+    counts = {tag['name']: tag['lead_count'] for tag in response.get_json()['data']}
+    expected = defaultdict(int)
+    for names in tags_by_lead().values():
+        for name in names:
+            expected[name] += 1
+    assert counts == {name: expected[name] for name in counts}
+    assert counts['brand-new'] == 2
+    assert set(counts) == set(db.session.execute(select(Tag.name)).scalars())